@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+# =============================
+#   Коды статусов событий APB
+# =============================
+
+# Успешные операции
+STATUS_SUCCESS_ENTRY = "SUCCESS_ENTRY"  # Успешный вход (outside -> inside)
+STATUS_SUCCESS_EXIT = "SUCCESS_EXIT"  # Успешный выход (inside -> outside)
+STATUS_ALLOWED_TIME_WINDOW = "ALLOWED_TIME_WINDOW"  # Разрешен вход в пределах временного окна
+
+# Нарушения APB (is_violation = TRUE)
+STATUS_DENIED_ALREADY_INSIDE = "DENIED_ALREADY_INSIDE"  # Запрещен вход - уже внутри (нарушение)
+STATUS_DENIED_OUTSIDE_WINDOW = "DENIED_OUTSIDE_WINDOW"  # Запрещен вход - вне временного окна (нарушение)
+
+# Предупреждения (не нарушения, но требует внимания)
+STATUS_WARNING_EXIT_WITHOUT_ENTRY = "WARNING_EXIT_WITHOUT_ENTRY"  # Предупреждение - выход без входа
+
+
+def effective_state(user_state, reset_epoch):
+    """
+    Состояние пользователя с учетом эпохи сброса
+
+    Сброс не переписывает user_states: 'inside', записанное до эпохи сброса
+    (last_event_time < reset_epoch), считается 'outside'. Строка в БД
+    исправляется лениво - при следующем событии пользователя или фоновой очисткой.
+    """
+    state = user_state.get('state') or 'outside'
+    if state == 'inside' and reset_epoch is not None:
+        last_event_time = user_state.get('last_event_time')
+        if last_event_time is None or last_event_time < reset_epoch:
+            return 'outside'
+    return state
+
+
+def decide_transition(current_state, last_entry_auth_time, terminal_type, window_seconds, now=None):
+    """
+    Принять решение APB по текущему состоянию пользователя
+
+    Чистая функция без обращений к БД и SDK: используется для авторитетного решения
+    внутри транзакции (Database.apply_transition) и для решения из памяти, когда
+    БД недоступна (main.process_apb_event), поэтому оба пути всегда согласованы.
+
+    Args:
+        current_state: 'inside' | 'outside'
+        last_entry_auth_time: время последней аутентификации на входе ДО события (или None)
+        terminal_type: 'entry' | 'exit'
+        window_seconds: временное окно для повторного входа (секунды)
+        now: момент события (по умолчанию - текущее время)
+
+    Returns:
+        Словарь: action_taken, status_code, is_violation, allow_door, new_state, time_diff
+    """
+    now = now or datetime.now()
+    time_diff = None
+    if last_entry_auth_time:
+        time_diff = (now - last_entry_auth_time).total_seconds()
+
+    decision = {
+        'action_taken': None,
+        'status_code': None,
+        'is_violation': False,
+        'allow_door': False,
+        'new_state': current_state,
+        'time_diff': time_diff,
+    }
+
+    if terminal_type == "entry":
+        within_time_window = time_diff is not None and time_diff < window_seconds
+
+        if current_state == "inside":
+            if within_time_window:
+                # Уже внутри, но в пределах временного окна - разрешаем повторный вход
+                decision['action_taken'] = f"ВХОД РАЗРЕШЕН - временное окно ({window_seconds} сек)"
+                decision['status_code'] = STATUS_ALLOWED_TIME_WINDOW
+                decision['allow_door'] = True
+            else:
+                # Уже внутри и вне временного окна - НАРУШЕНИЕ APB
+                decision['action_taken'] = "ВХОД ЗАПРЕЩЕН - уже внутри"
+                decision['status_code'] = STATUS_DENIED_ALREADY_INSIDE
+                decision['is_violation'] = True
+        else:
+            # Снаружи - разрешаем вход
+            decision['action_taken'] = "ВХОД РАЗРЕШЕН"
+            decision['status_code'] = STATUS_SUCCESS_ENTRY
+            decision['allow_door'] = True
+            decision['new_state'] = "inside"
+
+    elif terminal_type == "exit":
+        if current_state == "inside":
+            # Внутри - разрешаем выход (дверями выхода через SDK не управляем)
+            decision['action_taken'] = "ВЫХОД РАЗРЕШЕН"
+            decision['status_code'] = STATUS_SUCCESS_EXIT
+            decision['new_state'] = "outside"
+        else:
+            # Снаружи пытается выйти - предупреждение (не нарушение)
+            decision['action_taken'] = "ВЫХОД ПРЕДУПРЕЖДЕНИЕ - не числится внутри"
+            decision['status_code'] = STATUS_WARNING_EXIT_WITHOUT_ENTRY
+
+    return decision
+
+
+def apply_decision(user_state, decision, terminal_ip, terminal_type, now):
+    """
+    Применить решение к состоянию пользователя (словарь user_states, изменяется на месте)
+
+    Общее правило для транзакции перехода (Database.apply_transition) и для решения
+    в памяти при недоступной БД (UserStateCache.record_fallback).
+
+    Returns:
+        True, если состояние (state) изменилось
+    """
+    if terminal_type == "entry":
+        # Время аутентификации обновляется даже если вход запрещен (для временного окна)
+        user_state['last_entry_auth_time'] = now
+        user_state['last_terminal'] = terminal_ip
+    if decision['new_state'] == user_state.get('state'):
+        return False
+    user_state['state'] = decision['new_state']
+    user_state['last_terminal'] = terminal_ip
+    user_state['last_event_time'] = now
+    user_state['last_reset_date'] = now.date()
+    return True
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронный сервер APB (asyncio + aiohttp + aiomysql)
+
+Альтернатива встроенному серверу Flask для большого числа одновременных
+подключений терминалов. Маршруты и формат ответов совпадают с main.py:
+/event, /status, /stats, /violations, /violations/stats, /violations/<status_code>, /stream.
+
+Запуск:
+    pip install -r requirements-async.txt
+    python async_server.py
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import os
+import sys
+
+try:
+    import aiomysql
+    from aiohttp import web
+except ImportError:
+    print("❌ Для асинхронного сервера нужны aiohttp и aiomysql")
+    print("ℹ️  Установите: pip install -r requirements-async.txt")
+    sys.exit(1)
+
+from werkzeug.http import http_date
+
+import main
+from db import (
+    db,
+    build_statistics_query,
+    build_violations_query,
+    build_violation_statistics_queries,
+    page_limit,
+    violations_page,
+)
+
+
+def _json_default(value):
+    """Сериализация как у Flask: даты в формате HTTP, Decimal - строкой"""
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_response(payload, status=200):
+    return web.json_response(
+        payload, status=status,
+        dumps=lambda obj: json.dumps(obj, default=_json_default, sort_keys=True)
+    )
+
+
+class AsyncDatabase:
+    """Асинхронные запросы чтения (те же SQL, что и в db.Database)"""
+
+    def __init__(self, database, pool_size=None):
+        self.database = database
+        self.pool_size = pool_size or int(os.getenv("ASYNC_DB_POOL_SIZE", 10))
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await aiomysql.create_pool(
+            host=self.database.host,
+            port=self.database.port,
+            db=self.database.database,
+            user=self.database.user,
+            password=self.database.password,
+            autocommit=True,
+            minsize=1,
+            maxsize=self.pool_size,
+        )
+        print(f"✅ Асинхронный пул MySQL: {self.pool_size} соединений")
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    async def _fetchall(self, query, params=None, dictionary=False):
+        cursor_class = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(cursor_class) as cursor:
+                await cursor.execute(query, params or None)
+                return await cursor.fetchall()
+
+    async def get_statistics(self, start_date=None, end_date=None):
+        try:
+            query, params = build_statistics_query(start_date, end_date)
+            return list(await self._fetchall(query, params, dictionary=True))
+        except Exception as e:
+            print(f"❌ Ошибка получения статистики: {e}")
+            return None
+
+    async def get_violations(self, start_date=None, end_date=None, user_name=None, status_code=None,
+                             cursor=None, limit=None):
+        """Страница нарушений: (строки, курсор следующей страницы) или None при ошибке"""
+        limit = page_limit(limit)
+        query, params = build_violations_query(
+            start_date, end_date, user_name=user_name, status_code=status_code, cursor=cursor, limit=limit
+        )
+        try:
+            return violations_page(list(await self._fetchall(query, params, dictionary=True)), limit)
+        except Exception as e:
+            print(f"❌ Ошибка получения нарушений: {e}")
+            return None
+
+    async def get_violation_statistics(self, start_date=None, end_date=None):
+        try:
+            queries = build_violation_statistics_queries(start_date, end_date)
+            # Разделы статистики независимы - выполняем их параллельно на разных соединениях
+            sections = list(queries.keys())
+            results = await asyncio.gather(*(
+                self._fetchall(query, params, dictionary=True) for query, params in queries.values()
+            ))
+            stats = {section: list(rows) for section, rows in zip(sections, results)}
+            stats['total_violations'] = stats['total_violations'][0]['total']
+            return stats
+        except Exception as e:
+            print(f"❌ Ошибка получения статистики нарушений: {e}")
+            return None
+
+
+async_db = AsyncDatabase(db)
+
+# Блокирующая обработка событий (БД, SDK) не выполняется в цикле событий.
+# Команды SDK дополнительно идут через полосы терминалов (sdk_lanes), у каждой свой поток.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASYNC_BLOCKING_WORKERS", 16)),
+    thread_name_prefix="apb-blocking"
+)
+
+
+async def event(request):
+    """Обработчик событий от терминалов Hikvision"""
+    device_ip = request.headers.get('X-Forwarded-For', request.remote)
+    if ',' in device_ip:
+        device_ip = device_ip.split(',')[0].strip()
+
+    post = await request.post()
+    form = {}
+    files = []
+    for key, value in post.items():
+        if isinstance(value, web.FileField):
+            files.append((key, value.filename, value.file.read()))
+        else:
+            form[key] = value
+
+    if main.INGEST_ASYNC:
+        # Событие только ставится в очередь пула - в цикле событий ничего не блокируется
+        body, status = main.handle_event_payload(device_ip, dict(request.headers), form, files)
+    else:
+        body, status = await asyncio.get_running_loop().run_in_executor(
+            blocking_executor, main.handle_event_payload, device_ip, dict(request.headers), form, files
+        )
+    return web.Response(text=body, status=status)
+
+
+async def index(request):
+    return web.Response(text="✅ Hikvision APB System Active")
+
+
+async def status(request):
+    # Индекс присутствия в памяти - запроса к БД нет
+    try:
+        include_users, offset, limit = main.status_params(request.query)
+    except ValueError as e:
+        return _json_payload(main.bad_request(e))
+    return json_response(main.status_payload(include_users, offset, limit))
+
+
+async def get_stats(request):
+    params = {"start_date": request.query.get("start_date"), "end_date": request.query.get("end_date")}
+    stats = await main.result_cache.get_or_compute_async(
+        "/stats", params, lambda: async_db.get_statistics(**params)
+    )
+    return _json_payload(main.statistics_payload(stats))
+
+
+def _json_payload(payload):
+    body, status = payload
+    return json_response(body, status=status)
+
+
+async def get_violations(request):
+    try:
+        params = {
+            "start_date": request.query.get("start_date"),
+            "end_date": request.query.get("end_date"),
+            "user_name": request.query.get("user_name"),
+            "cursor": request.query.get("cursor"),
+            "limit": page_limit(request.query.get("limit")),
+        }
+        page = await main.result_cache.get_or_compute_async(
+            "/violations", params, lambda: async_db.get_violations(**params)
+        )
+    except ValueError as e:
+        return _json_payload(main.bad_request(e))
+    return _json_payload(main.violations_payload(page))
+
+
+async def get_violation_stats(request):
+    params = {"start_date": request.query.get("start_date"), "end_date": request.query.get("end_date")}
+    stats = await main.result_cache.get_or_compute_async(
+        "/violations/stats", params, lambda: async_db.get_violation_statistics(**params)
+    )
+    return _json_payload(main.statistics_payload(stats))
+
+
+async def get_violations_by_status(request):
+    status_code = request.match_info["status_code"]
+    try:
+        params = {
+            "start_date": request.query.get("start_date"),
+            "end_date": request.query.get("end_date"),
+            "cursor": request.query.get("cursor"),
+            "limit": page_limit(request.query.get("limit")),
+        }
+        page = await main.result_cache.get_or_compute_async(
+            f"/violations/{status_code}", params,
+            lambda: async_db.get_violations(status_code=status_code, **params)
+        )
+    except ValueError as e:
+        return _json_payload(main.bad_request(e))
+    return _json_payload(main.violations_payload(page, status_code=status_code))
+
+
+async def stream(request):
+    """Server-Sent Events: буфер подписчика заполняет поток рассылки, ожидание - без потока"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    broker = main.event_broker
+    subscriber = broker.subscribe(wake=lambda: loop.call_soon_threadsafe(ready.set))
+    if subscriber is None:
+        return json_response({"status": "error", "message": "Слишком много подписчиков /stream"}, status=429)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream; charset=utf-8",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    try:
+        await response.prepare(request)
+        await response.write(broker.preamble([("occupancy", main.stream_snapshot(subscriber))]))
+        while broker.running:
+            try:
+                await asyncio.wait_for(ready.wait(), broker.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+            ready.clear()
+            await response.write(broker.frames(subscriber) or b": keepalive\n\n")
+    except ConnectionResetError:
+        # Клиент отключился
+        pass
+    finally:
+        broker.unsubscribe(subscriber)
+    return response
+
+
+async def on_startup(app):
+    # Запуск подсистем main (SDK, БД, фоновые службы) блокирующий - выполняется вне цикла событий
+    await asyncio.get_running_loop().run_in_executor(blocking_executor, main.startup)
+    await async_db.connect()
+
+
+async def on_cleanup(app):
+    await async_db.close()
+    await asyncio.get_running_loop().run_in_executor(blocking_executor, main.shutdown)
+    blocking_executor.shutdown(wait=True)
+
+
+def create_async_app():
+    app = web.Application(client_max_size=int(os.getenv("ASYNC_MAX_BODY_MB", 20)) * 1024 * 1024)
+    app.router.add_post("/event", event)
+    app.router.add_get("/", index)
+    app.router.add_get("/status", status)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/violations", get_violations)
+    # /violations/stats регистрируется раньше /violations/{status_code}
+    app.router.add_get("/violations/stats", get_violation_stats)
+    app.router.add_get("/violations/{status_code}", get_violations_by_status)
+    app.router.add_get("/stream", stream)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    host = os.getenv("FLASK_HOST", "0.0.0.0")
+    port = int(os.getenv("FLASK_PORT", 3000))
+
+    print("\n" + "=" * 60)
+    print(f"🚀 APB System (asyncio) запускается на {host}:{port}")
+    print("=" * 60 + "\n")
+
+    web.run_app(create_async_app(), host=host, port=port, print=None)
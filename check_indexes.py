@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка индексов: планы EXPLAIN и время запросов db.py на синтетических данных
+
+Создает отдельную базу (INDEX_CHECK_DB, по умолчанию <DB_NAME>_index_check),
+заполняет event_logs, user_states и витрины синтетическими событиями и для
+каждого запроса Database проверяет, что он читает ожидаемый индекс (без
+полного просмотра таблицы и сортировки) и укладывается в INDEX_CHECK_MAX_MS.
+Код возврата 1 - регрессия индексов или запросов.
+
+Запуск:
+    python check_indexes.py                # 200 000 событий, база удаляется после проверки
+    python check_indexes.py --rows 1000000 --keep
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Цветные выводы
+GREEN = '\033[92m'
+RED = '\033[91m'
+YELLOW = '\033[93m'
+BLUE = '\033[94m'
+RESET = '\033[0m'
+
+def print_success(msg):
+    print(f"{GREEN}✅ {msg}{RESET}")
+
+def print_error(msg):
+    print(f"{RED}❌ {msg}{RESET}")
+
+def print_warning(msg):
+    print(f"{YELLOW}⚠️  {msg}{RESET}")
+
+def print_info(msg):
+    print(f"{BLUE}ℹ️  {msg}{RESET}")
+
+
+SEED_USERS = 5000
+SEED_TERMINALS = [f"10.0.{kind}.{number}" for kind in (1, 2) for number in range(1, 10)]
+SEED_DAYS = 180
+SEED_BATCH = 5000
+# Коды статуса и их доля в синтетическом потоке (нарушения - около 5%)
+SEED_STATUSES = [
+    ("SUCCESS_ENTRY", "entry", False, 45),
+    ("SUCCESS_EXIT", "exit", False, 45),
+    ("ALLOWED_TIME_WINDOW", "entry", False, 3),
+    ("WARNING_EXIT_WITHOUT_ENTRY", "exit", False, 2),
+    ("DENIED_ALREADY_INSIDE", "entry", True, 4),
+    ("DENIED_OUTSIDE_WINDOW", "entry", True, 1),
+]
+
+
+def open_database(name):
+    """Database из db.py, подключенный к проверочной базе"""
+    import mysql.connector
+    from db import Database
+
+    check_db = Database()
+    server = mysql.connector.connect(
+        host=check_db.host, port=check_db.port, user=check_db.user, password=check_db.password
+    )
+    cursor = server.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cursor.close()
+    server.close()
+
+    check_db.database = name
+    if not check_db.connect() or not check_db.initialize_tables():
+        raise RuntimeError(f"Не удалось подготовить базу {name}")
+    return check_db
+
+
+def drop_database(check_db):
+    with check_db._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{check_db.database}`")
+        cursor.close()
+    check_db.disconnect()
+
+
+def seed(check_db, rows):
+    """Синтетические события, состояния пользователей и витрины (если данных меньше rows)"""
+    print("\n" + "="*60)
+    print(f"1. Синтетические данные ({rows} событий)")
+    print("="*60)
+
+    with check_db._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM event_logs")
+        existing = cursor.fetchone()[0]
+        cursor.close()
+
+    if existing >= rows:
+        print_info(f"В event_logs уже {existing} строк - заполнение пропущено")
+        return
+
+    rng = random.Random(42)
+    weights = [weight for *_, weight in SEED_STATUSES]
+    now = datetime.now().replace(microsecond=0)
+    started = time.monotonic()
+
+    with check_db._connection() as connection:
+        cursor = connection.cursor()
+        remaining = rows - existing
+        while remaining > 0:
+            batch = []
+            for _ in range(min(SEED_BATCH, remaining)):
+                status_code, terminal_type, is_violation, _ = rng.choices(SEED_STATUSES, weights)[0]
+                terminals = SEED_TERMINALS[:9] if terminal_type == "entry" else SEED_TERMINALS[9:]
+                batch.append((
+                    f"user_{rng.randrange(SEED_USERS):05d}", rng.choice(terminals), terminal_type,
+                    "AccessControllerEvent", 75, status_code, status_code, is_violation,
+                    not is_violation, now - timedelta(seconds=rng.randrange(SEED_DAYS * 86400))
+                ))
+            cursor.executemany(
+                """INSERT INTO event_logs
+                   (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                    action_taken, status_code, is_violation, door_opened, created_at)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                batch
+            )
+            remaining -= len(batch)
+
+        cursor.executemany(
+            """INSERT IGNORE INTO user_states (user_name, state, last_terminal, last_event_time)
+               VALUES (%s, %s, %s, %s)""",
+            [
+                (f"user_{number:05d}", "inside" if rng.random() < 0.05 else "outside", rng.choice(SEED_TERMINALS),
+                 now - timedelta(seconds=rng.randrange(3 * 86400)))
+                for number in range(SEED_USERS)
+            ]
+        )
+
+        # Витрины досчитываются тем же кодом, что и в приложении (Database.backfill_rollups)
+        cursor.execute(
+            """UPDATE system_config SET config_value = (SELECT COALESCE(MAX(id), 0) FROM event_logs)
+               WHERE config_key = 'rollup_backfill_id'"""
+        )
+        cursor.close()
+
+    while check_db.backfill_rollups(50000) == 50000:
+        pass
+
+    with check_db._connection() as connection:
+        cursor = connection.cursor()
+        for table in ("event_logs", "user_states", "event_rollup_hourly", "user_rollup_daily"):
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+        cursor.close()
+
+    print_success(f"Добавлено событий: {rows - existing} за {time.monotonic() - started:.1f} сек")
+
+
+def query_checks():
+    """
+    Запросы Database: (название, (SQL, параметры), таблица, допустимые индексы, порядок из индекса)
+
+    Порядок из индекса - ORDER BY выполняется чтением индекса, без filesort
+    (для запросов с группировкой сортировка результата допустима).
+    """
+    from db import (
+        CLEANUP_STALE_STATES_QUERY,
+        USER_STATE_FOR_UPDATE_QUERY,
+        USER_STATE_QUERY,
+        USERS_INSIDE_QUERY,
+        build_event_export_query,
+        build_statistics_query,
+        build_violation_statistics_queries,
+        build_violations_query,
+        encode_cursor,
+    )
+
+    today = datetime.now().date()
+    month_ago = (today - timedelta(days=30)).isoformat()
+    week_ago = (today - timedelta(days=7)).isoformat()
+    day_ago = (today - timedelta(days=1)).isoformat()
+    cursor = encode_cursor({'created_at': datetime.now() - timedelta(days=10), 'id': 2 ** 31 - 1})
+
+    checks = [
+        ("Состояние пользователя", (USER_STATE_QUERY, ["user_00042"]), "user_states", {"user_name"}, False),
+        ("Переход APB (SELECT ... FOR UPDATE)", (USER_STATE_FOR_UPDATE_QUERY, ["user_00042"]),
+         "user_states", {"user_name"}, False),
+        ("Пользователи внутри", (USERS_INSIDE_QUERY, []), "user_states", {"idx_state_event_time"}, False),
+        ("Очистка по эпохе сброса", (CLEANUP_STALE_STATES_QUERY, [1000]), "user_states", {"idx_state_event_time"}, False),
+        ("Нарушения: первая страница", build_violations_query(limit=100), "event_logs", {"idx_violation_date"}, True),
+        ("Нарушения: страница по курсору", build_violations_query(cursor=cursor, limit=100),
+         "event_logs", {"idx_violation_date"}, True),
+        ("Нарушения: за период", build_violations_query(month_ago, week_ago, limit=100),
+         "event_logs", {"idx_violation_date"}, True),
+        ("Нарушения пользователя", build_violations_query(user_name="user_00042", limit=100),
+         "event_logs", {"idx_user_violation_date"}, True),
+        ("Нарушения пользователя за период", build_violations_query(month_ago, None, user_name="user_00042", limit=100),
+         "event_logs", {"idx_user_violation_date"}, True),
+        ("Нарушения по коду статуса", build_violations_query(status_code="DENIED_OUTSIDE_WINDOW", limit=100),
+         "event_logs", {"idx_status_violation_date"}, True),
+        ("Выгрузка: терминал за неделю", build_event_export_query(week_ago, None, terminal_ip=SEED_TERMINALS[0]),
+         "event_logs", {"idx_terminal_date"}, True),
+        ("Выгрузка: сутки", build_event_export_query(day_ago, None), "event_logs", {"idx_created_at"}, True),
+        ("Выгрузка: нарушения за неделю", build_event_export_query(week_ago, None, violations_only=True),
+         "event_logs", {"idx_violation_date"}, True),
+        ("Заполнение витрин (диапазон id)", (
+            "SELECT COUNT(*) FROM event_logs WHERE id > %s AND id <= %s", [1000, 11000]), "event_logs", {"PRIMARY"}, False),
+        ("Статистика событий за месяц", build_statistics_query(month_ago, None),
+         "event_rollup_hourly", {"PRIMARY", "idx_violation_hour"}, False),
+    ]
+    for section, (query, params) in build_violation_statistics_queries(month_ago, None).items():
+        table = "user_rollup_daily" if section == "top_violators" else "event_rollup_hourly"
+        checks.append((f"Статистика нарушений: {section}", (query, params), table,
+                       {"PRIMARY", "idx_violation_hour"}, False))
+    return checks
+
+
+def check_plans(check_db, max_ms):
+    """EXPLAIN и время выполнения каждого запроса"""
+    print("\n" + "="*60)
+    print(f"2. Планы запросов и время (предел {max_ms} мс)")
+    print("="*60)
+
+    failures = 0
+    with check_db._connection() as connection:
+        cursor = connection.cursor(dictionary=True)
+        for name, (query, params), table, expected, ordered in query_checks():
+            cursor.execute("EXPLAIN " + query, params)
+            plan = [row for row in cursor.fetchall() if row['table'] == table]
+            problems = []
+            if not plan:
+                problems.append(f"в плане нет таблицы {table}")
+            for row in plan:
+                extra = row.get('Extra') or ""
+                if row['type'] == "ALL":
+                    problems.append("полный просмотр таблицы")
+                if row['key'] not in expected:
+                    problems.append(f"индекс {row['key']} вместо {'/'.join(sorted(expected))}")
+                if ordered and "Using filesort" in extra:
+                    problems.append("сортировка (filesort)")
+
+            elapsed_ms = None
+            if not query.lstrip().startswith("UPDATE"):
+                started = time.monotonic()
+                cursor.execute(query, params)
+                cursor.fetchall()
+                elapsed_ms = (time.monotonic() - started) * 1000
+                if elapsed_ms > max_ms:
+                    problems.append(f"{elapsed_ms:.1f} мс > {max_ms} мс")
+
+            keys = ", ".join(str(row['key']) for row in plan) or "-"
+            timing = f", {elapsed_ms:.1f} мс" if elapsed_ms is not None else ""
+            if problems:
+                failures += 1
+                print_error(f"{name}: {'; '.join(problems)} (индекс: {keys}{timing})")
+            else:
+                print_success(f"{name}: {keys}{timing}")
+        cursor.close()
+
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка индексов APB по планам EXPLAIN")
+    parser.add_argument("--rows", type=int, default=int(os.getenv("INDEX_CHECK_ROWS", 200000)),
+                        help="число синтетических событий")
+    parser.add_argument("--max-ms", type=float, default=float(os.getenv("INDEX_CHECK_MAX_MS", 200)),
+                        help="предельное время запроса (мс)")
+    parser.add_argument("--keep", action="store_true", help="не удалять проверочную базу")
+    args = parser.parse_args()
+
+    name = os.getenv("INDEX_CHECK_DB", f"{os.getenv('DB_NAME', 'app_db')}_index_check")
+
+    print("\n" + "="*60)
+    print(f"🔍 ПРОВЕРКА ИНДЕКСОВ APB (база {name})")
+    print("="*60)
+
+    try:
+        check_db = open_database(name)
+    except Exception as e:
+        print_error(f"Не удалось подготовить проверочную базу: {e}")
+        print_info("Нужны права CREATE/DROP DATABASE для пользователя DB_USER")
+        return 1
+
+    try:
+        seed(check_db, args.rows)
+        passed = check_plans(check_db, args.max_ms)
+    finally:
+        if args.keep:
+            print_info(f"Проверочная база {name} сохранена (--keep)")
+            check_db.disconnect()
+        else:
+            drop_database(check_db)
+
+    print("\n" + "="*60)
+    if passed:
+        print_success("Все запросы используют ожидаемые индексы")
+        return 0
+    print_error("Регрессия индексов: исправьте набор индексов в db.py или запросы")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
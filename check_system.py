@@ -51,14 +51,8 @@ def check_env_variables():
 
     load_dotenv()
 
+    # Терминалы проверяются отдельно (реестр: файл TERMINALS_FILE или TERMINAL_IN_<n> / TERMINAL_OUT_<n>)
     required_vars = [
-        "TERMINAL_IN_1", "TERMINAL_IN_2", "TERMINAL_IN_3",
-        "TERMINAL_IN_4", "TERMINAL_IN_5", "TERMINAL_IN_6",
-        "TERMINAL_IN_7", "TERMINAL_IN_8", "TERMINAL_IN_9",
-        "TERMINAL_OUT_1", "TERMINAL_OUT_2", "TERMINAL_OUT_3",
-        "TERMINAL_OUT_4", "TERMINAL_OUT_5", "TERMINAL_OUT_6",
-        "TERMINAL_OUT_7", "TERMINAL_OUT_8", "TERMINAL_OUT_9",
-        "TERMINAL_USER", "TERMINAL_PASSWORD",
         "DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"
     ]
 
@@ -109,7 +103,7 @@ def check_mysql():
             cursor.execute("SHOW TABLES")
             tables = cursor.fetchall()
 
-            required_tables = ['user_states', 'event_logs', 'system_config']
+            required_tables = ['user_states', 'event_logs', 'system_config', 'event_rollup_hourly', 'user_rollup_daily']
             existing_tables = [table[0] for table in tables]
 
             missing_tables = [t for t in required_tables if t not in existing_tables]
@@ -167,52 +161,37 @@ def check_terminals():
     print("5. Проверка доступности терминалов")
     print("="*60)
 
-    terminals_in = [
-        os.getenv("TERMINAL_IN_1"),
-        os.getenv("TERMINAL_IN_2"),
-        os.getenv("TERMINAL_IN_3"),
-        os.getenv("TERMINAL_IN_4"),
-        os.getenv("TERMINAL_IN_5"),
-        os.getenv("TERMINAL_IN_6"),
-        os.getenv("TERMINAL_IN_7"),
-        os.getenv("TERMINAL_IN_8"),
-        os.getenv("TERMINAL_IN_9"),
-    ]
+    from terminal_registry import terminal_registry
 
-    terminals_out = [
-        os.getenv("TERMINAL_OUT_1"),
-        os.getenv("TERMINAL_OUT_2"),
-        os.getenv("TERMINAL_OUT_3"),
-        os.getenv("TERMINAL_OUT_4"),
-        os.getenv("TERMINAL_OUT_5"),
-        os.getenv("TERMINAL_OUT_6"),
-        os.getenv("TERMINAL_OUT_7"),
-        os.getenv("TERMINAL_OUT_8"),
-        os.getenv("TERMINAL_OUT_9"),
-    ]
+    try:
+        terminal_registry.load()
+    except (OSError, ValueError) as e:
+        print_error(f"Ошибка конфигурации терминалов: {e}")
+        return False
 
-    port = int(os.getenv("TERMINAL_PORT", 8000))
+    terminals_in = terminal_registry.entries()
+    terminals_out = terminal_registry.exits()
 
     print("\n📥 Терминалы входа:")
     available_in = 0
-    for ip in terminals_in:
-        if check_network_connectivity(ip, port):
-            print_success(f"{ip} доступен")
+    for terminal in terminals_in:
+        if check_network_connectivity(terminal.ip, terminal.port):
+            print_success(f"{terminal.ip} ({terminal.name}) доступен")
             available_in += 1
         else:
-            print_warning(f"{ip} недоступен")
+            print_warning(f"{terminal.ip} ({terminal.name}) недоступен")
 
     print("\n📤 Терминалы выхода:")
     available_out = 0
-    for ip in terminals_out:
-        if check_network_connectivity(ip, port):
-            print_success(f"{ip} доступен")
+    for terminal in terminals_out:
+        if check_network_connectivity(terminal.ip, terminal.port):
+            print_success(f"{terminal.ip} ({terminal.name}) доступен")
             available_out += 1
         else:
-            print_warning(f"{ip} недоступен")
+            print_warning(f"{terminal.ip} ({terminal.name}) недоступен")
 
-    total_in = len([ip for ip in terminals_in if ip])
-    total_out = len([ip for ip in terminals_out if ip])
+    total_in = len(terminals_in)
+    total_out = len(terminals_out)
 
     print(f"\n📊 Доступно терминалов входа: {available_in}/{total_in}")
     print(f"📊 Доступно терминалов выхода: {available_out}/{total_out}")
@@ -1,16 +1,462 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import mysql.connector
-from mysql.connector import Error
-from datetime import datetime
+from mysql.connector import Error, connect as mysql_connect
+from mysql.connector.errors import PoolError
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import base64
+import json
 import os
 import threading
+import time
 from dotenv import load_dotenv
+from apb_logic import apply_decision, decide_transition, effective_state
 
 load_dotenv()
 
 
+# =============================
+#   Эпоха сброса состояний
+# =============================
+# Ежедневный сброс - одна запись в system_config: состояние 'inside', записанное
+# раньше эпохи, считается 'outside' (см. apb_logic.effective_state)
+
+RESET_EPOCH_KEY = "reset_epoch"
+RESET_EPOCH_FORMAT = "%Y-%m-%d %H:%M:%S"
+RESET_EPOCH_SUBQUERY = (
+    "(SELECT CAST(config_value AS DATETIME) FROM system_config WHERE config_key = 'reset_epoch')"
+)
+
+# =============================
+#   Секционирование event_logs
+# =============================
+# RANGE по TO_DAYS(created_at): секция на месяц (month) или сутки (day).
+# Секции создаются заранее, срок хранения - удаление целых секций (DROP PARTITION)
+
+EVENT_LOG_FUTURE_PARTITION = "p_future"
+
+
+def _to_days(day):
+    """MySQL TO_DAYS() для даты"""
+    return day.toordinal() + 365
+
+
+def _period_start(day, period):
+    return day.replace(day=1) if period == "month" else day
+
+
+def _next_period(day, period):
+    if period == "month":
+        return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _partition_clause(start, period):
+    """Описание секции периода, начинающегося в start"""
+    name = "p" + start.strftime("%Y%m" if period == "month" else "%Y%m%d")
+    return name, f"PARTITION {name} VALUES LESS THAN ({_to_days(_next_period(start, period))})"
+
+
+def _event_log_partitions(today, period, ahead):
+    """Секции для новой таблицы: история, текущий период + ahead вперед, p_future"""
+    start = _period_start(today, period)
+    clauses = [f"PARTITION p_history VALUES LESS THAN ({_to_days(start)})"]
+    for _ in range(ahead + 1):
+        clauses.append(_partition_clause(start, period)[1])
+        start = _next_period(start, period)
+    clauses.append(f"PARTITION {EVENT_LOG_FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    return ",\n".join(clauses)
+
+
+# =============================
+#   Индексы
+# =============================
+# Набор индексов под формы запросов (проверяется планами EXPLAIN в check_indexes.py).
+# Индекс с колонками-префиксом другого индекса избыточен: запросы используют
+# составной, а вставка платит за оба.
+
+# user_states: поиск по user_name - UNIQUE, пользователи внутри и очистка по эпохе сброса
+USER_STATES_INDEXES = {
+    'idx_state_event_time': "(state, last_event_time)",
+}
+USER_STATES_OBSOLETE_INDEXES = ('idx_user_name', 'idx_state', 'idx_last_entry_auth_time')
+
+# event_logs: нарушения (все / пользователя / по коду статуса) по убыванию времени,
+# выгрузка по терминалу и по периоду. Вторичный индекс InnoDB содержит первичный
+# ключ (id, created_at) - ORDER BY created_at, id читается из индекса без сортировки
+EVENT_LOGS_INDEXES = {
+    'idx_created_at': "(created_at)",
+    'idx_violation_date': "(is_violation, created_at)",
+    'idx_user_violation_date': "(user_name, is_violation, created_at)",
+    'idx_status_violation_date': "(status_code, is_violation, created_at)",
+    'idx_terminal_date': "(terminal_ip, created_at)",
+}
+EVENT_LOGS_OBSOLETE_INDEXES = ('idx_user_name', 'idx_terminal', 'idx_status_code', 'idx_is_violation')
+
+
+def _index_definitions(indexes):
+    """Описание индексов для CREATE TABLE"""
+    return ",\n".join(f"INDEX {name} {columns}" for name, columns in indexes.items())
+
+
+# =============================
+#   Запросы аналитики
+# =============================
+# Общие для синхронного Database и асинхронного сервера (async_server.py)
+
+USERS_INSIDE_QUERY = f"""
+    SELECT user_name, last_terminal, last_event_time FROM user_states
+    WHERE state = 'inside'
+      AND last_event_time >= COALESCE({RESET_EPOCH_SUBQUERY}, '1000-01-01')"""
+
+# Запросы к user_states (используются также check_indexes.py для проверки планов)
+USER_STATE_QUERY = """
+    SELECT state, last_terminal, last_event_time, last_reset_date, last_entry_auth_time
+    FROM user_states WHERE user_name = %s"""
+
+# Блокировка строки пользователя в apply_transition (горячий путь APB)
+USER_STATE_FOR_UPDATE_QUERY = f"""
+    SELECT state, last_terminal, last_event_time, last_reset_date, last_entry_auth_time,
+           {RESET_EPOCH_SUBQUERY}
+    FROM user_states WHERE user_name = %s FOR UPDATE"""
+
+CLEANUP_STALE_STATES_QUERY = f"""
+    UPDATE user_states
+    SET state = 'outside', last_reset_date = CURDATE()
+    WHERE state = 'inside'
+      AND (last_event_time IS NULL OR last_event_time < {RESET_EPOCH_SUBQUERY})
+    LIMIT %s"""
+
+VIOLATION_COLUMNS = """
+                        id,
+                        user_name,
+                        terminal_ip,
+                        terminal_type,
+                        status_code,
+                        action_taken,
+                        state_before,
+                        state_after,
+                        created_at"""
+
+
+def _is_date_only(value):
+    """Граница периода задана датой без времени ('YYYY-MM-DD' или date)"""
+    if isinstance(value, datetime):
+        return False
+    if hasattr(value, "year"):
+        return True
+    try:
+        datetime.strptime(str(value), "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+def _date_range_filter(start_date=None, end_date=None, column="created_at", whole_days=False):
+    """
+    Условие по периоду для запросов с WHERE (возвращает SQL и параметры)
+
+    Одно правило для всех эндпоинтов: начало включительно, конечная дата без
+    времени включает весь последний день (column < дата + 1 день), конечная
+    дата со временем - включительно. whole_days=True округляет обе границы до
+    суток (статистика по витринам: почасовая и суточная витрины тогда отбирают
+    одни и те же сутки).
+    """
+    conditions, params = [], []
+    if start_date:
+        conditions.append(f"{column} >= DATE(%s)" if whole_days else f"{column} >= %s")
+        params.append(start_date)
+    if end_date:
+        if whole_days:
+            conditions.append(f"{column} < DATE(%s) + INTERVAL 1 DAY")
+        elif _is_date_only(end_date):
+            conditions.append(f"{column} < %s + INTERVAL 1 DAY")
+        else:
+            conditions.append(f"{column} <= %s")
+        params.append(end_date)
+    return "".join(f" AND {condition}" for condition in conditions), params
+
+
+# Постраничная выдача нарушений: размер страницы по умолчанию и предел,
+# предельное время выполнения запроса на сервере MySQL (мс, 0 - без ограничения)
+VIOLATIONS_PAGE_SIZE = int(os.getenv("VIOLATIONS_PAGE_SIZE", 100))
+VIOLATIONS_MAX_PAGE_SIZE = int(os.getenv("VIOLATIONS_MAX_PAGE_SIZE", 1000))
+QUERY_MAX_EXECUTION_MS = int(os.getenv("QUERY_MAX_EXECUTION_MS", 5000))
+
+CURSOR_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def page_limit(limit=None):
+    """Размер страницы: по умолчанию VIOLATIONS_PAGE_SIZE, не больше VIOLATIONS_MAX_PAGE_SIZE"""
+    if limit is None or limit == "":
+        return VIOLATIONS_PAGE_SIZE
+    try:
+        return max(1, min(int(limit), VIOLATIONS_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный размер страницы: {limit}")
+
+
+def encode_cursor(row):
+    """Курсор страницы - позиция (created_at, id) последней выданной строки"""
+    payload = json.dumps([row['created_at'].strftime(CURSOR_TIME_FORMAT), row['id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Позиция (created_at, id) из курсора; поврежденный курсор - ValueError"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.strptime(created_at, CURSOR_TIME_FORMAT), int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError("Некорректный курсор страницы")
+
+
+def violations_page(rows, limit):
+    """
+    Страница из результата запроса с LIMIT limit + 1
+
+    Returns:
+        (строки страницы, курсор следующей страницы или None - страница последняя)
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def _max_execution_hint():
+    """Подсказка оптимизатору MySQL: прервать SELECT дольше QUERY_MAX_EXECUTION_MS"""
+    return f" /*+ MAX_EXECUTION_TIME({QUERY_MAX_EXECUTION_MS}) */" if QUERY_MAX_EXECUTION_MS > 0 else ""
+
+
+def build_violations_query(start_date=None, end_date=None, user_name=None, status_code=None,
+                           cursor=None, limit=None):
+    """
+    Запрос страницы нарушений APB с фильтрами (возвращает SQL и параметры)
+
+    Постраничная выдача по ключу (created_at, id), от новых к старым: следующая
+    страница начинается строго после позиции курсора, поэтому стоимость запроса
+    не зависит от номера страницы. Читается limit + 1 строка - лишняя строка
+    означает, что есть следующая страница (см. violations_page).
+
+    Args:
+        cursor: курсор предыдущей страницы (encode_cursor) или None - первая страница
+        limit: размер страницы (после page_limit)
+    """
+    query = f"""
+                    SELECT{_max_execution_hint()}{VIOLATION_COLUMNS}
+                    FROM event_logs
+                    WHERE is_violation = TRUE
+                """
+    params = []
+
+    if status_code:
+        query += " AND status_code = %s"
+        params.append(status_code)
+
+    if user_name:
+        query += " AND user_name = %s"
+        params.append(user_name)
+
+    date_filter, date_params = _date_range_filter(start_date, end_date)
+    query += date_filter
+    params.extend(date_params)
+
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params.extend([cursor_time, cursor_time, cursor_id])
+
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(page_limit(limit) + 1)
+    return query, params
+
+
+def build_violation_statistics_queries(start_date=None, end_date=None):
+    """
+    Запросы статистики нарушений по витринам (возвращает словарь: раздел -> (SQL, параметры))
+
+    Читаются почасовая (event_rollup_hourly) и суточная (user_rollup_daily)
+    витрины, а не event_logs: объем чтения зависит от числа часов/суток в
+    периоде, а не от числа событий. Статистика считается по целым суткам:
+    время в границах периода отбрасывается, последний день входит целиком.
+    """
+    hourly_query = "FROM event_rollup_hourly WHERE is_violation = TRUE"
+    hourly_filter, hourly_params = _date_range_filter(start_date, end_date, column="bucket_hour", whole_days=True)
+    hourly_query += hourly_filter
+
+    users_query = "FROM user_rollup_daily WHERE violations > 0"
+    users_filter, users_params = _date_range_filter(start_date, end_date, column="day", whole_days=True)
+    users_query += users_filter
+    select = f"SELECT{_max_execution_hint()}"
+
+    return {
+        # Общее количество нарушений
+        'total_violations': (f"{select} CAST(COALESCE(SUM(events), 0) AS SIGNED) as total {hourly_query}",
+                             hourly_params),
+        # Нарушения по коду статуса
+        'by_status_code': (f"""
+                    {select}
+                        status_code,
+                        CAST(SUM(events) AS SIGNED) as count
+                    {hourly_query}
+                    GROUP BY status_code
+                    ORDER BY count DESC
+                """, hourly_params),
+        # Нарушения по пользователю
+        'top_violators': (f"""
+                    {select}
+                        user_name,
+                        CAST(SUM(violations) AS SIGNED) as count
+                    {users_query}
+                    GROUP BY user_name
+                    ORDER BY count DESC
+                    LIMIT 10
+                """, users_params),
+        # Нарушения по терминалу
+        'by_terminal': (f"""
+                    {select}
+                        terminal_ip,
+                        CAST(SUM(events) AS SIGNED) as count
+                    {hourly_query}
+                    GROUP BY terminal_ip
+                    ORDER BY count DESC
+                """, hourly_params),
+    }
+
+
+def build_statistics_query(start_date=None, end_date=None):
+    """
+    Запрос статистики событий по дням и типу терминала из витрин (возвращает SQL и параметры)
+
+    События и открытия дверей суммируются по почасовой витрине, уникальные
+    пользователи - число строк суточной витрины пользователей. Период - целые сутки.
+    """
+    hourly_filter, hourly_params = _date_range_filter(start_date, end_date, column="bucket_hour", whole_days=True)
+    users_filter, users_params = _date_range_filter(start_date, end_date, column="day", whole_days=True)
+
+    query = f"""
+                    SELECT{_max_execution_hint()}
+                        events.date,
+                        events.terminal_type,
+                        events.total_events,
+                        COALESCE(users.unique_users, 0) as unique_users,
+                        events.doors_opened
+                    FROM (
+                        SELECT
+                            DATE(bucket_hour) as date,
+                            terminal_type,
+                            CAST(SUM(events) AS SIGNED) as total_events,
+                            CAST(SUM(doors_opened) AS SIGNED) as doors_opened
+                        FROM event_rollup_hourly
+                        WHERE 1 = 1{hourly_filter}
+                        GROUP BY DATE(bucket_hour), terminal_type
+                    ) events
+                    LEFT JOIN (
+                        SELECT day, terminal_type, COUNT(*) as unique_users
+                        FROM user_rollup_daily
+                        WHERE 1 = 1{users_filter}
+                        GROUP BY day, terminal_type
+                    ) users ON users.day = events.date AND users.terminal_type = events.terminal_type
+                    ORDER BY events.date DESC, events.terminal_type
+                """
+    return query, hourly_params + users_params
+
+
+# Колонки выгрузки event_logs (/export)
+EXPORT_COLUMNS = (
+    "id", "created_at", "user_name", "terminal_ip", "terminal_type", "event_type", "sub_event_type",
+    "action_taken", "status_code", "is_violation", "state_before", "state_after", "door_opened",
+    "picture_sha256",
+)
+
+
+def build_event_export_query(start_date=None, end_date=None, user_name=None, status_code=None,
+                             terminal_ip=None, violations_only=False):
+    """Запрос выгрузки event_logs с фильтрами, по возрастанию (created_at, id) (возвращает SQL и параметры)"""
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM event_logs WHERE 1 = 1"
+    params = []
+
+    if violations_only:
+        query += " AND is_violation = TRUE"
+
+    for column, value in (("user_name", user_name), ("status_code", status_code), ("terminal_ip", terminal_ip)):
+        if value:
+            query += f" AND {column} = %s"
+            params.append(value)
+
+    date_filter, date_params = _date_range_filter(start_date, end_date)
+    query += date_filter
+    params.extend(date_params)
+
+    query += " ORDER BY created_at, id"
+    return query, params
+
+
+# =============================
+#   Витрины (rollups) event_logs
+# =============================
+# Счетчики событий по часу/терминалу/коду статуса и по суткам/пользователю.
+# События, записанные после появления витрин, учитываются в той же транзакции,
+# что и строка event_logs; более ранние - догоняющей задачей backfill_rollups
+# по водяному знаку (id event_logs), поэтому каждое событие учитывается один раз.
+
+ROLLUP_BACKFILL_ID_KEY = "rollup_backfill_id"
+ROLLUP_WATERMARK_KEY = "rollup_watermark"
+
+ROLLUP_HOURLY_UPSERT = """
+    INSERT INTO event_rollup_hourly
+    (bucket_hour, terminal_ip, terminal_type, status_code, is_violation, events, doors_opened)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        is_violation = VALUES(is_violation),
+        events = events + VALUES(events),
+        doors_opened = doors_opened + VALUES(doors_opened)"""
+
+ROLLUP_USERS_UPSERT = """
+    INSERT INTO user_rollup_daily (day, user_name, terminal_type, events, violations)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        events = events + VALUES(events),
+        violations = violations + VALUES(violations)"""
+
+
+def _rollup_rows(events):
+    """
+    Свернуть события в строки для ROLLUP_HOURLY_UPSERT и ROLLUP_USERS_UPSERT
+
+    Args:
+        events: словари с полями created_at, user_name, terminal_ip, terminal_type,
+            status_code, is_violation, door_opened
+
+    Returns:
+        (строки почасовой витрины, строки витрины пользователей) - отсортированы по
+        ключу, чтобы параллельные транзакции блокировали строки в одном порядке
+    """
+    hourly = {}
+    users = {}
+    for event in events:
+        created_at = event['created_at']
+        bucket = created_at.replace(minute=0, second=0, microsecond=0)
+        hourly_key = (bucket, event['terminal_ip'], event['terminal_type'], event['status_code'] or 'UNKNOWN')
+        counters = hourly.setdefault(hourly_key, [bool(event['is_violation']), 0, 0])
+        counters[1] += 1
+        counters[2] += int(bool(event['door_opened']))
+
+        users_key = (created_at.date(), event['user_name'], event['terminal_type'])
+        counters = users.setdefault(users_key, [0, 0])
+        counters[0] += 1
+        counters[1] += int(bool(event['is_violation']))
+
+    return (
+        [key + tuple(counters) for key, counters in sorted(hourly.items())],
+        [key + tuple(counters) for key, counters in sorted(users.items())],
+    )
+
+
 class Database:
     """Класс для работы с MySQL базой данных APB системы"""
 
@@ -20,80 +466,212 @@ class Database:
         self.database = os.getenv("DB_NAME", "app_db")
         self.user = os.getenv("DB_USER", "root")
         self.password = os.getenv("DB_PASSWORD", "")
-        self.connection = None
-        self.lock = threading.Lock()  # Блокировка для потокобезопасности
+
+        # Пул соединений: каждый поток берет свое соединение, глобальной блокировки нет.
+        # Число выданных соединений ограничивает семафор, свободные хранятся в _idle
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", 10))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 5))
+        self._idle = deque()  # Свободные соединения: (соединение, поколение пула)
+        self._generation = 0  # Увеличивается при пересоздании пула (disconnect)
+        self._pool_lock = threading.Lock()  # Только для операций с _idle и поколением
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+
+        # Секционирование event_logs: период секции, секций вперед, срок хранения (0 - бессрочно)
+        self.partition_period = os.getenv("EVENT_LOG_PARTITION_PERIOD", "month")
+        if self.partition_period not in ("month", "day"):
+            self.partition_period = "month"
+        self.partitions_ahead = int(os.getenv("EVENT_LOG_PARTITIONS_AHEAD", 3))
+        self.event_log_retention_days = int(os.getenv("EVENT_LOG_RETENTION_DAYS", 0))
+
+        # Метрики пула
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._in_use = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        # Версия данных: увеличивается при каждой записи событий и состояний
+        # (инвалидация кэша результатов чтения, см. result_cache.py)
+        self._version_lock = threading.Lock()
+        self.events_version = 0
+
+    def bump_events_version(self):
+        """Отметить изменение данных, видимых через эндпоинты чтения"""
+        with self._version_lock:
+            self.events_version += 1
+
+    def _open_connection(self):
+        """Новое соединение с настройками пула"""
+        return mysql_connect(
+            host=self.host,
+            port=self.port,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            autocommit=True,
+            connection_timeout=10,
+            sql_mode='STRICT_TRANS_TABLES'
+        )
+
+    def _checkout(self):
+        """Свободное соединение текущего поколения или новое: (соединение, поколение)"""
+        while True:
+            with self._pool_lock:
+                if not self._idle:
+                    generation = self._generation
+                    break
+                connection, generation = self._idle.pop()
+            # Разорванное соединение переподключается при выдаче
+            try:
+                connection.ping(reconnect=True, attempts=1, delay=0)
+                return connection, generation
+            except Error:
+                self._close_quietly(connection)
+        return self._open_connection(), generation
+
+    def _checkin(self, connection, generation):
+        """Вернуть соединение в пул; соединения старого поколения закрываются"""
+        try:
+            # Сброс сессии (временные таблицы, переменные, незавершенная транзакция)
+            connection.reset_session(session_variables={
+                'autocommit': 1, 'sql_mode': 'STRICT_TRANS_TABLES'
+            })
+        except Error:
+            self._close_quietly(connection)
+            return
+        with self._pool_lock:
+            if generation == self._generation:
+                self._idle.append((connection, generation))
+                return
+        self._close_quietly(connection)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Error:
+            pass
 
     def connect(self):
-        """Подключение к базе данных"""
+        """Подключение к базе данных (проверочное соединение из пула)"""
         try:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                port=self.port,
-                database=self.database,
-                user=self.user,
-                password=self.password,
-                autocommit=True,
-                connection_timeout=10,
-                pool_reset_session=True,
-                sql_mode='STRICT_TRANS_TABLES'
-            )
-            if self.connection.is_connected():
-                print(f"✅ Подключено к MySQL базе: {self.database}")
-                return True
+            with self._connection() as connection:
+                if connection.is_connected():
+                    print(f"✅ Подключено к MySQL базе: {self.database} (пул: {self.pool_size} соединений)")
+                    return True
         except Error as e:
             print(f"❌ Ошибка подключения к MySQL: {e}")
             return False
 
+    def ping(self):
+        """Проверка доступности БД (True - соединение из пула выполняет запрос)"""
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+                return True
+        except Error:
+            return False
+
     def disconnect(self):
-        """Отключение от базы данных"""
-        with self.lock:
-            if self.connection and self.connection.is_connected():
-                self.connection.close()
-                print("🔌 Отключено от MySQL")
-
-    def _ensure_connection(self):
-        """Проверка и восстановление подключения к БД"""
+        """
+        Отключение от базы данных
+
+        Свободные соединения закрываются сразу, выданные - при возврате (их поколение
+        устарело). Следующий запрос открывает соединения заново.
+        """
+        with self._pool_lock:
+            self._generation += 1
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _ in idle:
+            self._close_quietly(connection)
+        print("🔌 Отключено от MySQL")
+
+    @contextmanager
+    def _connection(self):
+        """
+        Взять соединение из пула на время операции
+
+        Ожидание свободного соединения ограничено DB_POOL_TIMEOUT секундами,
+        после чего выбрасывается PoolError.
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            with self._stats_lock:
+                self._timeouts += 1
+            raise PoolError(f"Нет свободных соединений в пуле за {self.pool_timeout} сек")
+
+        connection = None
+        generation = None
         try:
-            if self.connection is None or not self.connection.is_connected():
-                # Закрываем старое подключение если оно есть
-                try:
-                    if self.connection:
-                        self.connection.close()
-                except:
-                    pass
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self._checkouts += 1
+                self._in_use += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+                if waited > 0.001:
+                    self._waits += 1
 
-                # Пытаемся переподключиться
-                self.connection = mysql.connector.connect(
-                    host=self.host,
-                    port=self.port,
-                    database=self.database,
-                    user=self.user,
-                    password=self.password,
-                    autocommit=True,
-                    connection_timeout=10,
-                    pool_reset_session=True,
-                    sql_mode='STRICT_TRANS_TABLES'
-                )
-                if self.connection.is_connected():
-                    return True
-                else:
-                    return False
-            return True
-        except Error as e:
-            print(f"❌ Ошибка переподключения к MySQL: {e}")
-            return False
+            connection, generation = self._checkout()
+            yield connection
+        finally:
+            if connection is not None:
+                self._checkin(connection, generation)  # Возврат соединения в пул
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def job_lock(self, name):
+        """
+        Именованная блокировка MySQL (GET_LOCK) на время выполнения задачи
+
+        Блокировка держится соединением из пула до выхода из блока with, поэтому
+        задачу выполняет только один процесс (воркер) из всех подключенных к БД.
+
+        Yields:
+            True, если блокировка получена; False - задачу уже выполняет другой процесс
+        """
+        lock_name = f"apb_job:{name}"
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+            acquired = cursor.fetchone()[0] == 1
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                    cursor.fetchone()
+                cursor.close()
+
+    def pool_stats(self):
+        """Метрики пула соединений"""
+        with self._stats_lock:
+            return {
+                'pool_size': self.pool_size,
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'avg_wait_ms': round(self._total_wait / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 3),
+            }
 
     def initialize_tables(self):
         """Создание необходимых таблиц"""
-        with self.lock:
-            if not self._ensure_connection():
-                print("❌ Не удалось подключиться к БД для инициализации таблиц")
-                return False
-            try:
-                cursor = self.connection.cursor()
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
 
                 # Таблица состояний пользователей (APB)
-                cursor.execute("""
+                cursor.execute(f"""
                     CREATE TABLE IF NOT EXISTS user_states (
                         id INT AUTO_INCREMENT PRIMARY KEY,
                         user_name VARCHAR(255) NOT NULL UNIQUE,
@@ -104,9 +682,7 @@ class Database:
                         last_reset_date DATE,
                         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                        INDEX idx_user_name (user_name),
-                        INDEX idx_state (state),
-                        INDEX idx_last_entry_auth_time (last_entry_auth_time)
+                        {_index_definitions(USER_STATES_INDEXES)}
                     )
                 """)
 
@@ -120,18 +696,10 @@ class Database:
                     # Игнорируем ошибку если поле уже существует или ALTER не поддерживает IF NOT EXISTS
                     pass
 
-                try:
-                    cursor.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_last_entry_auth_time
-                        ON user_states(last_entry_auth_time)
-                    """)
-                except:
-                    pass
-
-                # Таблица логов событий
-                cursor.execute("""
+                # Таблица логов событий (секционирована по created_at)
+                cursor.execute(f"""
                     CREATE TABLE IF NOT EXISTS event_logs (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        id INT AUTO_INCREMENT,
                         user_name VARCHAR(255) NOT NULL,
                         terminal_ip VARCHAR(50) NOT NULL,
                         terminal_type ENUM('entry', 'exit') NOT NULL,
@@ -143,13 +711,13 @@ class Database:
                         state_before ENUM('inside', 'outside'),
                         state_after ENUM('inside', 'outside'),
                         door_opened BOOLEAN DEFAULT FALSE,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        INDEX idx_user_name (user_name),
-                        INDEX idx_terminal (terminal_ip),
-                        INDEX idx_created_at (created_at),
-                        INDEX idx_status_code (status_code),
-                        INDEX idx_is_violation (is_violation),
-                        INDEX idx_violation_date (is_violation, created_at)
+                        picture_sha256 CHAR(64) NULL,
+                        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (id, created_at),
+                        {_index_definitions(EVENT_LOGS_INDEXES)}
+                    )
+                    PARTITION BY RANGE (TO_DAYS(created_at)) (
+                        {_event_log_partitions(datetime.now().date(), self.partition_period, self.partitions_ahead)}
                     )
                 """)
 
@@ -170,30 +738,17 @@ class Database:
                 except:
                     pass
 
-                # Создаем индексы если их нет
                 try:
                     cursor.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_status_code
-                        ON event_logs(status_code)
-                    """)
-                except:
-                    pass
-
-                try:
-                    cursor.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_is_violation
-                        ON event_logs(is_violation)
+                        ALTER TABLE event_logs
+                        ADD COLUMN IF NOT EXISTS picture_sha256 CHAR(64) NULL
                     """)
                 except:
                     pass
 
-                try:
-                    cursor.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_violation_date
-                        ON event_logs(is_violation, created_at)
-                    """)
-                except:
-                    pass
+                # Приводим индексы существующих таблиц к текущему набору
+                self._sync_indexes(cursor, 'user_states', USER_STATES_INDEXES, USER_STATES_OBSOLETE_INDEXES)
+                self._sync_indexes(cursor, 'event_logs', EVENT_LOGS_INDEXES, EVENT_LOGS_OBSOLETE_INDEXES)
 
                 # Таблица конфигурации системы
                 cursor.execute("""
@@ -206,28 +761,89 @@ class Database:
                     )
                 """)
 
+                # Почасовая витрина событий по терминалу и коду статуса
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS event_rollup_hourly (
+                        bucket_hour DATETIME NOT NULL,
+                        terminal_ip VARCHAR(50) NOT NULL,
+                        terminal_type ENUM('entry', 'exit') NOT NULL,
+                        status_code VARCHAR(50) NOT NULL,
+                        is_violation BOOLEAN NOT NULL DEFAULT FALSE,
+                        events INT NOT NULL DEFAULT 0,
+                        doors_opened INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket_hour, terminal_ip, terminal_type, status_code),
+                        INDEX idx_violation_hour (is_violation, bucket_hour)
+                    )
+                """)
+
+                # Суточная витрина событий по пользователю
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS user_rollup_daily (
+                        day DATE NOT NULL,
+                        user_name VARCHAR(255) NOT NULL,
+                        terminal_type ENUM('entry', 'exit') NOT NULL,
+                        events INT NOT NULL DEFAULT 0,
+                        violations INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, user_name, terminal_type)
+                    )
+                """)
+
+                # Граница догоняющего заполнения витрин: события до нее учитывает
+                # backfill_rollups, после нее - запись события (фиксируется один раз)
+                cursor.execute(
+                    """INSERT IGNORE INTO system_config (config_key, config_value, description)
+                       SELECT %s, COALESCE(MAX(id), 0), 'Последний id event_logs до появления витрин'
+                       FROM event_logs""",
+                    (ROLLUP_BACKFILL_ID_KEY,)
+                )
+                cursor.execute(
+                    """INSERT IGNORE INTO system_config (config_key, config_value, description)
+                       VALUES (%s, '0', 'Водяной знак заполнения витрин (id event_logs)')""",
+                    (ROLLUP_WATERMARK_KEY,)
+                )
+
                 cursor.close()
                 print("✅ Таблицы инициализированы")
                 return True
-            except Error as e:
-                print(f"❌ Ошибка создания таблиц: {e}")
-                return False
+        except Error as e:
+            print(f"❌ Ошибка создания таблиц: {e}")
+            return False
+
+    def _sync_indexes(self, cursor, table, indexes, obsolete):
+        """
+        Добавить недостающие и удалить устаревшие индексы таблицы одним ALTER TABLE
+
+        Изменение выполняется без блокировки записи (ALGORITHM=INPLACE, LOCK=NONE),
+        но на большой таблице занимает время - при первом запуске после обновления.
+        """
+        cursor.execute(
+            """SELECT DISTINCT INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""",
+            (table,)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+
+        changes = [f"ADD INDEX {name} {columns}" for name, columns in indexes.items() if name not in existing]
+        changes += [f"DROP INDEX {name}" for name in obsolete if name in existing]
+        if not changes:
+            return
+
+        print(f"🔧 Индексы {table}: {', '.join(changes)}")
+        try:
+            cursor.execute(f"ALTER TABLE {table} {', '.join(changes)}, ALGORITHM=INPLACE, LOCK=NONE")
+        except Error as e:
+            # Таблица работает и со старым набором индексов - запуск не прерываем
+            print(f"⚠️  Не удалось обновить индексы {table}: {e}")
 
     def get_user_state(self, user_name):
         """
         Получить состояние пользователя
         Возвращает: ('inside' | 'outside', last_terminal, last_event_time, last_entry_auth_time)
         """
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения состояния пользователя: MySQL Connection not available")
-                return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
-            try:
-                cursor = self.connection.cursor()
-                cursor.execute(
-                    "SELECT state, last_terminal, last_event_time, last_reset_date, last_entry_auth_time FROM user_states WHERE user_name = %s",
-                    (user_name,)
-                )
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(USER_STATE_QUERY, (user_name,))
                 result = cursor.fetchone()
                 cursor.close()
 
@@ -241,45 +857,82 @@ class Database:
                     }
                 else:
                     # Пользователь не найден - создаем запись
-                    # Освобождаем блокировку перед рекурсивным вызовом
+                    # (после возврата соединения в пул)
                     pass
-            except Error as e:
-                print(f"❌ Ошибка получения состояния пользователя: {e}")
-                return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
+        except Error as e:
+            print(f"❌ Ошибка получения состояния пользователя: {e}")
+            return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
 
-        # Если пользователь не найден, создаем запись (вне блокировки)
+        # Если пользователь не найден, создаем запись
         return self.create_user_state(user_name)
 
+    def load_user_states(self, limit=50000):
+        """
+        Массовая загрузка состояний пользователей (для прогрева кэша)
+        Возвращает: список (user_name, dict состояния), от самых свежих к старым
+        """
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """SELECT user_name, state, last_terminal, last_event_time, last_reset_date, last_entry_auth_time
+                       FROM user_states
+                       ORDER BY updated_at DESC
+                       LIMIT %s""",
+                    (limit,)
+                )
+                results = cursor.fetchall()
+                cursor.close()
+                return [
+                    (row[0], {
+                        'state': row[1],
+                        'last_terminal': row[2],
+                        'last_event_time': row[3],
+                        'last_reset_date': row[4],
+                        'last_entry_auth_time': row[5]
+                    })
+                    for row in results
+                ]
+        except Error as e:
+            print(f"❌ Ошибка загрузки состояний: {e}")
+            return []
+
     def create_user_state(self, user_name):
         """Создать новую запись пользователя"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка создания пользователя: MySQL Connection not available")
-                return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
-            try:
-                cursor = self.connection.cursor()
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
                 today = datetime.now().date()
                 cursor.execute(
-                    """INSERT INTO user_states (user_name, state, last_reset_date)
+                    """INSERT IGNORE INTO user_states (user_name, state, last_reset_date)
                        VALUES (%s, 'outside', %s)""",
                     (user_name, today)
                 )
+                if cursor.rowcount == 0:
+                    # Запись уже создана параллельным событием - возвращаем ее
+                    cursor.execute(USER_STATE_QUERY, (user_name,))
+                    result = cursor.fetchone()
+                    cursor.close()
+                    return {
+                        'state': result[0],
+                        'last_terminal': result[1],
+                        'last_event_time': result[2],
+                        'last_reset_date': result[3],
+                        'last_entry_auth_time': result[4]
+                    }
                 cursor.close()
                 print(f"➕ Создан новый пользователь: {user_name}")
                 return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': today, 'last_entry_auth_time': None}
-            except Error as e:
-                print(f"❌ Ошибка создания пользователя: {e}")
-                return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
+        except Error as e:
+            print(f"❌ Ошибка создания пользователя: {e}")
+            return {'state': 'outside', 'last_terminal': None, 'last_event_time': None, 'last_reset_date': None, 'last_entry_auth_time': None}
 
-    def update_user_state(self, user_name, new_state, terminal_ip):
+    def update_user_state(self, user_name, new_state, terminal_ip, now=None):
         """Обновить состояние пользователя"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка обновления состояния: MySQL Connection not available")
-                return False
-            try:
-                cursor = self.connection.cursor()
-                now = datetime.now()
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                now = now or datetime.now()
                 today = now.date()
                 cursor.execute(
                     """UPDATE user_states
@@ -288,20 +941,46 @@ class Database:
                     (new_state, terminal_ip, now, today, user_name)
                 )
                 cursor.close()
+                self.bump_events_version()
                 return True
-            except Error as e:
-                print(f"❌ Ошибка обновления состояния: {e}")
-                return False
+        except Error as e:
+            print(f"❌ Ошибка обновления состояния: {e}")
+            return False
+
+    def sync_user_state(self, user_name, user_state):
+        """
+        Записать состояние пользователя целиком (upsert)
 
-    def update_entry_auth_time(self, user_name, terminal_ip):
+        Используется для переходов, принятых в памяти, пока БД была недоступна.
+        """
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """INSERT INTO user_states
+                       (user_name, state, last_terminal, last_event_time, last_reset_date, last_entry_auth_time)
+                       VALUES (%s, %s, %s, %s, %s, %s)
+                       ON DUPLICATE KEY UPDATE
+                           state = VALUES(state), last_terminal = VALUES(last_terminal),
+                           last_event_time = VALUES(last_event_time), last_reset_date = VALUES(last_reset_date),
+                           last_entry_auth_time = VALUES(last_entry_auth_time)""",
+                    (user_name, user_state.get('state') or 'outside', user_state.get('last_terminal'),
+                     user_state.get('last_event_time'), user_state.get('last_reset_date') or datetime.now().date(),
+                     user_state.get('last_entry_auth_time'))
+                )
+                cursor.close()
+                self.bump_events_version()
+                return True
+        except Error as e:
+            print(f"❌ Ошибка синхронизации состояния {user_name}: {e}")
+            return False
+
+    def update_entry_auth_time(self, user_name, terminal_ip, now=None):
         """Обновить время последней успешной аутентификации на терминале входа"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка обновления времени аутентификации: MySQL Connection not available")
-                return False
-            try:
-                cursor = self.connection.cursor()
-                now = datetime.now()
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                now = now or datetime.now()
                 cursor.execute(
                     """UPDATE user_states
                        SET last_entry_auth_time = %s, last_terminal = %s
@@ -309,300 +988,554 @@ class Database:
                     (now, terminal_ip, user_name)
                 )
                 cursor.close()
+                self.bump_events_version()
                 return True
-            except Error as e:
-                print(f"❌ Ошибка обновления времени аутентификации: {e}")
-                return False
+        except Error as e:
+            print(f"❌ Ошибка обновления времени аутентификации: {e}")
+            return False
+
+    def apply_transition(self, user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                         door_opened, window_seconds, now=None, write_log=True, picture_sha256=None):
+        """
+        Атомарный переход состояния APB в одной транзакции
+
+        upsert пользователя -> блокировка строки (SELECT ... FOR UPDATE) -> решение ->
+        запись состояния и строки event_logs -> COMMIT. Два почти одновременных события
+        одного пользователя (карта + лицо, два терминала) сериализуются на блокировке
+        строки, поэтому второе событие видит результат первого.
+
+        При write_log=False строка event_logs не пишется - ее записывает вызывающий
+        код (например, через асинхронный EventLogWriter). door_opened может быть
+        функцией decision -> bool: тогда признак открытия двери в строке event_logs
+        определяется по решению, принятому в этой транзакции.
+
+        Returns:
+            Словарь с решением (см. apb_logic.decide_transition), состоянием до события
+            ('state_before', 'last_entry_auth_time'), итоговым состоянием пользователя
+            ('user_state') и признаком открытия двери ('door_opened') или None при ошибке
+        """
+        try:
+            with self._connection() as connection:
+                try:
+                    now = now or datetime.now()
+                    today = now.date()
+                    connection.start_transaction()
+                    cursor = connection.cursor()
+
+                    # Создаем пользователя если его нет (без гонки на UNIQUE user_name)
+                    cursor.execute(
+                        """INSERT INTO user_states (user_name, state, last_reset_date)
+                           VALUES (%s, 'outside', %s)
+                           ON DUPLICATE KEY UPDATE user_name = user_name""",
+                        (user_name, today)
+                    )
+
+                    cursor.execute(USER_STATE_FOR_UPDATE_QUERY, (user_name,))
+                    row = cursor.fetchone()
+                    user_state = {
+                        'state': row[0],
+                        'last_terminal': row[1],
+                        'last_event_time': row[2],
+                        'last_reset_date': row[3],
+                        'last_entry_auth_time': row[4]
+                    }
+
+                    # Ленивый сброс: 'inside' до эпохи сброса исправляется этим же UPDATE
+                    stale = effective_state(user_state, row[5]) != user_state['state']
+                    if stale:
+                        user_state['state'] = 'outside'
+                        user_state['last_reset_date'] = today
+                    state_before = user_state['state']
+                    last_entry_auth_time = user_state['last_entry_auth_time']
+
+                    decision = decide_transition(
+                        state_before, last_entry_auth_time, terminal_type, window_seconds, now=now
+                    )
+                    new_state = decision['new_state']
+                    if callable(door_opened):
+                        door_opened = door_opened(decision)
+
+                    changed = apply_decision(user_state, decision, terminal_ip, terminal_type, now)
+
+                    if terminal_type == "entry" or changed or stale:
+                        cursor.execute(
+                            """UPDATE user_states
+                               SET state = %s, last_terminal = %s, last_event_time = %s,
+                                   last_reset_date = %s, last_entry_auth_time = %s
+                               WHERE user_name = %s""",
+                            (user_state['state'], user_state['last_terminal'], user_state['last_event_time'],
+                             user_state['last_reset_date'], user_state['last_entry_auth_time'], user_name)
+                        )
+
+                    if write_log:
+                        cursor.execute(
+                            """INSERT INTO event_logs
+                               (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                                action_taken, status_code, is_violation, state_before, state_after,
+                                door_opened, picture_sha256, created_at)
+                               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                            (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                             decision['action_taken'], decision['status_code'], decision['is_violation'],
+                             state_before, new_state, door_opened, picture_sha256, now)
+                        )
+                        self._write_rollups(cursor, [{
+                            'created_at': now, 'user_name': user_name, 'terminal_ip': terminal_ip,
+                            'terminal_type': terminal_type, 'status_code': decision['status_code'],
+                            'is_violation': decision['is_violation'], 'door_opened': door_opened,
+                        }])
+
+                    connection.commit()
+                    cursor.close()
+                    self.bump_events_version()
+
+                    decision['state_before'] = state_before
+                    decision['last_entry_auth_time'] = last_entry_auth_time
+                    decision['user_state'] = user_state
+                    decision['door_opened'] = door_opened
+                    return decision
+                except Error:
+                    try:
+                        connection.rollback()
+                    except Error:
+                        pass
+                    raise
+        except Error as e:
+            print(f"❌ Ошибка перехода состояния: {e}")
+            return None
+
+    def _write_rollups(self, cursor, events):
+        """Учесть события в витринах (в транзакции, где пишутся строки event_logs)"""
+        hourly_rows, users_rows = _rollup_rows(events)
+        cursor.executemany(ROLLUP_HOURLY_UPSERT, hourly_rows)
+        cursor.executemany(ROLLUP_USERS_UPSERT, users_rows)
 
     def log_event(self, user_name, terminal_ip, terminal_type, event_type, sub_event_type,
-                  action_taken, status_code, is_violation, state_before, state_after, door_opened):
+                  action_taken, status_code, is_violation, state_before, state_after, door_opened,
+                  picture_sha256=None):
         """Записать событие в лог"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка записи лога: MySQL Connection not available")
-                return False
-            try:
-                cursor = self.connection.cursor()
+        return self.log_events_batch([{
+            'user_name': user_name, 'terminal_ip': terminal_ip, 'terminal_type': terminal_type,
+            'event_type': event_type, 'sub_event_type': sub_event_type, 'action_taken': action_taken,
+            'status_code': status_code, 'is_violation': is_violation, 'state_before': state_before,
+            'state_after': state_after, 'door_opened': door_opened, 'picture_sha256': picture_sha256,
+            'created_at': datetime.now(),
+        }])
+
+    def log_events_batch(self, rows):
+        """
+        Записать пакет событий в лог одним многострочным INSERT
+
+        Строки event_logs и приращения витрин пишутся в одной транзакции.
+
+        Args:
+            rows: список словарей с полями event_logs (как у log_event + created_at)
+        """
+        if not rows:
+            return True
+        try:
+            with self._connection() as connection:
+                try:
+                    connection.start_transaction()
+                    cursor = connection.cursor()
+                    cursor.executemany(
+                        """INSERT INTO event_logs
+                           (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                            action_taken, status_code, is_violation, state_before, state_after,
+                            door_opened, picture_sha256, created_at)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                        [
+                            (row['user_name'], row['terminal_ip'], row['terminal_type'], row['event_type'],
+                             row['sub_event_type'], row['action_taken'], row['status_code'], row['is_violation'],
+                             row['state_before'], row['state_after'], row['door_opened'],
+                             row.get('picture_sha256'), row['created_at'])
+                            for row in rows
+                        ]
+                    )
+                    self._write_rollups(cursor, rows)
+                    connection.commit()
+                    cursor.close()
+                    self.bump_events_version()
+                    return True
+                except Error:
+                    try:
+                        connection.rollback()
+                    except Error:
+                        pass
+                    raise
+        except Error as e:
+            print(f"❌ Ошибка записи лога: {e}" if len(rows) == 1 else f"❌ Ошибка пакетной записи лога: {e}")
+            return False
+
+    def backfill_rollups(self, batch_size=10000):
+        """
+        Догоняющее заполнение витрин по событиям, записанным до их появления
+
+        Один пакет: строки event_logs с id в (водяной знак, водяной знак + batch_size],
+        не дальше границы rollup_backfill_id. Приращения витрин и новый водяной знак
+        фиксируются одной транзакцией, поэтому прерванный пакет не учитывается дважды.
+
+        Returns:
+            Число пройденных id (меньше batch_size - заполнение завершено)
+        """
+        try:
+            with self._connection() as connection:
+                try:
+                    connection.start_transaction()
+                    cursor = connection.cursor()
+                    cursor.execute(
+                        """SELECT config_key, CAST(config_value AS UNSIGNED) FROM system_config
+                           WHERE config_key IN (%s, %s) FOR UPDATE""",
+                        (ROLLUP_BACKFILL_ID_KEY, ROLLUP_WATERMARK_KEY)
+                    )
+                    marks = dict(cursor.fetchall())
+                    watermark = marks.get(ROLLUP_WATERMARK_KEY, 0)
+                    upper = min(watermark + batch_size, marks.get(ROLLUP_BACKFILL_ID_KEY, 0))
+                    if upper <= watermark:
+                        connection.commit()
+                        cursor.close()
+                        return 0
+
+                    cursor.execute(
+                        """INSERT INTO event_rollup_hourly
+                           (bucket_hour, terminal_ip, terminal_type, status_code, is_violation, events, doors_opened)
+                           SELECT TIMESTAMP(DATE(created_at), MAKETIME(HOUR(created_at), 0, 0)) as bucket,
+                                  terminal_ip, terminal_type, COALESCE(status_code, 'UNKNOWN') as code,
+                                  MAX(COALESCE(is_violation, FALSE)), COUNT(*), SUM(COALESCE(door_opened, FALSE))
+                           FROM event_logs
+                           WHERE id > %s AND id <= %s
+                           GROUP BY bucket, terminal_ip, terminal_type, code
+                           ON DUPLICATE KEY UPDATE
+                               is_violation = VALUES(is_violation),
+                               events = events + VALUES(events),
+                               doors_opened = doors_opened + VALUES(doors_opened)""",
+                        (watermark, upper)
+                    )
+                    cursor.execute(
+                        """INSERT INTO user_rollup_daily (day, user_name, terminal_type, events, violations)
+                           SELECT DATE(created_at) as event_day, user_name, terminal_type,
+                                  COUNT(*), SUM(COALESCE(is_violation, FALSE))
+                           FROM event_logs
+                           WHERE id > %s AND id <= %s
+                           GROUP BY event_day, user_name, terminal_type
+                           ON DUPLICATE KEY UPDATE
+                               events = events + VALUES(events),
+                               violations = violations + VALUES(violations)""",
+                        (watermark, upper)
+                    )
+                    cursor.execute(
+                        "UPDATE system_config SET config_value = %s WHERE config_key = %s",
+                        (str(upper), ROLLUP_WATERMARK_KEY)
+                    )
+                    connection.commit()
+                    cursor.close()
+                    self.bump_events_version()
+                    return upper - watermark
+                except Error:
+                    try:
+                        connection.rollback()
+                    except Error:
+                        pass
+                    raise
+        except Error as e:
+            print(f"❌ Ошибка заполнения витрин: {e}")
+            return 0
+
+    def get_reset_epoch(self):
+        """Текущая эпоха сброса состояний (datetime или None, если сброса еще не было)"""
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
                 cursor.execute(
-                    """INSERT INTO event_logs
-                       (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
-                        action_taken, status_code, is_violation, state_before, state_after, door_opened)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (user_name, terminal_ip, terminal_type, event_type, sub_event_type,
-                     action_taken, status_code, is_violation, state_before, state_after, door_opened)
+                    "SELECT config_value FROM system_config WHERE config_key = %s",
+                    (RESET_EPOCH_KEY,)
                 )
+                result = cursor.fetchone()
                 cursor.close()
-                return True
-            except Error as e:
-                print(f"❌ Ошибка записи лога: {e}")
-                return False
-
-    def reset_daily_states(self):
-        """Сброс всех состояний на 'outside' (вызывается раз в день)"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка сброса состояний: MySQL Connection not available")
-                return 0
-            try:
-                cursor = self.connection.cursor()
-                today = datetime.now().date()
+                return datetime.strptime(result[0], RESET_EPOCH_FORMAT) if result else None
+        except (Error, ValueError) as e:
+            print(f"❌ Ошибка чтения эпохи сброса: {e}")
+            return None
+
+    def reset_daily_states(self, epoch=None):
+        """
+        Сброс всех состояний на 'outside' за O(1): сдвиг эпохи сброса
+
+        Эпоха только увеличивается (GREATEST), поэтому повторный сброс на ту же
+        границу из нескольких процессов ничего не меняет.
+
+        Args:
+            epoch: граница сброса (по умолчанию - текущее время)
+
+        Returns:
+            Число пользователей внутри, которые после сброса считаются снаружи
+        """
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                epoch = (epoch or datetime.now()).replace(microsecond=0)
                 cursor.execute(
-                    """UPDATE user_states
-                       SET state = 'outside', last_reset_date = %s
-                       WHERE last_reset_date < %s OR last_reset_date IS NULL""",
-                    (today, today)
+                    """INSERT INTO system_config (config_key, config_value, description)
+                       VALUES (%s, %s, 'Эпоха ежедневного сброса состояний APB')
+                       ON DUPLICATE KEY UPDATE config_value = GREATEST(config_value, VALUES(config_value))""",
+                    (RESET_EPOCH_KEY, epoch.strftime(RESET_EPOCH_FORMAT))
+                )
+                cursor.execute(
+                    f"""SELECT COUNT(*) FROM user_states
+                       WHERE state = 'inside'
+                         AND (last_event_time IS NULL OR last_event_time < {RESET_EPOCH_SUBQUERY})"""
                 )
+                affected_rows = cursor.fetchone()[0]
+                cursor.close()
+                self.bump_events_version()
+                print(f"🔄 Эпоха сброса: {epoch.strftime(RESET_EPOCH_FORMAT)}, сброшено состояний: {affected_rows}")
+                return affected_rows
+        except Error as e:
+            print(f"❌ Ошибка сброса состояний: {e}")
+            return 0
+
+    def cleanup_stale_states(self, batch_size=1000):
+        """
+        Физическая очистка состояний, устаревших по эпохе сброса, одним небольшим пакетом
+
+        Returns:
+            Число исправленных строк (меньше batch_size - очистка завершена)
+        """
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(CLEANUP_STALE_STATES_QUERY, (batch_size,))
                 affected_rows = cursor.rowcount
                 cursor.close()
-                print(f"🔄 Сброшено состояний: {affected_rows}")
                 return affected_rows
-            except Error as e:
-                print(f"❌ Ошибка сброса состояний: {e}")
-                return 0
+        except Error as e:
+            print(f"❌ Ошибка очистки устаревших состояний: {e}")
+            return 0
 
-    def get_all_users_inside(self):
-        """Получить всех пользователей внутри здания"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения пользователей внутри: MySQL Connection not available")
-                return []
-            try:
-                cursor = self.connection.cursor()
+    def manage_event_log_partitions(self, now=None):
+        """
+        Обслуживание секций event_logs: создание секций вперед и удаление старых
+
+        Новые секции выделяются из пустой p_future (REORGANIZE без переноса строк).
+        При EVENT_LOG_RETENTION_DAYS > 0 секции, все строки которых старше срока
+        хранения, удаляются целиком (DROP PARTITION) вместо DELETE.
+
+        Returns:
+            {'added': [...], 'dropped': [...]} или None (таблица не секционирована / ошибка)
+        """
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
                 cursor.execute(
-                    "SELECT user_name, last_terminal, last_event_time FROM user_states WHERE state = 'inside'"
+                    """SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+                       FROM INFORMATION_SCHEMA.PARTITIONS
+                       WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'event_logs'
+                       ORDER BY PARTITION_ORDINAL_POSITION"""
                 )
-                results = cursor.fetchall()
+                partitions = cursor.fetchall()
+                if not partitions or partitions[0][0] is None:
+                    cursor.close()
+                    print("⚠️  Таблица event_logs не секционирована - см. миграцию в setup_database.sql")
+                    return None
+
+                today = (now or datetime.now()).date()
+                bounds = {name: int(description) for name, description in partitions if description != "MAXVALUE"}
+                has_future = len(bounds) < len(partitions)
+                max_bound = max(bounds.values(), default=0)
+
+                # Секции на текущий период и partitions_ahead периодов вперед
+                added = []
+                clauses = []
+                start = _period_start(today, self.partition_period)
+                for _ in range(self.partitions_ahead + 1):
+                    if _to_days(_next_period(start, self.partition_period)) > max_bound:
+                        name, clause = _partition_clause(start, self.partition_period)
+                        added.append(name)
+                        clauses.append(clause)
+                    start = _next_period(start, self.partition_period)
+
+                if clauses:
+                    if has_future:
+                        cursor.execute(
+                            f"""ALTER TABLE event_logs REORGANIZE PARTITION {EVENT_LOG_FUTURE_PARTITION} INTO (
+                                {", ".join(clauses)},
+                                PARTITION {EVENT_LOG_FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"""
+                        )
+                    else:
+                        cursor.execute(f"ALTER TABLE event_logs ADD PARTITION ({', '.join(clauses)})")
+                    print(f"🗂️  Созданы секции event_logs: {', '.join(added)}")
+
+                # Срок хранения: секции, верхняя граница которых не позже границы хранения
+                dropped = []
+                if self.event_log_retention_days > 0:
+                    cutoff = _to_days(today - timedelta(days=self.event_log_retention_days))
+                    dropped = [name for name, bound in bounds.items() if bound <= cutoff]
+                    if dropped:
+                        cursor.execute(f"ALTER TABLE event_logs DROP PARTITION {', '.join(dropped)}")
+                        self.bump_events_version()
+                        print(f"🗑️  Удалены секции event_logs старше {self.event_log_retention_days} дн.: {', '.join(dropped)}")
+
                 cursor.close()
-                return results
-            except Error as e:
-                print(f"❌ Ошибка получения пользователей внутри: {e}")
-                return []
+                return {'added': added, 'dropped': dropped}
+        except Error as e:
+            print(f"❌ Ошибка обслуживания секций event_logs: {e}")
+            return None
 
-    def get_statistics(self, start_date=None, end_date=None):
-        """Получить статистику событий за период"""
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения статистики: MySQL Connection not available")
-                return []
+    def iter_rows(self, query, params=None, fetch_size=1000, net_write_timeout=600):
+        """
+        Потоковое чтение результата запроса (словари строк) на отдельном соединении
+
+        Соединение открывается вне пула: долгое чтение не занимает соединения
+        обработки событий. Курсор небуферизованный - строки приходят с сервера
+        пачками по fetch_size, в памяти не больше одной пачки. net_write_timeout
+        (сек) - сколько сервер ждет медленного клиента выгрузки.
+
+        Соединение закрывается, когда генератор исчерпан или закрыт (обрыв клиента).
+        """
+        connection = mysql_connect(
+            host=self.host,
+            port=self.port,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            autocommit=True,
+            connection_timeout=10
+        )
+        try:
+            session = connection.cursor()
+            session.execute("SET SESSION net_write_timeout = %s", (net_write_timeout,))
+            session.close()
+
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+        finally:
             try:
-                cursor = self.connection.cursor(dictionary=True)
-                query = """
-                    SELECT
-                        DATE(created_at) as date,
-                        terminal_type,
-                        COUNT(*) as total_events,
-                        COUNT(DISTINCT user_name) as unique_users,
-                        SUM(door_opened) as doors_opened
-                    FROM event_logs
-                """
-                params = []
+                # При обрыве выгрузки непрочитанный результат отбрасывается вместе с соединением
+                connection.close()
+            except Error:
+                pass
 
-                if start_date and end_date:
-                    query += " WHERE created_at BETWEEN %s AND %s"
-                    params = [start_date, end_date]
-                elif start_date:
-                    query += " WHERE created_at >= %s"
-                    params = [start_date]
+    def get_all_users_inside(self):
+        """Получить всех пользователей внутри здания (None при ошибке)"""
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(USERS_INSIDE_QUERY)
+                results = cursor.fetchall()
+                cursor.close()
+                return results
+        except Error as e:
+            print(f"❌ Ошибка получения пользователей внутри: {e}")
+            return None
 
-                query += " GROUP BY DATE(created_at), terminal_type ORDER BY date DESC"
+    def get_statistics(self, start_date=None, end_date=None):
+        """Получить статистику событий за период (из витрин); None при ошибке"""
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                query, params = build_statistics_query(start_date, end_date)
 
                 cursor.execute(query, params)
                 results = cursor.fetchall()
                 cursor.close()
                 return results
-            except Error as e:
-                print(f"❌ Ошибка получения статистики: {e}")
-                return []
+        except Error as e:
+            print(f"❌ Ошибка получения статистики: {e}")
+            return None
 
-    def get_apb_violations(self, start_date=None, end_date=None, user_name=None):
+    def get_apb_violations(self, start_date=None, end_date=None, user_name=None, cursor=None, limit=None):
         """
-        Получить все нарушения APB (попытки входа когда уже внутри)
+        Получить страницу нарушений APB (попытки входа когда уже внутри)
 
         Args:
             start_date: Начальная дата (опционально)
             end_date: Конечная дата (опционально)
             user_name: Имя пользователя для фильтрации (опционально)
+            cursor: Курсор следующей страницы из предыдущего ответа (опционально)
+            limit: Размер страницы (опционально, не больше VIOLATIONS_MAX_PAGE_SIZE)
 
         Returns:
-            Список нарушений с детальной информацией
-        """
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения нарушений: MySQL Connection not available")
-                return []
-            try:
-                cursor = self.connection.cursor(dictionary=True)
-                query = """
-                    SELECT
-                        id,
-                        user_name,
-                        terminal_ip,
-                        terminal_type,
-                        status_code,
-                        action_taken,
-                        state_before,
-                        state_after,
-                        created_at
-                    FROM event_logs
-                    WHERE is_violation = TRUE
-                """
-                params = []
-
-                if user_name:
-                    query += " AND user_name = %s"
-                    params.append(user_name)
-
-                if start_date and end_date:
-                    query += " AND created_at BETWEEN %s AND %s"
-                    params.extend([start_date, end_date])
-                elif start_date:
-                    query += " AND created_at >= %s"
-                    params.append(start_date)
-                elif end_date:
-                    query += " AND created_at <= %s"
-                    params.append(end_date)
+            (список нарушений, курсор следующей страницы или None) или None при ошибке
 
-                query += " ORDER BY created_at DESC"
-
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-                cursor.close()
-                return results
-            except Error as e:
-                print(f"❌ Ошибка получения нарушений: {e}")
-                return []
+        Raises:
+            ValueError: некорректный курсор или размер страницы
+        """
+        return self._violations_page(start_date, end_date, user_name=user_name, cursor=cursor, limit=limit)
 
-    def get_violations_by_status_code(self, status_code, start_date=None, end_date=None):
+    def get_violations_by_status_code(self, status_code, start_date=None, end_date=None, cursor=None, limit=None):
         """
-        Получить нарушения по коду статуса
+        Получить страницу нарушений по коду статуса
 
         Args:
             status_code: Код статуса (например, 'DENIED_ALREADY_INSIDE')
             start_date: Начальная дата (опционально)
             end_date: Конечная дата (опционально)
+            cursor: Курсор следующей страницы из предыдущего ответа (опционально)
+            limit: Размер страницы (опционально, не больше VIOLATIONS_MAX_PAGE_SIZE)
 
         Returns:
-            Список нарушений с указанным кодом статуса
-        """
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения нарушений по статусу: MySQL Connection not available")
-                return []
-            try:
-                cursor = self.connection.cursor(dictionary=True)
-                query = """
-                    SELECT
-                        id,
-                        user_name,
-                        terminal_ip,
-                        terminal_type,
-                        status_code,
-                        action_taken,
-                        state_before,
-                        state_after,
-                        created_at
-                    FROM event_logs
-                    WHERE status_code = %s AND is_violation = TRUE
-                """
-                params = [status_code]
-
-                if start_date and end_date:
-                    query += " AND created_at BETWEEN %s AND %s"
-                    params.extend([start_date, end_date])
-                elif start_date:
-                    query += " AND created_at >= %s"
-                    params.append(start_date)
-                elif end_date:
-                    query += " AND created_at <= %s"
-                    params.append(end_date)
+            (список нарушений, курсор следующей страницы или None) или None при ошибке
 
-                query += " ORDER BY created_at DESC"
+        Raises:
+            ValueError: некорректный курсор или размер страницы
+        """
+        return self._violations_page(start_date, end_date, status_code=status_code, cursor=cursor, limit=limit)
 
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-                cursor.close()
-                return results
-            except Error as e:
-                print(f"❌ Ошибка получения нарушений по статусу: {e}")
-                return []
+    def _violations_page(self, start_date, end_date, user_name=None, status_code=None, cursor=None, limit=None):
+        limit = page_limit(limit)
+        query, params = build_violations_query(
+            start_date, end_date, user_name=user_name, status_code=status_code, cursor=cursor, limit=limit
+        )
+        try:
+            with self._connection() as connection:
+                db_cursor = connection.cursor(dictionary=True)
+                db_cursor.execute(query, params)
+                results = db_cursor.fetchall()
+                db_cursor.close()
+                return violations_page(results, limit)
+        except Error as e:
+            print(f"❌ Ошибка получения нарушений: {e}")
+            return None
 
     def get_violation_statistics(self, start_date=None, end_date=None):
         """
         Получить статистику нарушений APB
 
         Returns:
-            Словарь со статистикой нарушений
+            Словарь со статистикой нарушений или None при ошибке
         """
-        with self.lock:
-            if not self._ensure_connection():
-                print(f"❌ Ошибка получения статистики нарушений: MySQL Connection not available")
-                return {}
-            try:
-                cursor = self.connection.cursor(dictionary=True)
-
-                # Базовый запрос
-                base_query = "FROM event_logs WHERE is_violation = TRUE"
-                params = []
-
-                if start_date and end_date:
-                    base_query += " AND created_at BETWEEN %s AND %s"
-                    params.extend([start_date, end_date])
-                elif start_date:
-                    base_query += " AND created_at >= %s"
-                    params.append(start_date)
-                elif end_date:
-                    base_query += " AND created_at <= %s"
-                    params.append(end_date)
-
-                # Общее количество нарушений
-                cursor.execute(f"SELECT COUNT(*) as total {base_query}", params)
-                total = cursor.fetchone()['total']
+        try:
+            with self._connection() as connection:
+                cursor = connection.cursor(dictionary=True)
 
-                # Нарушения по коду статуса
-                cursor.execute(f"""
-                    SELECT
-                        status_code,
-                        COUNT(*) as count
-                    {base_query}
-                    GROUP BY status_code
-                    ORDER BY count DESC
-                """, params)
-                by_status = cursor.fetchall()
+                queries = build_violation_statistics_queries(start_date, end_date)
 
-                # Нарушения по пользователю
-                cursor.execute(f"""
-                    SELECT
-                        user_name,
-                        COUNT(*) as count
-                    {base_query}
-                    GROUP BY user_name
-                    ORDER BY count DESC
-                    LIMIT 10
-                """, params)
-                by_user = cursor.fetchall()
+                query, params = queries['total_violations']
+                cursor.execute(query, params)
+                total = cursor.fetchone()['total']
 
-                # Нарушения по терминалу
-                cursor.execute(f"""
-                    SELECT
-                        terminal_ip,
-                        COUNT(*) as count
-                    {base_query}
-                    GROUP BY terminal_ip
-                    ORDER BY count DESC
-                """, params)
-                by_terminal = cursor.fetchall()
+                results = {}
+                for section in ('by_status_code', 'top_violators', 'by_terminal'):
+                    query, params = queries[section]
+                    cursor.execute(query, params)
+                    results[section] = cursor.fetchall()
 
                 cursor.close()
 
                 return {
                     'total_violations': total,
-                    'by_status_code': by_status,
-                    'top_violators': by_user,
-                    'by_terminal': by_terminal
+                    'by_status_code': results['by_status_code'],
+                    'top_violators': results['top_violators'],
+                    'by_terminal': results['by_terminal']
                 }
-            except Error as e:
-                print(f"❌ Ошибка получения статистики нарушений: {e}")
-                return {}
+        except Error as e:
+            print(f"❌ Ошибка получения статистики нарушений: {e}")
+            return None
 
 
 # Глобальный экземпляр базы данных
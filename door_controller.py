@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Команды NET_DVR_ControlGateway
+GATEWAY_OPEN = 1
+GATEWAY_CLOSE = 3
+
+
+class DoorController:
+    """
+    Управление дверями: фиксированный пул рабочих потоков + куча таймеров закрытия
+
+    Вместо отдельного спящего потока на каждое открытие команда открытия ставится
+    в ограниченную очередь, а закрытие планируется в куче таймеров. Повторное
+    открытие той же двери продлевает закрытие (старый таймер становится неактуальным),
+    поэтому на каждую дверь приходится не более одного активного таймера.
+
+    Рабочие потоки не ждут ответа терминала: команда передается в полосу SDK
+    терминала, а результат (метрики, таймер закрытия) обрабатывается в обратном
+    вызове. Зависший терминал не задерживает двери других терминалов.
+
+    Args:
+        send_command: функция (terminal_ip, door_no, command, callback) -> bool,
+            ставящая команду NET_DVR_ControlGateway в очередь терминала без ожидания
+            (False - команда не принята); callback(ok) вызывается по завершении
+    """
+
+    def __init__(self, send_command, workers=None, queue_size=None):
+        self.send_command = send_command
+        self.workers = workers or int(os.getenv("DOOR_WORKERS", 4))
+        self._commands = queue.Queue(maxsize=queue_size or int(os.getenv("DOOR_QUEUE_SIZE", 1000)))
+        self._timers = []  # (due, seq, terminal_ip, door_no)
+        self._close_due = {}  # (terminal_ip, door_no) -> due актуального таймера
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._in_flight = 0  # Команды, переданные терминалам и еще не завершенные
+        self._flight = threading.Condition()
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._opens_sent = 0
+        self._open_failures = 0
+        self._closes_sent = 0
+        self._close_failures = 0
+        self._extended = 0
+        self._rejected = 0
+
+    def start(self):
+        """Запуск рабочих потоков и потока таймеров"""
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"door-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._timer_loop, name="door-timers", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """
+        Остановка: все двери, ожидающие закрытия, закрываются немедленно
+
+        Возвращается после выполнения переданных терминалам команд (в том числе
+        закрытий), но не позже чем через timeout секунд - после этого можно
+        выходить из сессий SDK.
+        """
+        if not self._running:
+            return
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            pending = list(self._close_due.keys())
+            self._close_due.clear()
+            self._timers.clear()
+            self._running = False
+            self._cond.notify_all()
+
+        for terminal_ip, door_no in pending:
+            self._close(terminal_ip, door_no)
+
+        for _ in range(self.workers):
+            self._commands.put(None)
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+
+        with self._flight:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"⚠️  Остановка дверей: не дождались команд терминалам: {self._in_flight}")
+                    break
+                self._flight.wait(remaining)
+
+    def open_door(self, terminal_ip, door_no, open_time):
+        """Поставить открытие двери в очередь (закрытие через open_time секунд)"""
+        try:
+            self._commands.put_nowait((GATEWAY_OPEN, terminal_ip, door_no, open_time))
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            print(f"⚠️  Очередь управления дверями переполнена - открытие {terminal_ip} отклонено")
+            return False
+
+    def _worker(self):
+        """Рабочий поток: выполняет команды открытия и закрытия"""
+        while True:
+            item = self._commands.get()
+            if item is None:
+                break
+            command, terminal_ip, door_no, open_time = item
+            try:
+                if command == GATEWAY_OPEN:
+                    self._open(terminal_ip, door_no, open_time)
+                else:
+                    self._close(terminal_ip, door_no)
+            except Exception as e:
+                print(f"❌ Ошибка управления дверью на {terminal_ip}: {e}")
+
+    def _send(self, terminal_ip, door_no, command, on_done):
+        """
+        Передать команду терминалу без ожидания; on_done(ok) вызывается по завершении
+        (сразу с False, если команда не принята). Учитывается в _in_flight до on_done.
+        """
+        with self._flight:
+            self._in_flight += 1
+
+        def finish(ok):
+            try:
+                on_done(ok)
+            finally:
+                with self._flight:
+                    self._in_flight -= 1
+                    self._flight.notify_all()
+
+        try:
+            accepted = self.send_command(terminal_ip, door_no, command, finish)
+        except Exception as e:
+            print(f"❌ Ошибка управления дверью на {terminal_ip}: {e}")
+            accepted = False
+        if not accepted:
+            finish(False)
+
+    def _open(self, terminal_ip, door_no, open_time):
+        print(f"🔓 Открываем дверь на {terminal_ip} (дверь {door_no}) на {open_time} сек...")
+        self._send(
+            terminal_ip, door_no, GATEWAY_OPEN,
+            lambda ok: self._on_opened(terminal_ip, door_no, open_time, ok)
+        )
+
+    def _on_opened(self, terminal_ip, door_no, open_time, ok):
+        """Результат открытия: метрики и таймер закрытия"""
+        if not ok:
+            with self._stats_lock:
+                self._open_failures += 1
+            print(f"⚠️  Не удалось открыть дверь на {terminal_ip}")
+            print(f"ℹ️  Возможно терминал отключился - проверьте подключение")
+            return
+
+        with self._stats_lock:
+            self._opens_sent += 1
+
+        due = time.monotonic() + open_time
+        key = (terminal_ip, door_no)
+        with self._cond:
+            if not self._running:
+                # Остановка уже прошла - закрываем сразу, таймеров больше нет
+                schedule = False
+            else:
+                schedule = True
+                if key in self._close_due:
+                    with self._stats_lock:
+                        self._extended += 1
+                self._close_due[key] = due
+                heapq.heappush(self._timers, (due, next(self._seq), terminal_ip, door_no))
+                self._cond.notify()
+        if not schedule:
+            self._close(terminal_ip, door_no)
+
+    def _close(self, terminal_ip, door_no):
+        self._send(terminal_ip, door_no, GATEWAY_CLOSE, lambda ok: self._on_closed(terminal_ip, ok))
+
+    def _on_closed(self, terminal_ip, ok):
+        """Результат закрытия: метрики"""
+        with self._stats_lock:
+            if ok:
+                self._closes_sent += 1
+            else:
+                self._close_failures += 1
+        if ok:
+            print(f"🚪 Дверь на {terminal_ip} снова закрыта")
+
+    def _timer_loop(self):
+        """Поток таймеров: ждет ближайший срок закрытия и отдает закрытие рабочим потокам"""
+        while True:
+            with self._cond:
+                while self._running and not self._timers:
+                    self._cond.wait()
+                if not self._running:
+                    return
+
+                due, _, terminal_ip, door_no = self._timers[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._timers)
+                key = (terminal_ip, door_no)
+                if self._close_due.get(key) != due:
+                    # Дверь была открыта повторно - закрытие перенесено на более поздний срок
+                    continue
+                del self._close_due[key]
+
+            try:
+                self._commands.put_nowait((GATEWAY_CLOSE, terminal_ip, door_no, None))
+            except queue.Full:
+                # Закрытие важнее новых открытий - выполняем сразу
+                self._close(terminal_ip, door_no)
+
+    def stats(self):
+        """Метрики управления дверями"""
+        with self._cond:
+            pending_closes = len(self._close_due)
+            timers = len(self._timers)
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'pending_opens': self._commands.qsize(),
+                'pending_closes': pending_closes,
+                'in_flight': self._in_flight,
+                'timer_heap_size': timers,
+                'opens_sent': self._opens_sent,
+                'open_failures': self._open_failures,
+                'closes_sent': self._closes_sent,
+                'close_failures': self._close_failures,
+                'extended': self._extended,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Заголовок записи: длина данных (uint32), время события (float64), флаги (uint8)
+RECORD_HEADER = struct.Struct(">IdB")
+FLAG_COMPRESSED = 0x01
+
+INDEX_FILE = "index.json"
+
+
+class EventArchive:
+    """
+    Архив сырых событий терминалов в сегментированных append-only файлах
+
+    Вместо каталога logs/<timestamp>/ с отдельными JSON файлами на каждый запрос
+    событие записывается одной записью с префиксом длины в текущий сегмент.
+    Сегменты ротируются по размеру и возрасту, небольшой индекс (index.json)
+    хранит диапазон времени каждого сегмента для поиска по периоду, старые
+    сегменты удаляются целиком по политике хранения.
+
+    Поток обработки запроса только ставит событие в очередь - запись на диск
+    выполняет фоновый поток.
+    """
+
+    _STOP = object()
+
+    def __init__(self, directory=None, segment_max_bytes=None, segment_max_age=None,
+                 retention_days=None, compress=None, queue_size=None):
+        self.directory = directory or os.getenv("ARCHIVE_DIR", "logs/archive")
+        self.segment_max_bytes = segment_max_bytes or int(os.getenv("ARCHIVE_SEGMENT_MB", 64)) * 1024 * 1024
+        self.segment_max_age = segment_max_age or int(os.getenv("ARCHIVE_SEGMENT_MAX_AGE", 3600))
+        # 0 - хранить бессрочно
+        if retention_days is None:
+            retention_days = int(os.getenv("ARCHIVE_RETENTION_DAYS", 90))
+        self.retention_days = retention_days
+        if compress is None:
+            compress = os.getenv("ARCHIVE_COMPRESS", "true").lower() == "true"
+        self.compress = compress
+        self._queue = queue.Queue(maxsize=queue_size or int(os.getenv("ARCHIVE_QUEUE_SIZE", 10000)))
+        self._thread = None
+
+        self._index_lock = threading.Lock()
+        self._index = {}
+        self._segment = None  # Открытый файл текущего сегмента
+        self._segment_name = None
+        self._segment_opened = 0.0
+        self._rotate_requested = False
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._appended = 0
+        self._written = 0
+        self._dropped = 0
+        self._bytes_written = 0
+        self._segments_removed = 0
+        self._loaded = False
+
+    # ---------- Индекс ----------
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _ensure_loaded(self):
+        """Загрузить индекс с диска при первом обращении (не при импорте)"""
+        with self._index_lock:
+            if self._loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+            self._loaded = True
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {}
+
+        # Сегменты, которых нет в индексе (например, после аварийной остановки)
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name not in self._index:
+                self._index[name] = self._scan_segment(name)
+
+    def _save_index(self):
+        """Атомарная запись индекса (вызывать под self._index_lock)"""
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path())
+
+    def _scan_segment(self, name):
+        """Восстановить запись индекса по содержимому сегмента"""
+        entry = {'first_ts': None, 'last_ts': None, 'records': 0, 'bytes': 0}
+        for ts, _ in self._read_segment(name):
+            if entry['first_ts'] is None:
+                entry['first_ts'] = ts
+            entry['last_ts'] = ts
+            entry['records'] += 1
+        try:
+            entry['bytes'] = os.path.getsize(os.path.join(self.directory, name))
+        except OSError:
+            pass
+        return entry
+
+    # ---------- Запись ----------
+
+    def start(self):
+        """Запуск фонового потока записи"""
+        self._ensure_loaded()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="event-archive", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Остановка с записью очереди и закрытием текущего сегмента"""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def append(self, record, ts=None):
+        """Поставить событие (словарь, сериализуемый в JSON) в очередь на запись"""
+        try:
+            self._queue.put_nowait((ts or time.time(), record))
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+        with self._stats_lock:
+            self._appended += 1
+        return True
+
+    def _open_segment(self, ts):
+        name = f"segment-{datetime.fromtimestamp(ts).strftime('%Y%m%d_%H%M%S_%f')}.log"
+        self._segment = open(os.path.join(self.directory, name), "ab")
+        self._segment_name = name
+        self._segment_opened = time.monotonic()
+        with self._index_lock:
+            self._index[name] = {'first_ts': None, 'last_ts': None, 'records': 0, 'bytes': 0}
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._segment.close()
+        self._segment = None
+        self._segment_name = None
+        with self._index_lock:
+            self._save_index()
+
+    def rotate(self):
+        """Закрыть текущий сегмент при ближайшей записи или паузе (например, по расписанию в полночь)"""
+        self._rotate_requested = True
+
+    def _should_rotate(self):
+        if self._segment is None:
+            return False
+        if self._rotate_requested:
+            self._rotate_requested = False
+            return True
+        with self._index_lock:
+            size = self._index[self._segment_name]['bytes']
+        return (size >= self.segment_max_bytes or
+                time.monotonic() - self._segment_opened >= self.segment_max_age)
+
+    def _write(self, ts, record):
+        payload = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")
+        flags = 0
+        if self.compress and len(payload) > 256:
+            payload = zlib.compress(payload)
+            flags |= FLAG_COMPRESSED
+
+        if self._should_rotate():
+            self._close_segment()
+            self.apply_retention()
+        if self._segment is None:
+            self._open_segment(ts)
+
+        data = RECORD_HEADER.pack(len(payload), ts, flags) + payload
+        self._segment.write(data)
+
+        with self._index_lock:
+            entry = self._index[self._segment_name]
+            if entry['first_ts'] is None:
+                entry['first_ts'] = ts
+            entry['last_ts'] = ts
+            entry['records'] += 1
+            entry['bytes'] += len(data)
+        with self._stats_lock:
+            self._written += 1
+            self._bytes_written += len(data)
+
+    def _run(self):
+        """Цикл фонового потока: пишет записи, сбрасывает буфер и индекс в паузах"""
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._segment is not None:
+                    self._segment.flush()
+                    with self._index_lock:
+                        self._save_index()
+                    if self._should_rotate():
+                        self._close_segment()
+                        self.apply_retention()
+                continue
+
+            if item is self._STOP:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                print(f"❌ Ошибка записи в архив событий: {e}")
+
+        # Дописываем оставшееся и закрываем сегмент
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    print(f"❌ Ошибка записи в архив событий: {e}")
+        self._close_segment()
+
+    # ---------- Хранение ----------
+
+    def apply_retention(self):
+        """Удалить сегменты, все записи которых старше ARCHIVE_RETENTION_DAYS (0 - не удалять)"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        with self._index_lock:
+            for name, entry in list(self._index.items()):
+                if name == self._segment_name:
+                    continue
+                last_ts = entry.get('last_ts')
+                if last_ts is not None and last_ts < cutoff:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+                    del self._index[name]
+                    removed += 1
+            if removed:
+                self._save_index()
+        if removed:
+            with self._stats_lock:
+                self._segments_removed += removed
+            print(f"🗑️  Архив событий: удалено сегментов по сроку хранения: {removed}")
+        return removed
+
+    # ---------- Чтение ----------
+
+    def _read_segment(self, name):
+        """Итератор (ts, запись) по одному сегменту; обрезанный хвост игнорируется"""
+        try:
+            f = open(os.path.join(self.directory, name), "rb")
+        except OSError:
+            return
+        with f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, ts, flags = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    break
+                if flags & FLAG_COMPRESSED:
+                    payload = zlib.decompress(payload)
+                yield ts, json.loads(payload.decode("utf-8"))
+
+    def iter_records(self, start_ts=None, end_ts=None):
+        """Итератор (ts, запись) за период; по индексу читаются только нужные сегменты"""
+        self._ensure_loaded()
+        with self._index_lock:
+            segments = sorted(
+                name for name, entry in self._index.items()
+                if entry['first_ts'] is not None
+                and (start_ts is None or entry['last_ts'] >= start_ts)
+                and (end_ts is None or entry['first_ts'] <= end_ts)
+            )
+        for name in segments:
+            for ts, record in self._read_segment(name):
+                if (start_ts is None or ts >= start_ts) and (end_ts is None or ts <= end_ts):
+                    yield ts, record
+
+    def stats(self):
+        """Метрики архива"""
+        with self._index_lock:
+            segments = len(self._index)
+            total_bytes = sum(entry['bytes'] for entry in self._index.values())
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'appended': self._appended,
+                'written': self._written,
+                'dropped': self._dropped,
+                'bytes_written': self._bytes_written,
+                'segments': segments,
+                'total_bytes': total_bytes,
+                'segments_removed': self._segments_removed,
+            }
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime
+from decimal import Decimal
+import csv
+import io
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from db import EXPORT_COLUMNS, build_event_export_query
+
+load_dotenv()
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _export_value(value):
+    """Значение поля выгрузки: даты - 'YYYY-MM-DD HH:MM:SS', Decimal - строкой"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class EventExporter:
+    """
+    Потоковая выгрузка event_logs в NDJSON или CSV
+
+    Строки читаются небуферизованным курсором на отдельном соединении (см.
+    Database.iter_rows) и отдаются клиенту кусками около EXPORT_CHUNK_KB КБ по
+    мере чтения - расход памяти не зависит от размера выгрузки. Одновременных
+    выгрузок не больше EXPORT_MAX_CONCURRENT: каждая держит свое соединение MySQL.
+    """
+
+    def __init__(self, database, max_concurrent=None, fetch_size=None, chunk_bytes=None, net_write_timeout=None):
+        self.db = database
+        self.max_concurrent = max_concurrent or int(os.getenv("EXPORT_MAX_CONCURRENT", 2))
+        self.fetch_size = fetch_size or int(os.getenv("EXPORT_FETCH_SIZE", 1000))
+        self.chunk_bytes = chunk_bytes or int(os.getenv("EXPORT_CHUNK_KB", 64)) * 1024
+        self.net_write_timeout = net_write_timeout or int(os.getenv("EXPORT_NET_WRITE_TIMEOUT", 600))
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._active = 0
+        self._started = 0
+        self._completed = 0
+        self._aborted = 0
+        self._rejected = 0
+        self._rows = 0
+        self._bytes = 0
+
+    def acquire(self):
+        """Занять место выгрузки (False - уже идет EXPORT_MAX_CONCURRENT выгрузок)"""
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+        with self._stats_lock:
+            self._active += 1
+            self._started += 1
+        return True
+
+    def release(self):
+        """Освободить место выгрузки (когда ответ закрыт сервером)"""
+        with self._stats_lock:
+            self._active -= 1
+        self._slots.release()
+
+    def stream(self, export_format, **filters):
+        """
+        Генератор кусков выгрузки (bytes в UTF-8)
+
+        Args:
+            export_format: 'ndjson' или 'csv'
+            filters: фильтры build_event_export_query
+        """
+        query, params = build_event_export_query(**filters)
+        encode = self._csv_encoder() if export_format == "csv" else self._ndjson_line
+
+        rows = 0
+        sent = 0
+        buffer = []
+        size = 0
+        completed = False
+        started = time.monotonic()
+        try:
+            if export_format == "csv":
+                header = encode(EXPORT_COLUMNS)
+                buffer.append(header)
+                size += len(header)
+
+            for row in self.db.iter_rows(query, params, self.fetch_size, self.net_write_timeout):
+                line = encode([_export_value(row[column]) for column in EXPORT_COLUMNS])
+                buffer.append(line)
+                size += len(line)
+                rows += 1
+                if size >= self.chunk_bytes:
+                    chunk = "".join(buffer).encode("utf-8")
+                    buffer, size = [], 0
+                    sent += len(chunk)
+                    yield chunk
+
+            if buffer:
+                chunk = "".join(buffer).encode("utf-8")
+                sent += len(chunk)
+                yield chunk
+            completed = True
+        except Exception as e:
+            # Ошибка пробрасывается серверу: ответ обрывается, и клиент видит неполную выгрузку
+            print(f"❌ Ошибка выгрузки event_logs: {e}")
+            raise
+        finally:
+            with self._stats_lock:
+                self._rows += rows
+                self._bytes += sent
+                if completed:
+                    self._completed += 1
+                else:
+                    self._aborted += 1
+            status = "завершена" if completed else "прервана"
+            print(f"📤 Выгрузка event_logs ({export_format}) {status}: строк {rows}, "
+                  f"{sent / 1024 / 1024:.1f} МБ за {time.monotonic() - started:.1f} сек")
+
+    @staticmethod
+    def _ndjson_line(values):
+        return json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False) + "\n"
+
+    @staticmethod
+    def _csv_encoder():
+        """Кодирование строки CSV через один переиспользуемый буфер"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def encode(values):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            return buffer.getvalue()
+
+        return encode
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'active': self._active,
+                'max_concurrent': self.max_concurrent,
+                'started': self._started,
+                'completed': self._completed,
+                'aborted': self._aborted,
+                'rejected': self._rejected,
+                'rows': self._rows,
+                'bytes': self._bytes,
+            }
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+from event_archive import EventArchive
+
+load_dotenv()
+
+
+class EventLogWriter:
+    """
+    Асинхронная пакетная запись в event_logs
+
+    Поток обработки события только ставит строку аудита в очередь. Фоновый поток
+    сбрасывает очередь многострочными INSERT (executemany), когда набирается
+    EVENT_LOG_BATCH_SIZE строк или проходит EVENT_LOG_FLUSH_INTERVAL секунд
+    с момента первой строки в пакете.
+
+    Строки аудита не отбрасываются: пока БД недоступна, пакет повторяется
+    с ограниченной экспоненциальной задержкой (переполненная очередь тем
+    временем пишет синхронно). Если БД доступна, а пакет все равно не
+    записывается, он делится пополам, чтобы одна плохая строка не мешала
+    остальным; такая строка уходит в архив недоставленных (dead letter).
+    """
+
+    _STOP = object()
+
+    def __init__(self, database, batch_size=None, flush_interval=None, queue_size=None, max_retries=3,
+                 max_backoff=None, dead_letter=None):
+        self.db = database
+        self.batch_size = batch_size or int(os.getenv("EVENT_LOG_BATCH_SIZE", 100))
+        self.flush_interval = flush_interval or float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", 0.5))
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff or float(os.getenv("EVENT_LOG_MAX_BACKOFF", 30))
+        # Недоставленные строки хранятся бессрочно - удалять их может только оператор
+        self.dead_letter = dead_letter or EventArchive(
+            directory=os.getenv("EVENT_LOG_DEAD_LETTER_DIR", "logs/dead_letter"), retention_days=0
+        )
+        self._queue = queue.Queue(maxsize=queue_size or int(os.getenv("EVENT_LOG_QUEUE_SIZE", 10000)))
+        self._thread = None
+        self._stopping = threading.Event()
+        self._failed_on_stop = False  # Запись при остановке не удалась - остаток сразу в архив
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._retries = 0
+        self._splits = 0
+        self._dead_lettered = 0
+        self._sync_fallbacks = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+
+    def start(self):
+        """Запуск фонового потока записи"""
+        self.dead_letter.start()
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._failed_on_stop = False
+            self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Остановка с записью всех строк, оставшихся в очереди"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        self.dead_letter.stop()
+        print(f"📝 Очередь event_logs сброшена (записано строк: {self._written})")
+
+    def enqueue(self, user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                action_taken, status_code, is_violation, state_before, state_after, door_opened,
+                picture_sha256=None, created_at=None):
+        """Поставить строку event_logs в очередь на запись"""
+        row = {
+            'user_name': user_name,
+            'terminal_ip': terminal_ip,
+            'terminal_type': terminal_type,
+            'event_type': event_type,
+            'sub_event_type': sub_event_type,
+            'action_taken': action_taken,
+            'status_code': status_code,
+            'is_violation': is_violation,
+            'state_before': state_before,
+            'state_after': state_after,
+            'door_opened': door_opened,
+            'picture_sha256': picture_sha256,
+            # Время события фиксируется сейчас, а не в момент сброса пакета
+            'created_at': created_at or datetime.now(),
+        }
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Очередь переполнена (БД не успевает) - пишем синхронно, аудит не теряем
+            with self._stats_lock:
+                self._sync_fallbacks += 1
+            if self.db.log_events_batch([row]):
+                return True
+            self._dead_letter([row], "синхронная запись не удалась")
+            return False
+
+        with self._stats_lock:
+            self._enqueued += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+
+    def _write(self, batch, attempts):
+        """Записать пакет за attempts попыток (без паузы после последней и при остановке)"""
+        for attempt in range(1, attempts + 1):
+            started = time.monotonic()
+            if self.db.log_events_batch(batch):
+                with self._stats_lock:
+                    self._written += len(batch)
+                    self._batches += 1
+                    self._last_flush_ms = round((time.monotonic() - started) * 1000, 3)
+                return True
+            with self._stats_lock:
+                self._retries += 1
+            if attempt < attempts and self._stopping.wait(min(2 ** (attempt - 1), self.max_backoff)):
+                break
+        return False
+
+    def _wait_for_db(self):
+        """
+        Ждать доступности БД с ограниченной экспоненциальной задержкой
+
+        Returns:
+            True - БД доступна; False - идет остановка, а БД все еще недоступна
+        """
+        delay = 1
+        while not self.db.ping():
+            print(f"⚠️  БД недоступна - запись event_logs повторим через {delay} сек")
+            if self._stopping.wait(delay):
+                return False
+            delay = min(delay * 2, self.max_backoff)
+        return True
+
+    def _flush(self, batch):
+        """
+        Записать пакет строк, не теряя их
+
+        Пока БД недоступна - ждем и повторяем. Если БД доступна, а пакет не
+        записывается - делим его пополам; одиночная строка, которую БД не
+        принимает, уходит в архив недоставленных. При остановке повторов нет:
+        после первой неудачной записи пакет и весь остаток очереди уходят в архив
+        недоставленных, чтобы уложиться во время ожидания stop().
+        """
+        if self._failed_on_stop:
+            self._dead_letter(batch, "БД недоступна при остановке")
+            return False
+        if self._write(batch, self.max_retries):
+            return True
+        if self._stopping.is_set():
+            self._failed_on_stop = True
+            self._dead_letter(batch, "БД недоступна при остановке")
+            return False
+        return self._isolate(batch)
+
+    def _isolate(self, batch):
+        """Записать пакет, отделяя строки, которые БД не принимает"""
+        while True:
+            if not self._wait_for_db():
+                # Остановка при недоступной БД: сохраняем пакет, чтобы не потерять
+                self._dead_letter(batch, "БД недоступна при остановке")
+                return False
+            if self._write(batch, 1):
+                return True
+            if self.db.ping():
+                break  # БД доступна - дело в строках пакета
+
+        if len(batch) == 1:
+            self._dead_letter(batch, "строка отклонена БД")
+            return False
+        with self._stats_lock:
+            self._splits += 1
+        middle = len(batch) // 2
+        first = self._isolate(batch[:middle])
+        second = self._isolate(batch[middle:])
+        return first and second
+
+    def _dead_letter(self, batch, reason):
+        """Сохранить строки, которые не удалось записать, в архив недоставленных"""
+        for row in batch:
+            ts = row['created_at'].timestamp() if isinstance(row.get('created_at'), datetime) else None
+            if not self.dead_letter.append({'reason': reason, 'row': row}, ts=ts):
+                print(f"❌ Архив недоставленных переполнен - строка event_logs потеряна: {row}")
+        with self._stats_lock:
+            self._dead_lettered += len(batch)
+        print(f"❌ Строки event_logs ({len(batch)}) сохранены в архив недоставленных: {reason}")
+
+    def _run(self):
+        """Цикл фонового потока: набираем пакет и сбрасываем его в БД"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # Дописываем все, что осталось в очереди после сигнала остановки
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def stats(self):
+        """Метрики очереди записи"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_depth,
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'batches': self._batches,
+                'retries': self._retries,
+                'splits': self._splits,
+                'dead_lettered': self._dead_lettered,
+                'sync_fallbacks': self._sync_fallbacks,
+                'last_flush_ms': self._last_flush_ms,
+            }
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import itertools
+import json
+import os
+import queue
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Subscriber:
+    """
+    Подписчик /stream: ограниченный буфер сообщений и счетчик потерь
+
+    Буфер заполняет поток рассылки, читает - поток (или задача asyncio) ответа.
+    При переполнении вытесняется самое старое сообщение: медленный клиент теряет
+    события, но не задерживает рассылку остальным.
+
+    Args:
+        wake: функция без аргументов, будящая читателя после добавления сообщения
+            (по умолчанию - threading.Event для синхронного сервера)
+    """
+
+    def __init__(self, subscriber_id, buffer_size, wake=None):
+        self.id = subscriber_id
+        self.buffer_size = buffer_size
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = wake or self._ready.set
+        self._watermarks = {}  # тип события -> seq, до которого (включительно) события пропускаются
+        self.delivered = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def skip_through(self, event_type, seq):
+        """
+        Пропускать события event_type с seq <= seq (уже учтены в начальном снимке),
+        включая те, что успели попасть в буфер
+        """
+        with self._lock:
+            self._watermarks[event_type] = seq
+            self._buffer = deque(
+                item for item in self._buffer if not self._skipped(item[1], item[2])
+            )
+
+    def _skipped(self, event_type, seq):
+        """Событие уже учтено в снимке (вызывать под self._lock)"""
+        watermark = self._watermarks.get(event_type)
+        return watermark is not None and seq is not None and seq <= watermark
+
+    def push(self, message, event_type=None, seq=None):
+        """Добавить сообщение (поток рассылки); seq - порядковый номер события его типа"""
+        with self._lock:
+            if self._skipped(event_type, seq):
+                return
+            if len(self._buffer) >= self.buffer_size:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append((message, event_type, seq))
+        self._wake()
+
+    def notify(self):
+        """Разбудить читателя без нового сообщения (остановка рассылки)"""
+        self._wake()
+
+    def wait(self, timeout):
+        """Ждать сообщений не дольше timeout сек (синхронный читатель)"""
+        self._ready.wait(timeout)
+        self._ready.clear()
+
+    def drain(self):
+        """Забрать накопленные сообщения: (сообщения, потеряно с прошлого вызова)"""
+        with self._lock:
+            messages = [message for message, _, _ in self._buffer]
+            self._buffer.clear()
+            self.delivered += len(messages)
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        return messages, dropped
+
+
+class EventBroker:
+    """
+    Рассылка решений APB и изменений присутствия подписчикам /stream (SSE)
+
+    Поток обработки события только кладет событие в ограниченную очередь
+    (put_nowait) - его стоимость не зависит от числа подписчиков. Поток рассылки
+    один раз сериализует событие в кадр SSE и раскладывает готовые байты по
+    буферам подписчиков. Если очередь рассылки переполнена, событие
+    отбрасывается (счетчик dropped_events) - обработка событий не ждет клиентов.
+    """
+
+    _STOP = object()
+
+    def __init__(self, buffer_size=None, queue_size=None, max_subscribers=None, heartbeat=None):
+        self.buffer_size = buffer_size or int(os.getenv("STREAM_BUFFER_SIZE", 256))
+        self.max_subscribers = max_subscribers or int(os.getenv("STREAM_MAX_SUBSCRIBERS", 8))
+        self.heartbeat = heartbeat or float(os.getenv("STREAM_HEARTBEAT", 15))
+        self._queue = queue.Queue(maxsize=queue_size or int(os.getenv("STREAM_QUEUE_SIZE", 10000)))
+        self._subscribers = ()  # Заменяется целиком: рассылка читает снимок без блокировки
+        self._subscribers_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._seq = itertools.count(1)
+        self._thread = None
+        self._running = False
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._published = 0
+        self._dropped_events = 0
+        self._dispatched = 0
+        self._rejected = 0
+        self._subscribed = 0
+
+    def start(self):
+        """Запуск потока рассылки"""
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="event-stream", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка рассылки; открытые потоки /stream завершаются"""
+        if self._thread is None:
+            return
+        self._running = False
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        for subscriber in self._subscribers:
+            subscriber.notify()
+
+    @property
+    def running(self):
+        return self._running
+
+    def publish(self, event_type, payload):
+        """Опубликовать событие (поток обработки события, без ожидания)"""
+        if not self._running or not self._subscribers:
+            return False
+        try:
+            self._queue.put_nowait((event_type, payload))
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped_events += 1
+            return False
+        with self._stats_lock:
+            self._published += 1
+        return True
+
+    def subscribe(self, wake=None):
+        """Новый подписчик или None, если уже STREAM_MAX_SUBSCRIBERS подписчиков"""
+        with self._subscribers_lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                with self._stats_lock:
+                    self._rejected += 1
+                return None
+            subscriber = Subscriber(next(self._ids), self.buffer_size, wake)
+            self._subscribers = self._subscribers + (subscriber,)
+        with self._stats_lock:
+            self._subscribed += 1
+        print(f"📡 Подписчик /stream #{subscriber.id} подключен (всего: {len(self._subscribers)})")
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._subscribers_lock:
+            if subscriber not in self._subscribers:
+                return  # Уже снят (например, потоком рассылки после ошибки)
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+        print(f"📡 Подписчик /stream #{subscriber.id} отключен "
+              f"(доставлено: {subscriber.delivered}, потеряно: {subscriber.dropped})")
+
+    @staticmethod
+    def format_message(event_type, payload, event_id=None):
+        """Кадр SSE в UTF-8"""
+        data = json.dumps(payload, ensure_ascii=False)
+        prefix = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{prefix}event: {event_type}\ndata: {data}\n\n".encode("utf-8")
+
+    def frames(self, subscriber):
+        """Кадры для читателя после пробуждения: уведомление о потерях + сообщения"""
+        messages, dropped = subscriber.drain()
+        if dropped:
+            messages.insert(0, self.format_message("dropped", {"dropped": dropped, "total": subscriber.dropped}))
+        return b"".join(messages)
+
+    def preamble(self, initial=()):
+        """
+        Начало ответа /stream: задержка переподключения клиента после обрыва (3 сек)
+        и начальные кадры initial - пары (тип события, данные)
+        """
+        return b"retry: 3000\n\n" + b"".join(self.format_message(event_type, payload) for event_type, payload in initial)
+
+    def stream(self, subscriber, initial=()):
+        """Генератор ответа /stream для синхронного сервера"""
+        yield self.preamble(initial)
+        while self._running:
+            subscriber.wait(self.heartbeat)
+            # Пустой кадр - комментарий SSE: держит соединение и обнаруживает отключение клиента
+            yield self.frames(subscriber) or b": keepalive\n\n"
+
+    def _run(self):
+        """Цикл рассылки: сериализация один раз, раскладка по буферам подписчиков"""
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            event_type, payload = item
+            # Порядковый номер события своего типа (например, seq изменения присутствия)
+            seq = payload.get('seq') if isinstance(payload, dict) else None
+            try:
+                message = self.format_message(event_type, payload, next(self._seq))
+            except (TypeError, ValueError) as e:
+                print(f"❌ Ошибка сериализации события /stream: {e}")
+                continue
+            subscribers = self._subscribers
+            for subscriber in subscribers:
+                try:
+                    subscriber.push(message, event_type, seq)
+                except Exception as e:
+                    # Читатель недоступен (например, цикл asyncio уже закрыт) - снимаем подписку,
+                    # чтобы поток рассылки продолжал работать для остальных
+                    print(f"⚠️  Подписчик /stream #{subscriber.id} недоступен: {e}")
+                    self.unsubscribe(subscriber)
+            with self._stats_lock:
+                self._dispatched += 1
+
+    def stats(self):
+        subscribers = self._subscribers
+        with self._stats_lock:
+            return {
+                'subscribers': len(subscribers),
+                'max_subscribers': self.max_subscribers,
+                'buffer_size': self.buffer_size,
+                'queue_depth': self._queue.qsize(),
+                'published': self._published,
+                'dispatched': self._dispatched,
+                'dropped_events': self._dropped_events,
+                'subscriber_drops': {s.id: s.dropped for s in subscribers},
+                'rejected': self._rejected,
+                'subscribed': self._subscribed,
+            }
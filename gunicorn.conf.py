@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn для APB System
+
+Процесс приложения один: он владеет сессиями SDK терминалов, кэшем состояний,
+таймерами закрытия дверей и очередями записи. Несколько процессов повторяли бы
+подключение к каждому терминалу и принимали решения APB по разным кэшам,
+поэтому параллельность обеспечивается потоками (gthread), а не процессами.
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 3000)}"
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+# Запуск включает ожидание БД (до 60 сек) и подключение к терминалам
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+# Приложение создается в рабочем процессе: потоки и сессии SDK не переживают fork
+preload_app = False
+accesslog = "-"
+
+
+def worker_exit(server, worker):
+    """Корректная остановка подсистем при завершении рабочего процесса"""
+    import main
+    main.shutdown()
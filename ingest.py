@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class _StageTimer:
+    """Счетчик длительности одного этапа обработки"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class IngestPool:
+    """
+    Пул обработки событий, разделенный на шарды по пользователю
+
+    Обработчик /event только проверяет и ставит событие в очередь, после чего
+    сразу отвечает терминалу. Событие попадает в шард по хэшу имени пользователя:
+    события одного пользователя обрабатываются строго по порядку в одном потоке,
+    события разных пользователей - параллельно в разных шардах.
+
+    Args:
+        handler: функция обработки события handler(user_name, *args); возвращает
+            False, если событие не обработано (учитывается в failed)
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler, shards=None, queue_size=None):
+        self.handler = handler
+        self.shards = shards or int(os.getenv("INGEST_WORKERS", 8))
+        size = queue_size or int(os.getenv("INGEST_QUEUE_SIZE", 1000))
+        self._queues = [queue.Queue(maxsize=size) for _ in range(self.shards)]
+        self._threads = []
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        self._stages = {name: _StageTimer() for name in ('ack', 'queue_wait', 'processing')}
+
+    def start(self):
+        """Запуск потоков шардов"""
+        if self._threads:
+            return
+        for i, shard_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(shard_queue,), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30):
+        """Остановка: события, уже принятые в очереди, обрабатываются до конца"""
+        if not self._threads:
+            return
+        for shard_queue in self._queues:
+            shard_queue.put(self._STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        print(f"📥 Очереди событий обработаны (всего событий: {self._processed})")
+
+    def shard_for(self, user_name):
+        """Номер шарда пользователя (стабильный хэш, не зависит от PYTHONHASHSEED)"""
+        return zlib.crc32(user_name.encode("utf-8")) % self.shards
+
+    def submit(self, user_name, *args):
+        """
+        Поставить событие пользователя в очередь его шарда
+
+        Returns:
+            False, если очередь шарда переполнена (терминал должен повторить отправку)
+        """
+        try:
+            self._queues[self.shard_for(user_name)].put_nowait((time.monotonic(), user_name, args))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+        with self._stats_lock:
+            self._accepted += 1
+        return True
+
+    def record_stage(self, name, seconds):
+        """Учесть длительность этапа, выполненного вне пула (например, 'ack' в обработчике)"""
+        with self._stats_lock:
+            self._stages.setdefault(name, _StageTimer()).add(seconds)
+
+    def _worker(self, shard_queue):
+        while True:
+            item = shard_queue.get()
+            if item is self._STOP:
+                break
+            enqueued, user_name, args = item
+            started = time.monotonic()
+            failed = False
+            try:
+                failed = self.handler(user_name, *args) is False
+            except Exception as e:
+                failed = True
+                print(f"❌ Ошибка обработки события {user_name}: {e}")
+            finished = time.monotonic()
+            with self._stats_lock:
+                self._stages['queue_wait'].add(started - enqueued)
+                self._stages['processing'].add(finished - started)
+                if failed:
+                    self._failed += 1
+                else:
+                    self._processed += 1
+
+    def stats(self):
+        """Метрики приема: глубина очередей шардов и длительность этапов"""
+        with self._stats_lock:
+            return {
+                'shards': self.shards,
+                'queue_depths': [shard_queue.qsize() for shard_queue in self._queues],
+                'accepted': self._accepted,
+                'rejected': self._rejected,
+                'processed': self._processed,
+                'failed': self._failed,
+                'stages': {name: timer.as_dict() for name, timer in self._stages.items()},
+            }
@@ -1,31 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request
+from flask import Blueprint, Flask, Response, request
 import os
 import json
-from datetime import datetime, time as dt_time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, time as dt_time, timedelta
 from ctypes import *
 import threading
 import time
 from dotenv import load_dotenv
-from db import db
-
-# =============================
-#   Коды статусов событий APB
-# =============================
-
-# Успешные операции
-STATUS_SUCCESS_ENTRY = "SUCCESS_ENTRY"  # Успешный вход (outside -> inside)
-STATUS_SUCCESS_EXIT = "SUCCESS_EXIT"  # Успешный выход (inside -> outside)
-STATUS_ALLOWED_TIME_WINDOW = "ALLOWED_TIME_WINDOW"  # Разрешен вход в пределах временного окна
-
-# Нарушения APB (is_violation = TRUE)
-STATUS_DENIED_ALREADY_INSIDE = "DENIED_ALREADY_INSIDE"  # Запрещен вход - уже внутри (нарушение)
-STATUS_DENIED_OUTSIDE_WINDOW = "DENIED_OUTSIDE_WINDOW"  # Запрещен вход - вне временного окна (нарушение)
-
-# Предупреждения (не нарушения, но требует внимания)
-STATUS_WARNING_EXIT_WITHOUT_ENTRY = "WARNING_EXIT_WITHOUT_ENTRY"  # Предупреждение - выход без входа
+from db import db, page_limit
+from apb_logic import (
+    decide_transition,
+    STATUS_SUCCESS_ENTRY,
+    STATUS_SUCCESS_EXIT,
+    STATUS_ALLOWED_TIME_WINDOW,
+    STATUS_DENIED_ALREADY_INSIDE,
+    STATUS_WARNING_EXIT_WITHOUT_ENTRY,
+)
+from state_cache import UserStateCache
+from event_log_writer import EventLogWriter
+from door_controller import DoorController
+from sdk_lanes import SdkCommandLanes
+from event_archive import EventArchive
+from picture_store import PictureStore
+from ingest import IngestPool
+from user_locks import StripedLocks
+from terminal_supervisor import TerminalSupervisor
+from terminal_registry import terminal_registry
+from scheduler import Scheduler
+from event_export import EventExporter, EXPORT_FORMATS
+from result_cache import ResultCache
+from occupancy import OccupancyIndex
+from event_stream import EventBroker
 
 # =============================
 #   Загрузка конфигурации
@@ -33,86 +41,161 @@ STATUS_WARNING_EXIT_WITHOUT_ENTRY = "WARNING_EXIT_WITHOUT_ENTRY"  # Предуп
 
 load_dotenv()
 
-# Терминалы входа (нечетные)
-TERMINALS_IN = [
-    os.getenv("TERMINAL_IN_1"),
-    os.getenv("TERMINAL_IN_2"),
-    os.getenv("TERMINAL_IN_3"),
-    os.getenv("TERMINAL_IN_4"),
-    os.getenv("TERMINAL_IN_5"),
-    os.getenv("TERMINAL_IN_6"),
-    os.getenv("TERMINAL_IN_7"),
-    os.getenv("TERMINAL_IN_8"),
-    os.getenv("TERMINAL_IN_9"),
-]
-
-# Терминалы выхода (четные)
-TERMINALS_OUT = [
-    os.getenv("TERMINAL_OUT_1"),
-    os.getenv("TERMINAL_OUT_2"),
-    os.getenv("TERMINAL_OUT_3"),
-    os.getenv("TERMINAL_OUT_4"),
-    os.getenv("TERMINAL_OUT_5"),
-    os.getenv("TERMINAL_OUT_6"),
-    os.getenv("TERMINAL_OUT_7"),
-    os.getenv("TERMINAL_OUT_8"),
-    os.getenv("TERMINAL_OUT_9"),
-]
-
-# Учетные данные терминалов
-PORT = int(os.getenv("TERMINAL_PORT"))
-USER = os.getenv("TERMINAL_USER").encode()
-PASS = os.getenv("TERMINAL_PASSWORD").encode()
+# Терминалы (тип, номер двери, учетные данные SDK) - реестр terminal_registry:
+# файл TERMINALS_FILE или переменные TERMINAL_IN_<n> / TERMINAL_OUT_<n>
+SDK_LIBRARY = os.getenv("SDK_LIBRARY", "./lib/libhcnetsdk.so")
+# Параллельное подключение к терминалам: число потоков и время ожидания терминала (сек)
+TERMINAL_LOGIN_WORKERS = int(os.getenv("TERMINAL_LOGIN_WORKERS", 8))
+TERMINAL_LOGIN_TIMEOUT = int(os.getenv("TERMINAL_LOGIN_TIMEOUT", 5))
 
 # Настройки APB
-RESET_TIME = os.getenv("RESET_TIME")  # Время ежедневного сброса
-DOOR_OPEN_TIME = int(os.getenv("DOOR_OPEN_TIME"))
+RESET_TIME = os.getenv("RESET_TIME", "00:00")  # Время ежедневного сброса
+DOOR_OPEN_TIME = int(os.getenv("DOOR_OPEN_TIME", 3))
+# Размер пакета фоновой очистки user_states после сброса
+RESET_CLEANUP_BATCH = int(os.getenv("RESET_CLEANUP_BATCH", 1000))
+# Время ежедневного закрытия сегмента архива событий
+ARCHIVE_ROTATE_TIME = os.getenv("ARCHIVE_ROTATE_TIME", "00:00")
+# Время ежедневного обслуживания секций event_logs
+EVENT_LOG_MAINTENANCE_TIME = os.getenv("EVENT_LOG_MAINTENANCE_TIME", "03:00")
+# Размер пакета и интервал (сек) догоняющего заполнения витрин статистики
+ROLLUP_BACKFILL_BATCH = int(os.getenv("ROLLUP_BACKFILL_BATCH", 10000))
+ROLLUP_BACKFILL_INTERVAL = int(os.getenv("ROLLUP_BACKFILL_INTERVAL", 300))
+# Период сверки индекса присутствия с user_states (сек)
+OCCUPANCY_REBUILD_INTERVAL = int(os.getenv("OCCUPANCY_REBUILD_INTERVAL", 300))
 ENTRY_WINDOW_SECONDS = int(os.getenv("ENTRY_WINDOW_SECONDS", "60"))  # Время окна для повторного входа (секунды)
+# Асинхронная пакетная запись event_logs (false - строка пишется в транзакции перехода)
+EVENT_LOG_ASYNC = os.getenv("EVENT_LOG_ASYNC", "true").lower() == "true"
+# Быстрый ответ терминалу: событие обрабатывается пулом после ответа (false - в обработчике)
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "true").lower() == "true"
 
 # =============================
 #   Инициализация SDK
 # =============================
 
-sdk = cdll.LoadLibrary("./lib/libhcnetsdk.so")
-sdk.NET_DVR_Init()
+# Библиотека SDK загружается при запуске (startup), а не при импорте модуля
+sdk = None
 
 # Словарь для хранения user_id подключений к терминалам входа
 terminal_connections = {}
-# Блокировка для потокобезопасного доступа к SDK
-sdk_lock = threading.Lock()
-
-print("=" * 60)
-print("🔌 Подключение к терминалам входа...")
-print("=" * 60)
+# Полосы команд SDK: параллельно между терминалами, последовательно внутри терминала
+sdk_lanes = SdkCommandLanes()
 
 # Список недоступных терминалов
 unavailable_terminals = []
 
-for terminal_ip in TERMINALS_IN:
+
+def init_sdk():
+    """Загрузка и инициализация библиотеки HCNetSDK"""
+    global sdk
+    if sdk is None:
+        library = cdll.LoadLibrary(SDK_LIBRARY)
+        library.NET_DVR_Init()
+        # Время подключения SDK (мс) и одна попытка - недоступный терминал не занимает поток надолго
+        library.NET_DVR_SetConnectTime(TERMINAL_LOGIN_TIMEOUT * 1000, 1)
+        sdk = library
+
+
+# Код NET_DVR_RemoteControl: проверка, активна ли сессия пользователя SDK
+NET_DVR_CHECK_USER_STATUS = 20005
+
+
+def sdk_login(terminal_ip):
+    """Вход в терминал через SDK (user_id сессии, < 0 - ошибка)"""
+    terminal = terminal_registry.get(terminal_ip)
+    if sdk is None or terminal is None:
+        return -1
+    return sdk.NET_DVR_Login_V30(
+        terminal.ip.encode(), terminal.port, terminal.user.encode(), terminal.password.encode(), None
+    )
+
+
+def check_terminal_session(terminal_ip, user_id):
+    """Дешевая проверка сессии (в полосе терминала, не дольше SDK_CALL_TIMEOUT)"""
+    result = sdk_lanes.call(
+        user_id, sdk.NET_DVR_RemoteControl, user_id, NET_DVR_CHECK_USER_STATUS, None, 0,
+        label=terminal_ip
+    )
+    return bool(result)
+
+
+def close_terminal_session(terminal_ip, user_id):
+    """Закрыть старую сессию терминала и ее полосу команд"""
+    sdk_lanes.close_lane(user_id)
     try:
-        ip_bytes = terminal_ip.encode()
-        user_id = sdk.NET_DVR_Login_V30(ip_bytes, PORT, USER, PASS, None)
-
-        if user_id < 0:
-            print(f"⚠️  Терминал {terminal_ip} недоступен - будет пропущен")
-            unavailable_terminals.append(terminal_ip)
-        else:
-            terminal_connections[terminal_ip] = user_id
-            print(f"✅ Подключено к {terminal_ip} (user_id: {user_id})")
+        sdk.NET_DVR_Logout(user_id)
+    except Exception as e:
+        print(f"⚠️  Ошибка выхода из сессии {terminal_ip}: {e}")
+
+
+# Наблюдение за сессиями: проверка и переподключение с экспоненциальной задержкой
+terminal_supervisor = TerminalSupervisor(sdk_login, close_terminal_session, check_terminal_session, terminal_connections)
+
+
+def login_terminal(terminal_ip):
+    """Подключение к одному терминалу входа (True - подключен)"""
+    started = time.monotonic()
+    try:
+        user_id = sdk_login(terminal_ip)
     except Exception as e:
         print(f"⚠️  Ошибка подключения к {terminal_ip}: {e}")
+        user_id = -1
+    elapsed = time.monotonic() - started
+
+    if user_id < 0:
+        print(f"⚠️  Терминал {terminal_ip} недоступен - переподключение в фоне ({elapsed:.1f} сек)")
         unavailable_terminals.append(terminal_ip)
+        terminal_supervisor.failed(terminal_ip, "login failed")
+        return False
+
+    terminal_supervisor.attached(terminal_ip, user_id, elapsed)
+    print(f"✅ Подключено к {terminal_ip} (user_id: {user_id}, {elapsed:.1f} сек)")
+    return True
 
-if terminal_connections:
-    print(f"\n✅ Успешно подключено к {len(terminal_connections)}/{len(TERMINALS_IN)} терминалам входа")
-    if unavailable_terminals:
-        print(f"⚠️  Недоступные терминалы: {', '.join(unavailable_terminals)}")
-        print("ℹ️  Система продолжит работу с доступными терминалами")
-else:
-    print("\n⚠️  Ни один терминал входа не подключен!")
-    print("ℹ️  Система будет работать в режиме мониторинга (без управления дверями)")
 
-print(f"📊 Активных подключений: {len(terminal_connections)}")
+def login_terminals():
+    """
+    Параллельное подключение к терминалам входа
+
+    Логины выполняются пулом из TERMINAL_LOGIN_WORKERS потоков. Терминалы, не
+    ответившие за TERMINAL_LOGIN_TIMEOUT сек, продолжают подключаться в фоне -
+    запуск их не ждет, дверь такого терминала управляется с момента подключения.
+    """
+    terminals = [terminal.ip for terminal in terminal_registry.sdk_terminals()]
+
+    print("=" * 60)
+    print(f"🔌 Подключение к терминалам входа ({len(terminals)}, параллельно)...")
+    print("=" * 60)
+
+    if not terminals:
+        print("\n⚠️  Терминалы с управлением через SDK не настроены!")
+        return
+
+    for terminal_ip in terminals:
+        terminal_supervisor.register(terminal_ip)
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(TERMINAL_LOGIN_WORKERS, len(terminals)),
+        thread_name_prefix="terminal-login"
+    )
+    futures = {executor.submit(login_terminal, terminal_ip): terminal_ip for terminal_ip in terminals}
+    # Потоки пула завершатся сами после последнего логина
+    executor.shutdown(wait=False)
+
+    _, pending = wait(futures, timeout=TERMINAL_LOGIN_TIMEOUT)
+
+    if terminal_connections:
+        print(f"\n✅ Успешно подключено к {len(terminal_connections)}/{len(terminals)} терминалам входа")
+        if unavailable_terminals:
+            print(f"⚠️  Недоступные терминалы: {', '.join(unavailable_terminals)}")
+            print("ℹ️  Система продолжит работу с доступными терминалами, недоступные переподключаются в фоне")
+    elif not pending:
+        print("\n⚠️  Ни один терминал входа не подключен!")
+        print("ℹ️  Система будет работать в режиме мониторинга (без управления дверями)")
+
+    if pending:
+        print(f"⏳ Подключаются в фоне: {', '.join(futures[future] for future in pending)}")
+
+    print(f"📊 Активных подключений: {len(terminal_connections)}")
 
 # =============================
 #   Подключение к БД
@@ -137,109 +220,184 @@ def wait_for_db(max_attempts=30, delay_seconds=2):
     return False
 
 
-if not wait_for_db():
-    exit(1)
+# In-memory кэш состояний пользователей (последнее известное состояние - для решений при недоступной БД)
+state_cache = UserStateCache(db)
+
+# Рассылка решений APB и изменений присутствия подписчикам /stream (SSE)
+event_broker = EventBroker()
+
+# Индекс присутствия: кто внутри (для /status без запроса к user_states)
+occupancy = OccupancyIndex(db, on_change=lambda change: event_broker.publish("occupancy", change))
 
-db.initialize_tables()
+# Фоновая пакетная запись аудита event_logs
+event_log_writer = EventLogWriter(db)
+
+# Архив сырых событий (сегменты с ротацией вместо каталога на каждый запрос)
+event_archive = EventArchive()
+
+
+def init_db():
+    """Подключение к БД, создание таблиц, прогрев кэша состояний и индекса присутствия"""
+    if not wait_for_db():
+        return False
+
+    db.initialize_tables()
+    state_cache.warm_up()
+    occupancy.rebuild()
+    return True
 
 # =============================
 #   Логика управления дверью
 # =============================
 
-def open_door(terminal_ip, door_no=1, open_time=DOOR_OPEN_TIME):
-    """Открыть дверь на определенном терминале"""
-    user_id = terminal_connections.get(terminal_ip)
+def control_gateway(terminal_ip, door_no, command, callback):
+    """
+    Поставить команду NET_DVR_ControlGateway в полосу терминала (1 - открыть, 3 - закрыть)
 
+    Не ждет терминал: callback(ok) вызывается в потоке полосы после выполнения.
+    False - терминал не подключен или его полоса переполнена.
+    """
+    user_id = terminal_connections.get(terminal_ip)
     if user_id is None:
-        print(f"⚠️  Терминал {terminal_ip} не подключен к SDK - управление дверью недоступно")
-        print(f"ℹ️  Событие будет залогировано, но дверь не откроется")
         return False
 
-    try:
-        print(f"🔓 Открываем дверь на {terminal_ip} (дверь {door_no}) на {open_time} сек...")
+    return sdk_lanes.submit(
+        user_id, sdk.NET_DVR_ControlGateway, user_id, door_no, command,
+        label=terminal_ip, callback=lambda result: callback(bool(result))
+    )
 
-        # Используем блокировку для потокобезопасного доступа к SDK
-        with sdk_lock:
-            result = sdk.NET_DVR_ControlGateway(user_id, door_no, 1)  # open door
 
-        if result == 0:
-            print(f"⚠️  Не удалось открыть дверь на {terminal_ip}")
-            print(f"ℹ️  Возможно терминал отключился - проверьте подключение")
-            return False
+# Фиксированный пул потоков управления дверями + таймеры закрытия
+door_controller = DoorController(control_gateway)
 
-        time.sleep(open_time)
 
-        # Используем блокировку для потокобезопасного доступа к SDK
-        with sdk_lock:
-            sdk.NET_DVR_ControlGateway(user_id, door_no, 3)  # close door
+def open_door(terminal_ip, door_no=None, open_time=DOOR_OPEN_TIME):
+    """Открыть дверь на определенном терминале (закрытие по таймеру через open_time сек)"""
+    if door_no is None:
+        terminal = terminal_registry.get(terminal_ip)
+        door_no = terminal.door_no if terminal else 1
 
-        print(f"🚪 Дверь на {terminal_ip} снова закрыта")
-        return True
-    except Exception as e:
-        print(f"❌ Ошибка управления дверью на {terminal_ip}: {e}")
-        print(f"ℹ️  Терминал может быть недоступен")
+    if terminal_ip not in terminal_connections:
+        print(f"⚠️  Терминал {terminal_ip} не подключен к SDK - управление дверью недоступно")
+        print(f"ℹ️  Событие будет залогировано, но дверь не откроется")
         return False
 
+    return door_controller.open_door(terminal_ip, door_no, open_time)
+
 
 # =============================
-#   Фоновая задача сброса состояний
+#   Задачи по расписанию
 # =============================
 
-last_reset_date = datetime.now().date()
-
-def reset_states_scheduler():
-    """Фоновый поток для ежедневного сброса состояний"""
-    global last_reset_date
-
+def cleanup_stale_states():
+    """Физическая очистка состояний, устаревших по эпохе сброса, небольшими пакетами"""
+    total = 0
     while True:
-        try:
-            now = datetime.now()
-            current_date = now.date()
-            current_time = now.time()
+        affected = db.cleanup_stale_states(RESET_CLEANUP_BATCH)
+        total += affected
+        if affected < RESET_CLEANUP_BATCH:
+            break
+        # Пауза между пакетами - короткие блокировки не мешают обработке событий
+        time.sleep(0.1)
+    if total:
+        print(f"🧹 Очищено устаревших состояний: {total}")
+    return total
+
+
+def backfill_rollups():
+    """Догоняющее заполнение витрин статистики по старым событиям, небольшими пакетами"""
+    total = 0
+    while True:
+        processed = db.backfill_rollups(ROLLUP_BACKFILL_BATCH)
+        total += processed
+        if processed < ROLLUP_BACKFILL_BATCH:
+            break
+        # Пауза между пакетами - чтение event_logs не мешает обработке событий
+        time.sleep(0.1)
+    if total:
+        print(f"📊 Витрины статистики дополнены по старым событиям (id: {total})")
+    return total
+
+
+def sync_fallback_states():
+    """Записать в user_states переходы, принятые в памяти, пока БД была недоступна"""
+    synced = 0
+    for user_name in state_cache.unsynced_users():
+        with user_locks.hold(user_name):
+            if not state_cache.sync(user_name):
+                break  # БД все еще недоступна - повторим при следующем запуске
+        synced += 1
+    if synced:
+        print(f"🔁 Состояния, принятые без БД, записаны в user_states: {synced}")
+    return synced
+
+
+def sync_reset_epoch():
+    """Принять эпоху сброса из БД в кэше состояний и индексе присутствия"""
+    state_cache.reset_all()
+    occupancy.apply_reset(state_cache.reset_epoch)
+
+
+def last_reset_boundary(now):
+    """Последняя наступившая граница ежедневного сброса (RESET_TIME сегодня или вчера)"""
+    reset_hour, reset_minute = map(int, RESET_TIME.split(":"))
+    boundary = datetime.combine(now.date(), dt_time(reset_hour, reset_minute))
+    if boundary > now:
+        boundary -= timedelta(days=1)
+    return boundary
+
+
+def daily_reset_job():
+    """
+    Ежедневный сброс состояний
 
-            # Парсим время сброса
-            reset_hour, reset_minute = map(int, RESET_TIME.split(":"))
-            reset_time = dt_time(reset_hour, reset_minute)
+    Сброс - сдвиг эпохи сброса на последнее наступившее RESET_TIME (одна запись
+    в БД). Эпоха только растет, поэтому запуск после перезапуска процесса
+    только догоняет пропущенный сброс. Строки user_states очищаются пакетами.
+    """
+    now = datetime.now()
+    boundary = last_reset_boundary(now)
 
-            # Проверяем, нужен ли сброс
-            if current_date > last_reset_date and current_time >= reset_time:
-                print("\n" + "=" * 60)
-                print(f"🔄 Выполняется ежедневный сброс состояний в {now.strftime('%Y-%m-%d %H:%M:%S')}")
-                print("=" * 60)
+    if state_cache.reset_epoch is None or state_cache.reset_epoch < boundary:
+        print("\n" + "=" * 60)
+        print(f"🔄 Выполняется ежедневный сброс состояний в {now.strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
 
-                affected = db.reset_daily_states()
-                last_reset_date = current_date
+        affected = db.reset_daily_states(boundary)
+        sync_reset_epoch()
 
-                print(f"✅ Сброс завершен. Обновлено записей: {affected}\n")
+        print(f"✅ Сброс завершен. Сброшено состояний: {affected}\n")
 
-            # Проверяем каждую минуту
-            time.sleep(60)
+    cleanup_stale_states()
 
-        except Exception as e:
-            print(f"❌ Ошибка в планировщике сброса: {e}")
-            time.sleep(60)
 
+# Задачи с single_runner выполняются одним процессом (блокировка MySQL GET_LOCK)
+scheduler = Scheduler(lock=db.job_lock)
+scheduler.daily("daily_reset", RESET_TIME, daily_reset_job, run_at_start=True)
+# Эпоха сброса могла сдвинуться в другом процессе - кэш и индекс подхватывают ее из БД
+scheduler.every("reset_epoch_sync", 60, sync_reset_epoch, single_runner=False)
+# Переходы, принятые в памяти при недоступной БД, дописываются в user_states
+scheduler.every("fallback_state_sync", 30, sync_fallback_states, single_runner=False)
+# Индекс присутствия сверяется с user_states (переходы других процессов, правки в БД)
+scheduler.every("occupancy_rebuild", OCCUPANCY_REBUILD_INTERVAL, occupancy.rebuild, single_runner=False)
+# Архив событий локален для процесса: сегменты по суткам и удаление старых сегментов
+scheduler.daily("archive_rotation", ARCHIVE_ROTATE_TIME, event_archive.rotate, single_runner=False)
+scheduler.every("archive_retention", 3600, event_archive.apply_retention, single_runner=False)
+# Секции event_logs: создание вперед и удаление по сроку хранения (DROP PARTITION)
+scheduler.daily("event_log_partitions", EVENT_LOG_MAINTENANCE_TIME, db.manage_event_log_partitions, run_at_start=True)
+# Витрины статистики: события, записанные до появления витрин (по водяному знаку)
+scheduler.every("rollup_backfill", ROLLUP_BACKFILL_INTERVAL, backfill_rollups, run_at_start=True)
 
-# Запускаем фоновый поток сброса
-reset_thread = threading.Thread(target=reset_states_scheduler, daemon=True)
-reset_thread.start()
 
 # =============================
 #   Логика APB
 # =============================
 
-def determine_terminal_type(device_ip):
-    """Определить тип терминала по IP"""
-    # Проверяем последнюю цифру IP
-    last_octet = int(device_ip.split('.')[-1])
-
-    if last_octet % 2 == 1:  # Нечетный - вход
-        return "entry"
-    else:  # Четный - выход
-        return "exit"
+# Блокировки по пользователю для пути принятия решения APB
+user_locks = StripedLocks()
 
 
-def process_apb_event(user_name, device_ip, sub_event_type):
+def process_apb_event(user_name, device_ip, sub_event_type, picture_sha256=None):
     """
     Обработка события с применением логики Anti-Passback
 
@@ -250,186 +408,202 @@ def process_apb_event(user_name, device_ip, sub_event_type):
     - Если пользователь снаружи, он может войти через любой терминал входа
     - Если пользователь внутри, он может выйти через любой терминал выхода
     - Если пользователь снаружи, он не может выйти (предупреждение)
+
+    Returns:
+        True, если решение принято и сохранено в БД; False - событие не обработано
+        или не сохранено (счетчик failed в пуле обработки)
     """
 
+    # Тип терминала - из реестра; неизвестный терминал отклоняется до обращения к БД
+    terminal = terminal_registry.get(device_ip)
+    if terminal is None:
+        terminal_registry.reject(device_ip)
+        return False
+
     try:
-        # Получаем текущее состояние пользователя из БД
-        user_data = db.get_user_state(user_name)
-        if not user_data:
-            print(f"⚠️  Не удалось получить состояние пользователя {user_name}")
-            return
-
-        current_state = user_data.get('state', 'outside')
-        last_entry_auth_time = user_data.get('last_entry_auth_time')
-        terminal_type = determine_terminal_type(device_ip)
-
-        print(f"\n{'='*60}")
-        print(f"👤 Пользователь: {user_name}")
-        print(f"📍 Терминал: {device_ip} ({terminal_type})")
-        print(f"📊 Текущее состояние: {current_state}")
-        if last_entry_auth_time:
-            print(f"⏰ Последняя аутентификация на входе: {last_entry_auth_time}")
-        print(f"{'='*60}")
-
-        action_taken = None
-        status_code = None
-        is_violation = False
-        door_opened = False
-        new_state = current_state
-
-        # ===== ТЕРМИНАЛ ВХОДА =====
-        if terminal_type == "entry":
-            # Обновляем время последней аутентификации на терминале входа
-            # Это нужно для отслеживания временного окна (даже если вход будет запрещен)
-            db.update_entry_auth_time(user_name, device_ip)
-
-            # Получаем обновленное время для проверки окна
-            updated_user_data = db.get_user_state(user_name)
-            current_auth_time = updated_user_data.get('last_entry_auth_time')
-
-            # Проверяем временное окно для повторного входа
-            within_time_window = False
-            if last_entry_auth_time and current_auth_time:
-                # Используем старое время для проверки окна (до обновления)
-                time_diff = (datetime.now() - last_entry_auth_time).total_seconds()
-                within_time_window = time_diff < ENTRY_WINDOW_SECONDS
-                if within_time_window:
-                    print(f"⏱️  Временное окно: {time_diff:.1f} сек назад (окно: {ENTRY_WINDOW_SECONDS} сек)")
-
-            status_code = None
-            is_violation = False
-
-            if current_state == "inside":
-                if within_time_window:
-                    # Пользователь уже внутри, но в пределах временного окна - разрешаем повторный вход
-                    action_taken = f"ВХОД РАЗРЕШЕН - временное окно ({ENTRY_WINDOW_SECONDS} сек)"
-                    status_code = STATUS_ALLOWED_TIME_WINDOW
-                    is_violation = False
-                    print(f"✅ {user_name} входит повторно через {device_ip} (в пределах временного окна)")
-
-                    # Проверяем подключен ли терминал к SDK
-                    if device_ip in terminal_connections:
-                        # Открываем дверь в отдельном потоке
-                        threading.Thread(target=open_door, args=(device_ip,)).start()
-                        door_opened = True
-                    else:
-                        print(f"⚠️  Терминал {device_ip} не подключен к SDK")
-                        print(f"ℹ️  Пользователю разрешен вход, но дверь не откроется автоматически")
-                        door_opened = False
-                else:
-                    # Пользователь уже внутри и вне временного окна - запрещаем вход (НАРУШЕНИЕ APB)
-                    action_taken = "ВХОД ЗАПРЕЩЕН - уже внутри"
-                    status_code = STATUS_DENIED_ALREADY_INSIDE
-                    is_violation = True  # Это нарушение APB!
-                    print(f"⛔ {user_name} уже внутри здания - запрет повторного входа (НАРУШЕНИЕ APB)")
-                    if last_entry_auth_time:
-                        time_diff = (datetime.now() - last_entry_auth_time).total_seconds()
-                        print(f"ℹ️  С момента последней аутентификации прошло {time_diff:.1f} сек (окно: {ENTRY_WINDOW_SECONDS} сек)")
-                    door_opened = False
-
-            else:  # current_state == "outside"
-                # Пользователь снаружи - разрешаем вход
-                action_taken = "ВХОД РАЗРЕШЕН"
-                status_code = STATUS_SUCCESS_ENTRY
-                is_violation = False
+        # События одного пользователя линеаризуются на его полосе блокировок,
+        # события разных пользователей выполняются параллельно
+        with user_locks.hold(user_name):
+            terminal_type = terminal.type
+
+            print(f"\n{'='*60}")
+            print(f"👤 Пользователь: {user_name}")
+            print(f"📍 Терминал: {terminal.name} - {device_ip} ({terminal_type})")
+
+            now = datetime.now()
+
+            def door_available(decision):
+                """Откроется ли дверь при этом решении (без побочных эффектов)"""
+                return bool(decision['allow_door']) and device_ip in terminal_connections
+
+            # Решение принимается в одной транзакции по строке user_states под блокировкой:
+            # состояние (и запись event_logs, если она не асинхронная) фиксируется сразу,
+            # дверь открывается уже по авторитетному решению из БД. Кэш состояний на этом
+            # пути не читается - он нужен только для решения при недоступной БД
+            result = state_cache.record_transition(
+                user_name, device_ip, terminal_type, "AccessControl", sub_event_type,
+                door_available, ENTRY_WINDOW_SECONDS, now=now, write_log=not EVENT_LOG_ASYNC,
+                picture_sha256=picture_sha256
+            )
+            if result is None:
+                # БД недоступна - решаем по последнему известному состоянию в памяти и
+                # обновляем его, чтобы APB соблюдался и во время сбоя (в user_states
+                # переход запишется при восстановлении БД)
+                print(f"❌ Не удалось сохранить событие {user_name} в БД - решение по кэшу")
+                cached = state_cache.peek(user_name) or {}
+                state_before = cached.get('state', 'outside')
+                last_entry_auth_time = cached.get('last_entry_auth_time')
+                decision = decide_transition(
+                    state_before, last_entry_auth_time, terminal_type, ENTRY_WINDOW_SECONDS, now=now
+                )
+                user_state = state_cache.record_fallback(user_name, device_ip, terminal_type, decision, now)
+            else:
+                decision = result
+                state_before = result['state_before']
+                last_entry_auth_time = result['last_entry_auth_time']
+                user_state = result['user_state']
+
+            print(f"📊 Текущее состояние: {state_before}")
+            if last_entry_auth_time:
+                print(f"⏰ Последняя аутентификация на входе: {last_entry_auth_time}")
+            print(f"{'='*60}")
+            status_code = decision['status_code']
+            new_state = decision['new_state']
+            door_opened = False
+
+            if status_code == STATUS_ALLOWED_TIME_WINDOW:
+                print(f"⏱️  Временное окно: {decision['time_diff']:.1f} сек назад (окно: {ENTRY_WINDOW_SECONDS} сек)")
+                print(f"✅ {user_name} входит повторно через {device_ip} (в пределах временного окна)")
+            elif status_code == STATUS_DENIED_ALREADY_INSIDE:
+                print(f"⛔ {user_name} уже внутри здания - запрет повторного входа (НАРУШЕНИЕ APB)")
+                if decision['time_diff'] is not None:
+                    print(f"ℹ️  С момента последней аутентификации прошло {decision['time_diff']:.1f} сек (окно: {ENTRY_WINDOW_SECONDS} сек)")
+            elif status_code == STATUS_SUCCESS_ENTRY:
                 print(f"✅ {user_name} входит в здание через {device_ip}")
+            elif status_code == STATUS_SUCCESS_EXIT:
+                # На выходе мы не управляем дверью через SDK (только входы подключены)
+                print(f"🚪 {user_name} выходит из здания через {device_ip}")
+            elif status_code == STATUS_WARNING_EXIT_WITHOUT_ENTRY:
+                print(f"⚠️ {user_name} пытается выйти, но не числится внутри здания")
 
+            if decision['allow_door']:
                 # Проверяем подключен ли терминал к SDK
                 if device_ip in terminal_connections:
-                    # Открываем дверь в отдельном потоке
-                    threading.Thread(target=open_door, args=(device_ip,)).start()
-                    door_opened = True
+                    # Открытие ставится в очередь контроллера дверей - обработка не ждет SDK
+                    door_opened = open_door(device_ip, terminal.door_no)
                 else:
-                    # Терминал не подключен - дверь не откроется
                     print(f"⚠️  Терминал {device_ip} не подключен к SDK")
                     print(f"ℹ️  Пользователю разрешен вход, но дверь не откроется автоматически")
-                    door_opened = False
-
-                new_state = "inside"
 
-                # Обновляем состояние в БД
-                db.update_user_state(user_name, new_state, device_ip)
-
-        # ===== ТЕРМИНАЛ ВЫХОДА =====
-        elif terminal_type == "exit":
-            if current_state == "inside":
-                # Пользователь внутри - разрешаем выход
-                action_taken = "ВЫХОД РАЗРЕШЕН"
-                status_code = STATUS_SUCCESS_EXIT
-                is_violation = False
-                print(f"🚪 {user_name} выходит из здания через {device_ip}")
-
-                # На выходе мы не управляем дверью через SDK (только входы подключены)
-                # Но логируем событие
-                door_opened = False
-                new_state = "outside"
-
-                # Обновляем состояние в БД
-                db.update_user_state(user_name, new_state, device_ip)
-
-            else:  # current_state == "outside"
-                # Пользователь снаружи пытается выйти - предупреждение (не нарушение)
-                action_taken = "ВЫХОД ПРЕДУПРЕЖДЕНИЕ - не числится внутри"
-                status_code = STATUS_WARNING_EXIT_WITHOUT_ENTRY
-                is_violation = False
-                print(f"⚠️ {user_name} пытается выйти, но не числится внутри здания")
-                door_opened = False
-
-        # Записываем событие в лог
-        db.log_event(
-            user_name=user_name,
-            terminal_ip=device_ip,
-            terminal_type=terminal_type,
-            event_type="AccessControl",
-            sub_event_type=sub_event_type,
-            action_taken=action_taken,
-            status_code=status_code,
-            is_violation=is_violation,
-            state_before=current_state,
-            state_after=new_state,
-            door_opened=door_opened
-        )
-
-        print(f"✏️  Действие: {action_taken}")
-        print(f"🔄 Новое состояние: {new_state}")
-        print(f"{'='*60}\n")
+            if result is not None and not EVENT_LOG_ASYNC:
+                if door_opened != result['door_opened']:
+                    # Строка аудита уже записана в транзакции с ожидаемым открытием
+                    print(f"⚠️  Дверь на {device_ip}: ожидалось открытие={result['door_opened']}, фактически={door_opened}")
+            else:
+                # Аудит уходит с пути обработки запроса - пишется пакетами в фоне. Решения,
+                # принятые без БД, тоже идут сюда: запись повторяется до восстановления БД
+                event_log_writer.enqueue(
+                    user_name=user_name,
+                    terminal_ip=device_ip,
+                    terminal_type=terminal_type,
+                    event_type="AccessControl",
+                    sub_event_type=sub_event_type,
+                    action_taken=decision['action_taken'],
+                    status_code=status_code,
+                    is_violation=decision['is_violation'],
+                    state_before=state_before,
+                    state_after=new_state,
+                    door_opened=door_opened,
+                    picture_sha256=picture_sha256,
+                    created_at=now
+                )
+
+            # Подписчикам /stream - только постановка в очередь рассылки
+            event_broker.publish("decision", {
+                'user_name': user_name,
+                'terminal_ip': device_ip,
+                'terminal_type': terminal_type,
+                'status_code': status_code,
+                'is_violation': decision['is_violation'],
+                'door_opened': door_opened,
+                'state': new_state,
+                'recorded': result is not None,
+                'time': now.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+            occupancy.record(user_name, device_ip, status_code, now, user_state)
+
+            print(f"✏️  Действие: {decision['action_taken']}")
+            print(f"🔄 Новое состояние: {new_state}")
+            print(f"{'='*60}\n")
+            return result is not None
 
     except Exception as e:
         print(f"❌ Критическая ошибка при обработке события для {user_name}: {e}")
         import traceback
         traceback.print_exc()
+        return False
 
 
 # =============================
 #   Flask сервер
 # =============================
 
-app = Flask(__name__)
-os.makedirs("logs", exist_ok=True)
+bp = Blueprint("apb", __name__)
 
+# Хранилище снимков с терминалов (дедупликация по SHA-256, квота на диск)
+picture_store = PictureStore()
 
-@app.route("/event", methods=["POST"])
-def event():
-    """Обработчик событий от терминалов Hikvision"""
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    log_dir = f"logs/{ts}"
-    os.makedirs(log_dir, exist_ok=True)
+# Пул обработки событий: шарды по пользователю, порядок событий пользователя сохраняется
+ingest_pool = IngestPool(process_apb_event)
 
-    # Сохраняем заголовки
-    with open(f"{log_dir}/headers.json", "w", encoding="utf-8") as f:
-        json.dump(dict(request.headers), f, indent=4, ensure_ascii=False)
+# Потоковая выгрузка event_logs (отдельные соединения, не из пула)
+event_exporter = EventExporter(db)
 
-    # Сохраняем файлы (если есть)
-    for key in request.files:
-        file = request.files[key]
-        file.save(os.path.join(log_dir, file.filename))
+# Кэш ответов эндпоинтов чтения (инвалидация по версии данных db.events_version и TTL)
+result_cache = ResultCache(db)
+
+
+def handle_event_payload(device_ip, headers, form, files):
+    """
+    Обработка запроса терминала (общая для Flask и асинхронного сервера)
+
+    Args:
+        device_ip: IP терминала
+        headers: заголовки запроса (dict)
+        form: поля form-data (dict: ключ -> строка)
+        files: список загруженных файлов (поле, имя файла, содержимое)
+
+    Returns:
+        (тело ответа, HTTP статус)
+    """
+    started = time.monotonic()
+
+    # Неизвестный терминал отклоняется сразу: без архива, снимков и обращений к БД
+    if terminal_registry.get(device_ip) is None:
+        terminal_registry.reject(device_ip)
+        return "Unknown terminal", 403
+
+    # Снимки (если есть) - хэшируем здесь, запись на диск выполняется в фоне
+    archived_files = []
+    picture_sha256 = None
+    for key, filename, data in files:
+        sha256 = picture_store.put(data, filename)
+        archived_files.append({"field": key, "filename": filename, "size": len(data), "sha256": sha256})
+        if picture_sha256 is None:
+            picture_sha256 = sha256
+
+    # Сырое событие уходит в архив одной записью (запись на диск - в фоне)
+    event_archive.append({
+        "device_ip": device_ip,
+        "headers": headers,
+        "form": form,
+        "files": archived_files,
+    })
 
     # Обработка form-data
-    for key, val in request.form.items():
+    for key, val in form.items():
         try:
             data = json.loads(val)
-            with open(f"{log_dir}/{key}.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
 
             # ========== Проверка события AccessControllerEvent ==========
             # Проверяем либо ключ в данных, либо сам ключ = "AccessControllerEvent"
@@ -444,43 +618,43 @@ def event():
             sub_type = ev.get("subEventType")
             user = ev.get("name", "")
 
-            # Получаем IP устройства (для тестирования поддерживаем X-Forwarded-For)
-            device_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-            if ',' in device_ip:
-                device_ip = device_ip.split(',')[0].strip()
-
             # События успешной аутентификации: 75 (по карте) или 117 (по лицу)
             if sub_type in [75, 117]:
-                process_apb_event(user, device_ip, sub_type)
+                if not INGEST_ASYNC:
+                    process_apb_event(user, device_ip, sub_type, picture_sha256=picture_sha256)
+                elif not ingest_pool.submit(user, device_ip, sub_type, picture_sha256):
+                    # Очередь переполнена - терминал повторит отправку события
+                    print(f"⚠️  Очередь обработки событий переполнена - событие {user} отклонено")
+                    return "Busy", 503
 
         except Exception as e:
-            # Если не JSON, сохраняем как текст
-            with open(f"{log_dir}/{key}.txt", "w", encoding="utf-8") as f:
-                f.write(val)
+            # Если не JSON - значение уже сохранено в архиве как есть
             print(f"⚠️ Ошибка обработки события: {e}")
 
-    print(f"📝 Событие сохранено в {log_dir}")
+    if INGEST_ASYNC:
+        ingest_pool.record_stage('ack', time.monotonic() - started)
     return "OK", 200
 
 
-@app.route("/", methods=["GET"])
-def index():
-    """Главная страница - статус системы"""
-    return "✅ Hikvision APB System Active", 200
-
-
-@app.route("/status", methods=["GET"])
-def status():
-    """Статус системы и текущие пользователи внутри"""
-    users_inside = db.get_all_users_inside()
+def status_payload(include_users=False, offset=0, limit=None):
+    """
+    Тело ответа /status (общее для Flask и асинхронного сервера)
 
-    return {
+    Число людей внутри и разбивка по терминалам - из индекса присутствия (O(1)),
+    список людей - только по запросу, страницами (offset, limit)
+    """
+    payload = {
         "status": "active",
         "terminals_connected": len(terminal_connections),
-        "terminals_in": TERMINALS_IN,
-        "terminals_out": TERMINALS_OUT,
-        "users_inside_count": len(users_inside),
-        "users_inside": [
+        "terminals_in": [terminal.ip for terminal in terminal_registry.entries()],
+        "terminals_out": [terminal.ip for terminal in terminal_registry.exits()],
+        "users_inside_count": occupancy.count(),
+        "inside_by_terminal": occupancy.by_terminal(),
+        "last_events": occupancy.last_events(),
+    }
+    if include_users:
+        users_inside, next_offset = occupancy.users(offset, page_limit(limit))
+        payload["users_inside"] = [
             {
                 "name": u[0],
                 "last_terminal": u[1],
@@ -488,85 +662,446 @@ def status():
             }
             for u in users_inside
         ]
+        payload["next_offset"] = next_offset
+    return payload
+
+
+def stream_snapshot(subscriber):
+    """
+    Первый кадр /stream: текущее присутствие (дальше - изменения delta)
+
+    Снимок берется после подписки; изменения, уже вошедшие в снимок
+    (seq <= seq снимка), подписчику не отправляются.
+    """
+    snapshot = occupancy.snapshot()
+    subscriber.skip_through("occupancy", snapshot['seq'])
+    return {'reason': 'snapshot', 'delta': 0, **snapshot}
+
+
+def status_params(args):
+    """Параметры списка /status: (include_users, offset, limit); ValueError при ошибке"""
+    include_users = args.get('users', 'false').lower() == 'true'
+    offset = args.get('offset') or 0
+    if not str(offset).isdigit():
+        raise ValueError(f"Некорректное смещение: {offset}")
+    offset = int(offset)
+    return include_users, offset, page_limit(args.get('limit'))
+
+
+@bp.route("/event", methods=["POST"])
+def event():
+    """Обработчик событий от терминалов Hikvision"""
+    # Получаем IP устройства (для тестирования поддерживаем X-Forwarded-For)
+    device_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    if ',' in device_ip:
+        device_ip = device_ip.split(',')[0].strip()
+
+    files = [
+        (key, request.files[key].filename, request.files[key].read())
+        for key in request.files
+    ]
+    return handle_event_payload(device_ip, dict(request.headers), request.form.to_dict(), files)
+
+
+@bp.route("/", methods=["GET"])
+def index():
+    """Главная страница - статус системы"""
+    return "✅ Hikvision APB System Active", 200
+
+
+@bp.route("/status", methods=["GET"])
+def status():
+    """Статус системы и текущие пользователи внутри (?users=true&offset=&limit= - список)"""
+    try:
+        include_users, offset, limit = status_params(request.args)
+    except ValueError as e:
+        return bad_request(e)
+    return status_payload(include_users, offset, limit), 200
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Внутренние метрики подсистем (пул БД, кэши, очереди)"""
+    return {
+        "status": "success",
+        "db_pool": db.pool_stats(),
+        "state_cache": state_cache.stats(),
+        "event_log_writer": event_log_writer.stats(),
+        "doors": door_controller.stats(),
+        "sdk_lanes": sdk_lanes.stats(),
+        "event_archive": event_archive.stats(),
+        "pictures": picture_store.stats(),
+        "ingest": ingest_pool.stats(),
+        "export": event_exporter.stats(),
+        "result_cache": result_cache.stats(),
+        "occupancy": occupancy.stats(),
+        "stream": event_broker.stats(),
+        "user_locks": user_locks.stats(),
+        "terminal_registry": terminal_registry.stats(),
+        "scheduler": scheduler.stats(),
+        "startup": startup_report,
+    }, 200
+
+
+@bp.route("/terminals", methods=["GET"])
+def terminals():
+    """Состояние сессий терминалов: up/down, число и задержка переподключений"""
+    return {
+        "status": "success",
+        **terminal_supervisor.stats()
     }, 200
 
 
-@app.route("/reset", methods=["POST"])
+@bp.route("/reset", methods=["POST"])
 def manual_reset():
     """Ручной сброс всех состояний (для администратора)"""
     affected = db.reset_daily_states()
+    sync_reset_epoch()
+    # Строки user_states исправляются в фоне, ответ не ждет очистки
+    threading.Thread(target=cleanup_stale_states, name="reset-cleanup", daemon=True).start()
     return {
         "status": "success",
         "message": f"Сброшено состояний: {affected}"
     }, 200
 
 
-@app.route("/violations", methods=["GET"])
+def violations_payload(page, **extra):
+    """Ответ со страницей нарушений (общий для Flask и асинхронного сервера)"""
+    if page is None:
+        return {"status": "error", "message": "Ошибка получения нарушений"}, 503
+    violations, next_cursor = page
+    return {
+        "status": "success",
+        **extra,
+        "count": len(violations),
+        "violations": violations,
+        "next_cursor": next_cursor
+    }, 200
+
+
+def statistics_payload(stats):
+    """Ответ со статистикой (общий для Flask и асинхронного сервера); None - ошибка чтения"""
+    if stats is None:
+        return {"status": "error", "message": "Ошибка получения статистики"}, 503
+    return {
+        "status": "success",
+        "statistics": stats
+    }, 200
+
+
+def bad_request(error):
+    return {"status": "error", "message": str(error)}, 400
+
+
+@bp.route("/violations", methods=["GET"])
 def get_violations():
-    """Получить все нарушения APB"""
+    """Получить нарушения APB (постранично: limit и cursor из next_cursor)"""
     start_date = request.args.get("start_date")
     end_date = request.args.get("end_date")
     user_name = request.args.get("user_name")
 
-    violations = db.get_apb_violations(
-        start_date=start_date,
-        end_date=end_date,
-        user_name=user_name
-    )
+    cursor = request.args.get("cursor")
 
-    return {
-        "status": "success",
-        "count": len(violations),
-        "violations": violations
-    }, 200
+    try:
+        limit = page_limit(request.args.get("limit"))
+        page = result_cache.get_or_compute(
+            "/violations",
+            {"start_date": start_date, "end_date": end_date, "user_name": user_name, "cursor": cursor, "limit": limit},
+            lambda: db.get_apb_violations(
+                start_date=start_date,
+                end_date=end_date,
+                user_name=user_name,
+                cursor=cursor,
+                limit=limit
+            )
+        )
+    except ValueError as e:
+        return bad_request(e)
 
+    return violations_payload(page)
 
-@app.route("/violations/stats", methods=["GET"])
+
+@bp.route("/violations/stats", methods=["GET"])
 def get_violation_stats():
     """Получить статистику нарушений APB"""
     start_date = request.args.get("start_date")
     end_date = request.args.get("end_date")
 
-    stats = db.get_violation_statistics(
-        start_date=start_date,
-        end_date=end_date
+    stats = result_cache.get_or_compute(
+        "/violations/stats",
+        {"start_date": start_date, "end_date": end_date},
+        lambda: db.get_violation_statistics(
+            start_date=start_date,
+            end_date=end_date
+        )
     )
 
-    return {
-        "status": "success",
-        "statistics": stats
-    }, 200
+    return statistics_payload(stats)
 
 
-@app.route("/violations/<status_code>", methods=["GET"])
-def get_violations_by_status(status_code):
-    """Получить нарушения по коду статуса"""
+@bp.route("/stats", methods=["GET"])
+def get_stats():
+    """Статистика событий по дням и типу терминала (из витрин)"""
     start_date = request.args.get("start_date")
     end_date = request.args.get("end_date")
 
-    violations = db.get_violations_by_status_code(
-        status_code=status_code,
-        start_date=start_date,
-        end_date=end_date
+    stats = result_cache.get_or_compute(
+        "/stats",
+        {"start_date": start_date, "end_date": end_date},
+        lambda: db.get_statistics(
+            start_date=start_date,
+            end_date=end_date
+        )
     )
 
-    return {
-        "status": "success",
-        "status_code": status_code,
-        "count": len(violations),
-        "violations": violations
-    }, 200
+    return statistics_payload(stats)
+
+
+@bp.route("/export", methods=["GET"])
+def export_events():
+    """Потоковая выгрузка event_logs в NDJSON или CSV (все события или по фильтрам)"""
+    export_format = request.args.get("format", "ndjson").lower()
+    if export_format not in EXPORT_FORMATS:
+        return bad_request(f"Неизвестный формат выгрузки: {export_format} (ndjson или csv)")
+
+    filters = {
+        "start_date": request.args.get("start_date"),
+        "end_date": request.args.get("end_date"),
+        "user_name": request.args.get("user_name"),
+        "status_code": request.args.get("status_code"),
+        "terminal_ip": request.args.get("terminal_ip"),
+        "violations_only": request.args.get("violations_only", "false").lower() == "true",
+    }
+
+    if not event_exporter.acquire():
+        return {"status": "error", "message": "Слишком много одновременных выгрузок"}, 429
+
+    filename = f"event_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    response = Response(
+        event_exporter.stream(export_format, **filters),
+        content_type=f"{EXPORT_FORMATS[export_format]}; charset=utf-8",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            # Прокси (nginx) не должен буферизовать выгрузку целиком
+            "X-Accel-Buffering": "no",
+        }
+    )
+    # Место выгрузки освобождается, когда сервер закрыл ответ (в том числе при обрыве клиента)
+    response.call_on_close(event_exporter.release)
+    return response
+
+
+@bp.route("/stream", methods=["GET"])
+def stream_events():
+    """Server-Sent Events: решения APB (decision) и изменения присутствия (occupancy)"""
+    subscriber = event_broker.subscribe()
+    if subscriber is None:
+        return {"status": "error", "message": "Слишком много подписчиков /stream"}, 429
+
+    response = Response(
+        event_broker.stream(subscriber, initial=[("occupancy", stream_snapshot(subscriber))]),
+        content_type="text/event-stream; charset=utf-8",
+        headers={
+            "Cache-Control": "no-cache",
+            # Прокси (nginx) не должен буферизовать поток событий
+            "X-Accel-Buffering": "no",
+        }
+    )
+    # Подписка снимается, когда сервер закрыл ответ (отключение клиента видно на heartbeat)
+    response.call_on_close(lambda: event_broker.unsubscribe(subscriber))
+    return response
+
+
+@bp.route("/violations/<status_code>", methods=["GET"])
+def get_violations_by_status(status_code):
+    """Получить нарушения по коду статуса (постранично: limit и cursor из next_cursor)"""
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+
+    cursor = request.args.get("cursor")
+
+    try:
+        limit = page_limit(request.args.get("limit"))
+        page = result_cache.get_or_compute(
+            f"/violations/{status_code}",
+            {"start_date": start_date, "end_date": end_date, "cursor": cursor, "limit": limit},
+            lambda: db.get_violations_by_status_code(
+                status_code=status_code,
+                start_date=start_date,
+                end_date=end_date,
+                cursor=cursor,
+                limit=limit
+            )
+        )
+    except ValueError as e:
+        return bad_request(e)
+
+    return violations_payload(page, status_code=status_code)
 
 
 # =============================
 #   Запуск приложения
 # =============================
 
+_startup_lock = threading.Lock()
+_started = False
+startup_report = {}
+
+
+def start_background_services():
+    """Запуск фоновых потоков и пулов"""
+    # Писатель нужен и при синхронной записи: решения, принятые без БД, пишутся через него
+    event_log_writer.start()
+    door_controller.start()
+    event_broker.start()
+    event_archive.start()
+    picture_store.start()
+    if INGEST_ASYNC:
+        ingest_pool.start()
+
+    terminal_supervisor.start()
+    scheduler.start()
+
+
+def _timed(phase, func):
+    """Выполнить фазу запуска и вернуть (результат, длительность в секундах)"""
+    started = time.monotonic()
+    try:
+        return func(), time.monotonic() - started
+    except Exception as e:
+        print(f"❌ Ошибка фазы запуска {phase}: {e}")
+        return e, time.monotonic() - started
+
+
+def _sdk_phase():
+    init_sdk()
+    login_terminals()
+    return True
+
+
+def startup():
+    """
+    Запуск всех подсистем (идемпотентно)
+
+    Фазы SDK (загрузка библиотеки и подключение к терминалам) и БД (ожидание
+    MySQL, таблицы, прогрев кэша) независимы и выполняются параллельно.
+    Фоновые службы запускаются сразу после готовности БД - фаза SDK может
+    завершиться позже, терминалы подключаются к уже работающему серверу.
+
+    Returns:
+        Отчет о времени запуска по фазам (секунды)
+    """
+    global _started
+
+    with _startup_lock:
+        if _started:
+            return startup_report
+
+        started = time.monotonic()
+        # Ошибка в конфигурации терминалов останавливает запуск
+        terminal_registry.load()
+
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+        sdk_future = executor.submit(_timed, "sdk", _sdk_phase)
+        db_future = executor.submit(_timed, "db", init_db)
+        executor.shutdown(wait=False)
+
+        db_result, db_seconds = db_future.result()
+        if db_result is not True:
+            print("❌ База данных не готова - запуск невозможен")
+            raise SystemExit(1)
+
+        phase_started = time.monotonic()
+        start_background_services()
+        services_seconds = time.monotonic() - phase_started
+
+        startup_report.update({
+            'sdk_seconds': None,
+            'db_seconds': round(db_seconds, 3),
+            'services_seconds': round(services_seconds, 3),
+            'total_seconds': round(time.monotonic() - started, 3),
+            'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        _started = True
+        # Фаза SDK дописывает свое время в отчет по завершении
+        sdk_future.add_done_callback(_report_sdk_phase)
+
+        print("\n" + "=" * 60)
+        print(f"⏱️  Запуск: БД {db_seconds:.2f} сек, службы {services_seconds:.2f} сек, "
+              f"всего {startup_report['total_seconds']:.2f} сек")
+        print("=" * 60 + "\n")
+        return startup_report
+
+
+def _report_sdk_phase(future):
+    sdk_result, sdk_seconds = future.result()
+    startup_report['sdk_seconds'] = round(sdk_seconds, 3)
+    startup_report['sdk_loaded'] = sdk is not None
+    if sdk_result is not True:
+        print("⚠️  SDK недоступен - система будет работать без управления дверями")
+    print(f"⏱️  Фаза SDK: {sdk_seconds:.2f} сек (подключено терминалов: {len(terminal_connections)})")
+
+
+def create_app(start_services=True):
+    """
+    Фабрика приложения Flask
+
+    Args:
+        start_services: выполнить startup() (False - только маршруты, без SDK и БД)
+    """
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if start_services:
+        startup()
+    return app
+
+
+def shutdown():
+    """Корректная остановка всех подсистем (в том числе после частичного запуска)"""
+    global _started
+
+    with _startup_lock:
+        # Дообрабатываем принятые события
+        if INGEST_ASYNC:
+            ingest_pool.stop()
+
+        # Открытые потоки /stream завершаются
+        event_broker.stop()
+
+        # Новые запуски задач не начинаются, выполняющиеся завершаются
+        scheduler.stop()
+
+        # Переподключения больше не нужны
+        terminal_supervisor.stop()
+
+        # Закрываем двери, ожидающие закрытия по таймеру, и дожидаемся выполнения команд
+        # (ограничено по времени) - только после этого выходим из сессий SDK
+        door_controller.stop()
+        sdk_lanes.shutdown()
+
+        if sdk is not None:
+            # Отключаемся от всех терминалов
+            for terminal_ip, user_id in list(terminal_connections.items()):
+                sdk.NET_DVR_Logout(user_id)
+                print(f"🔌 Отключено от {terminal_ip}")
+            terminal_connections.clear()
+            sdk.NET_DVR_Cleanup()
+
+        event_log_writer.stop()
+        event_archive.stop()
+        picture_store.stop()
+        db.disconnect()
+        _started = False
+        print("✅ Система остановлена")
+
+
 if __name__ == "__main__":
     try:
         flask_host = os.getenv("FLASK_HOST", "0.0.0.0")
         flask_port = int(os.getenv("FLASK_PORT", 3000))
 
+        app = create_app()
+
         print("\n" + "=" * 60)
         print(f"🚀 APB System запущен на {flask_host}:{flask_port}")
         print(f"📊 Подключено терминалов входа: {len(terminal_connections)}")
@@ -578,11 +1113,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\n🛑 Завершение работы...")
     finally:
-        # Отключаемся от всех терминалов
-        for terminal_ip, user_id in terminal_connections.items():
-            sdk.NET_DVR_Logout(user_id)
-            print(f"🔌 Отключено от {terminal_ip}")
-
-        sdk.NET_DVR_Cleanup()
-        db.disconnect()
-        print("✅ Система остановлена")
+        shutdown()
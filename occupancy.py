@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from itertools import islice
+import threading
+from datetime import datetime
+
+
+class OccupancyIndex:
+    """
+    In-memory индекс присутствия: кто внутри, сколько по терминалам, последние события
+
+    Обновляется при каждом переходе в process_apb_event авторитетным состоянием из
+    транзакции (Database.apply_transition), поэтому /status отдает число людей
+    внутри за O(1) без запроса к user_states. При запуске и периодически индекс
+    перестраивается из user_states (с учетом эпохи сброса); события, пришедшие во
+    время перестроения, применяются к новому индексу поверх прочитанных строк.
+
+    Каждое изменение получает порядковый номер seq (под блокировкой индекса).
+    Снимок (snapshot) несет номер последнего учтенного изменения, поэтому
+    подписчик может пропустить изменения, уже вошедшие в снимок.
+
+    Args:
+        on_change: функция (dict), вызываемая при изменении числа людей внутри
+            (причина, изменение delta, новое число, seq) - вне блокировки индекса
+    """
+
+    def __init__(self, database, on_change=None):
+        self.db = database
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._inside = {}  # user_name -> (last_terminal, last_event_time), в порядке входа
+        self._by_terminal = Counter()  # terminal_ip -> число людей внутри, вошедших через него
+        self._last_events = {}  # terminal_ip -> последнее событие терминала
+        self._pending = None  # События во время перестроения (None - перестроения нет)
+        self._seq = 0  # Номер последнего изменения числа людей внутри
+        self.rebuilt_at = None
+        self.rebuilds = 0
+        self.transitions = 0
+
+    # ---------- Перестроение ----------
+
+    def rebuild(self):
+        """Перестроить индекс из user_states (False - БД недоступна, индекс не изменен)"""
+        with self._lock:
+            self._pending = []
+
+        rows = self.db.get_all_users_inside()
+        if rows is None:
+            with self._lock:
+                self._pending = None
+            return False
+
+        inside = {}
+        for user_name, last_terminal, last_event_time in sorted(rows, key=lambda row: row[2] or datetime.min):
+            inside[user_name] = (last_terminal, last_event_time)
+
+        with self._lock:
+            before = len(self._inside)
+            pending, self._pending = self._pending, None
+            self._inside = inside
+            self._by_terminal = Counter(terminal for terminal, _ in inside.values())
+            # Переходы, зафиксированные после чтения user_states, новее прочитанных строк
+            for user_name, user_state in pending:
+                self._apply(user_name, user_state)
+            self.rebuilt_at = datetime.now()
+            self.rebuilds += 1
+            count = len(self._inside)
+            seq = self._next_seq() if count != before else None
+
+        print(f"👥 Индекс присутствия перестроен: внутри {count}")
+        if seq is not None:
+            self._changed({'reason': 'rebuild', 'delta': count - before, 'users_inside_count': count, 'seq': seq})
+        return True
+
+    # ---------- Переходы ----------
+
+    def record(self, user_name, terminal_ip, status_code, event_time, user_state):
+        """
+        Учесть событие: user_state - состояние пользователя после транзакции перехода
+        (state, last_terminal, last_event_time)
+
+        Returns:
+            изменение числа людей внутри: 1, -1 или 0
+        """
+        with self._lock:
+            before = len(self._inside)
+            self.transitions += 1
+            self._last_events[terminal_ip] = {
+                'user_name': user_name,
+                'status_code': status_code,
+                'time': event_time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            if self._pending is not None:
+                self._pending.append((user_name, user_state))
+            self._apply(user_name, user_state)
+            count = len(self._inside)
+            delta = count - before
+            seq = self._next_seq() if delta else None
+
+        if delta:
+            self._changed({
+                'reason': 'transition', 'delta': delta, 'users_inside_count': count,
+                'user_name': user_name, 'terminal_ip': terminal_ip, 'state': user_state.get('state'),
+                'seq': seq,
+            })
+        return delta
+
+    def _apply(self, user_name, user_state):
+        """Применить состояние пользователя к индексу (вызывать под self._lock)"""
+        previous = self._inside.get(user_name)
+        if previous is not None:
+            self._by_terminal[previous[0]] -= 1
+            if self._by_terminal[previous[0]] <= 0:
+                del self._by_terminal[previous[0]]
+
+        if user_state.get('state') == 'inside':
+            # Пользователь, уже бывший внутри, сохраняет место в порядке входа
+            entry = (user_state.get('last_terminal'), user_state.get('last_event_time'))
+            self._inside[user_name] = entry
+            self._by_terminal[entry[0]] += 1
+        elif previous is not None:
+            del self._inside[user_name]
+
+    def apply_reset(self, epoch):
+        """Эпоха сброса сдвинута: люди, вошедшие до нее, считаются снаружи"""
+        if epoch is None:
+            return 0
+        with self._lock:
+            stale = [
+                user_name for user_name, (_, last_event_time) in self._inside.items()
+                if last_event_time is None or last_event_time < epoch
+            ]
+            for user_name in stale:
+                self._apply(user_name, {'state': 'outside'})
+            count = len(self._inside)
+            seq = self._next_seq() if stale else None
+        if stale:
+            print(f"👥 Индекс присутствия: сброшено {len(stale)} по эпохе сброса")
+            self._changed({'reason': 'reset', 'delta': -len(stale), 'users_inside_count': count, 'seq': seq})
+        return len(stale)
+
+    def _next_seq(self):
+        """Номер очередного изменения (вызывать под self._lock)"""
+        self._seq += 1
+        return self._seq
+
+    def _changed(self, change):
+        if self.on_change is not None:
+            self.on_change(change)
+
+    # ---------- Чтение ----------
+
+    def count(self):
+        """Число людей внутри - O(1)"""
+        return len(self._inside)
+
+    def snapshot(self):
+        """Согласованный снимок: число людей внутри, разбивка по терминалам и seq последнего изменения"""
+        with self._lock:
+            return {
+                'users_inside_count': len(self._inside),
+                'inside_by_terminal': dict(self._by_terminal),
+                'seq': self._seq,
+            }
+
+    def users(self, offset=0, limit=100):
+        """
+        Страница списка людей внутри (в порядке входа)
+
+        Returns:
+            (строки (user_name, last_terminal, last_event_time), смещение следующей страницы или None)
+        """
+        with self._lock:
+            page = [
+                (user_name, last_terminal, last_event_time)
+                for user_name, (last_terminal, last_event_time)
+                in islice(self._inside.items(), offset, offset + limit)
+            ]
+            total = len(self._inside)
+        next_offset = offset + limit if offset + limit < total else None
+        return page, next_offset
+
+    def by_terminal(self):
+        with self._lock:
+            return dict(self._by_terminal)
+
+    def last_events(self):
+        with self._lock:
+            return {terminal_ip: dict(event) for terminal_ip, event in self._last_events.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'inside': len(self._inside),
+                'terminals': len(self._by_terminal),
+                'transitions': self.transitions,
+                'rebuilds': self.rebuilds,
+                'rebuilt_at': self.rebuilt_at.strftime("%Y-%m-%d %H:%M:%S") if self.rebuilt_at else None,
+            }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PictureStore:
+    """
+    Хранилище снимков лиц с терминалов с адресацией по содержимому
+
+    Файл сохраняется под своим SHA-256 (logs/pictures/ab/abcdef....jpg), поэтому
+    повторно отправленные терминалом одинаковые снимки хранятся один раз.
+    Запись на диск выполняет фоновый пул потоков, общий размер ограничен квотой
+    PICTURE_QUOTA_MB - при превышении удаляются самые старые снимки.
+    Хэш снимка записывается в event_logs.picture_sha256.
+    """
+
+    def __init__(self, directory=None, quota_bytes=None, workers=None, max_pending=None):
+        self.directory = directory or os.getenv("PICTURE_DIR", "logs/pictures")
+        self.quota_bytes = quota_bytes or int(os.getenv("PICTURE_QUOTA_MB", 2048)) * 1024 * 1024
+        self.workers = workers or int(os.getenv("PICTURE_WORKERS", 2))
+        self._pending = threading.BoundedSemaphore(max_pending or int(os.getenv("PICTURE_MAX_PENDING", 200)))
+        self._executor = None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sha256 -> (path, size), от старых к новым
+        self._in_flight = set()
+        self._total_bytes = 0
+
+        # Метрики
+        self._stored = 0
+        self._deduplicated = 0
+        self._evicted = 0
+        self._dropped = 0
+
+    def _load(self):
+        """Восстановить индекс снимков по содержимому каталога (от старых к новым)"""
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    # Недописанный файл прерванной записи - не снимок, удаляем
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        print(f"⚠️ Не удалось удалить временный файл {path}: {e}")
+                    continue
+                sha256 = name.split(".", 1)[0]
+                if len(sha256) != 64:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, sha256, path, stat.st_size))
+
+        for _, sha256, path, size in sorted(found):
+            self._entries[sha256] = (path, size)
+            self._total_bytes += size
+
+    def start(self):
+        """Запуск пула записи (при первом запуске - восстановление индекса с диска)"""
+        if self._executor is None:
+            with self._lock:
+                self._entries.clear()
+                self._total_bytes = 0
+            os.makedirs(self.directory, exist_ok=True)
+            self._load()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="picture-store")
+
+    def stop(self):
+        """Остановка с записью всех поставленных в очередь снимков"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def put(self, data, filename=None):
+        """
+        Сохранить снимок (запись - в фоне)
+
+        Returns:
+            SHA-256 содержимого (для связи со строкой event_logs) или None, если
+            снимок отброшен из-за переполнения очереди записи
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(filename or "")[1].lower() or ".jpg"
+
+        with self._lock:
+            if sha256 in self._entries or sha256 in self._in_flight:
+                # Повторная отправка того же снимка - только обновляем "свежесть"
+                if sha256 in self._entries:
+                    self._entries.move_to_end(sha256)
+                self._deduplicated += 1
+                return sha256
+
+            if self._executor is None or not self._pending.acquire(blocking=False):
+                self._dropped += 1
+                return None
+            self._in_flight.add(sha256)
+
+        self._executor.submit(self._write, sha256, ext, data)
+        return sha256
+
+    def _write(self, sha256, ext, data):
+        try:
+            subdir = os.path.join(self.directory, sha256[:2])
+            os.makedirs(subdir, exist_ok=True)
+            path = os.path.join(subdir, sha256 + ext)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                self._entries[sha256] = (path, len(data))
+                self._total_bytes += len(data)
+                self._stored += 1
+            self._evict()
+        except OSError as e:
+            print(f"❌ Ошибка сохранения снимка {sha256[:12]}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(sha256)
+            self._pending.release()
+
+    def _evict(self):
+        """Удалить самые старые снимки, пока общий размер превышает квоту"""
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.quota_bytes or not self._entries:
+                    return
+                sha256, (path, size) = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self._evicted += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def path(self, sha256):
+        """Путь к файлу снимка по хэшу (или None)"""
+        with self._lock:
+            entry = self._entries.get(sha256)
+        return entry[0] if entry else None
+
+    def stats(self):
+        """Метрики хранилища снимков"""
+        with self._lock:
+            return {
+                'pictures': len(self._entries),
+                'total_bytes': self._total_bytes,
+                'quota_bytes': self.quota_bytes,
+                'pending_writes': len(self._in_flight),
+                'stored': self._stored,
+                'deduplicated': self._deduplicated,
+                'evicted': self._evicted,
+                'dropped': self._dropped,
+            }
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ResultCache:
+    """
+    Кэш результатов эндпоинтов чтения (LRU + версия данных + TTL)
+
+    Ключ - эндпоинт и нормализованные параметры запроса (пустые отброшены,
+    порядок не важен). Запись действительна, пока не изменилась версия данных
+    database.events_version (увеличивается при записи событий и состояний) и не
+    истек RESULT_CACHE_TTL - TTL ограничивает устаревание при изменениях, не
+    видимых этому процессу (другие процессы, ручные правки в БД). Повторные
+    опросы дашбордов между событиями не доходят до MySQL.
+
+    Версия запоминается до вычисления результата: если во время запроса к БД
+    пришло событие, запись сразу считается устаревшей.
+    """
+
+    def __init__(self, database, max_size=None, ttl=None):
+        self.db = database
+        self.max_size = max_size or int(os.getenv("RESULT_CACHE_SIZE", 1000))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESULT_CACHE_TTL", 30))
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # Промахи из-за изменения версии данных
+        self.expired = 0  # Промахи по TTL
+        self.evictions = 0
+
+    @staticmethod
+    def key(endpoint, params=None):
+        """Ключ кэша: эндпоинт + отсортированные непустые параметры"""
+        items = (params or {}).items()
+        return endpoint, tuple(sorted((name, str(value)) for name, value in items if value not in (None, "")))
+
+    def _lookup(self, key):
+        """(найдено, значение, версия на момент проверки)"""
+        version = self.db.events_version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version == version and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, version
+                del self._entries[key]
+                if entry_version != version:
+                    self.stale += 1
+                else:
+                    self.expired += 1
+            self.misses += 1
+        return False, None, version
+
+    def _store(self, key, version, value):
+        if value is None or self.ttl <= 0:
+            # None - ошибка чтения, ее не кэшируем
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, endpoint, params, compute):
+        """Результат из кэша или compute() с сохранением в кэше"""
+        key = self.key(endpoint, params)
+        found, value, version = self._lookup(key)
+        if found:
+            return value
+        value = compute()
+        self._store(key, version, value)
+        return value
+
+    async def get_or_compute_async(self, endpoint, params, compute):
+        """То же для асинхронного сервера: compute - корутинная функция"""
+        key = self.key(endpoint, params)
+        found, value, version = self._lookup(key)
+        if found:
+            return value
+        value = await compute()
+        self._store(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'version': self.db.events_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+import heapq
+import itertools
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@contextmanager
+def _no_lock(name):
+    yield True
+
+
+class Job:
+    """Задача планировщика и метрики ее запусков"""
+
+    def __init__(self, name, func, every=None, daily_at=None, single_runner=True, run_at_start=False):
+        self.name = name
+        self.func = func
+        self.every = every  # Интервал (сек)
+        self.daily_at = daily_at  # datetime.time ежедневного запуска
+        self.single_runner = single_runner
+        self.run_at_start = run_at_start
+        self.next_run = None  # datetime
+        self.running = False
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # Пропуски: задача уже выполняется здесь или в другом процессе
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = None
+        self.last_run = None
+        self.last_error = None
+
+    def next_after(self, moment):
+        """Следующее время запуска после moment"""
+        if self.every is not None:
+            return moment + timedelta(seconds=self.every)
+        due = datetime.combine(moment.date(), self.daily_at)
+        if due <= moment:
+            due += timedelta(days=1)
+        return due
+
+
+class Scheduler:
+    """
+    Планировщик периодических задач на очереди с приоритетом (куча времен запуска)
+
+    Поток планировщика спит до ближайшего времени запуска (а не опрашивает
+    каждую минуту) и передает задачу в небольшой пул, поэтому долгая задача не
+    задерживает остальные. Задачи с single_runner выполняются под именованной
+    блокировкой (MySQL GET_LOCK) - при нескольких процессах задачу выполняет один.
+
+    Args:
+        lock: функция (name) -> контекстный менеджер, возвращающий True, если
+            блокировка задачи получена (по умолчанию блокировки нет)
+    """
+
+    def __init__(self, lock=None, workers=None):
+        self.lock = lock or _no_lock
+        self.workers = workers or int(os.getenv("SCHEDULER_WORKERS", 2))
+        self._jobs = {}
+        self._heap = []  # (next_run, seq, name)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._running = False
+
+    # ---------- Регистрация ----------
+
+    def every(self, name, seconds, func, single_runner=True, run_at_start=False):
+        """Запускать func каждые seconds секунд"""
+        return self._add(Job(name, func, every=seconds, single_runner=single_runner, run_at_start=run_at_start))
+
+    def daily(self, name, at, func, single_runner=True, run_at_start=False):
+        """Запускать func ежедневно в at ('HH:MM' или datetime.time)"""
+        if isinstance(at, str):
+            hour, minute = map(int, at.split(":"))
+            at = dt_time(hour, minute)
+        return self._add(Job(name, func, daily_at=at, single_runner=single_runner, run_at_start=run_at_start))
+
+    def _add(self, job):
+        with self._cond:
+            if job.name in self._jobs:
+                raise ValueError(f"Задача {job.name} уже зарегистрирована")
+            self._jobs[job.name] = job
+            if self._running:
+                self._schedule(job, datetime.now() if job.run_at_start else job.next_after(datetime.now()))
+        return job
+
+    def _schedule(self, job, due):
+        """Поставить задачу в кучу (вызывать под self._cond)"""
+        job.next_run = due
+        heapq.heappush(self._heap, (due, next(self._seq), job.name))
+        self._cond.notify()
+
+    # ---------- Запуск ----------
+
+    def start(self):
+        """Запуск потока планировщика"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._heap = []
+            now = datetime.now()
+            for job in self._jobs.values():
+                self._schedule(job, now if job.run_at_start else job.next_after(now))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler-job")
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        """Остановка: новые запуски не начинаются, выполняющиеся задачи завершаются"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def run_now(self, name):
+        """Запустить задачу вне расписания (следующий плановый запуск не меняется)"""
+        job = self._jobs[name]
+        if self._executor is None:
+            self._execute(job)
+        else:
+            self._executor.submit(self._execute, job)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, name = self._heap[0]
+                wait = (due - datetime.now()).total_seconds()
+                if wait > 0:
+                    # Не дольше минуты: перевод системных часов не сдвигает запуск надолго
+                    self._cond.wait(min(wait, 60))
+                    continue
+                heapq.heappop(self._heap)
+                job = self._jobs[name]
+                # Следующий запуск считается от планового времени, а не от окончания задачи
+                self._schedule(job, job.next_after(max(due, datetime.now() - timedelta(seconds=1))))
+
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        with self._cond:
+            if job.running:
+                job.skipped += 1
+                return
+            job.running = True
+
+        try:
+            lock = self.lock(job.name) if job.single_runner else _no_lock(job.name)
+            with lock as acquired:
+                if not acquired:
+                    # Задачу сейчас выполняет другой процесс
+                    with self._cond:
+                        job.skipped += 1
+                    return
+
+                started = time.monotonic()
+                error = None
+                try:
+                    job.func()
+                except Exception as e:
+                    error = str(e)
+                    print(f"❌ Ошибка задачи {job.name}: {e}")
+                elapsed = time.monotonic() - started
+
+                with self._cond:
+                    job.runs += 1
+                    job.last_run = datetime.now()
+                    job.last_time = elapsed
+                    job.total_time += elapsed
+                    job.max_time = max(job.max_time, elapsed)
+                    if error is not None:
+                        job.failures += 1
+                    job.last_error = error
+        except Exception as e:
+            # Ошибка получения блокировки (например, БД недоступна)
+            with self._cond:
+                job.failures += 1
+                job.last_error = str(e)
+            print(f"❌ Ошибка запуска задачи {job.name}: {e}")
+        finally:
+            with self._cond:
+                job.running = False
+
+    # ---------- Метрики ----------
+
+    def stats(self):
+        """Расписание и длительность выполнения задач"""
+        with self._cond:
+            return {
+                job.name: {
+                    'schedule': f"every {job.every:g}s" if job.every is not None
+                    else f"daily at {job.daily_at.strftime('%H:%M')}",
+                    'single_runner': job.single_runner,
+                    'next_run': job.next_run.strftime("%Y-%m-%d %H:%M:%S") if job.next_run else None,
+                    'running': job.running,
+                    'runs': job.runs,
+                    'failures': job.failures,
+                    'skipped': job.skipped,
+                    'last_run': job.last_run.strftime("%Y-%m-%d %H:%M:%S") if job.last_run else None,
+                    'last_ms': round(job.last_time * 1000, 3) if job.last_time is not None else None,
+                    'avg_ms': round(job.total_time / job.runs * 1000, 3) if job.runs else 0.0,
+                    'max_ms': round(job.max_time * 1000, 3),
+                    'last_error': job.last_error,
+                }
+                for job in self._jobs.values()
+            }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import (
+    CancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures
+)
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class _Lane:
+    """Очередь команд одного терминала: один поток, строгий порядок вызовов"""
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sdk-lane-{key}")
+        self.futures = set()  # Принятые и еще не завершенные вызовы
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class SdkCommandLanes:
+    """
+    Полосы команд SDK по терминалам (user_id сессии HCNetSDK)
+
+    Вызовы к разным терминалам выполняются параллельно, вызовы к одному
+    терминалу - строго последовательно. Зависший терминал блокирует только
+    свою полосу: call() ждет не дольше SDK_CALL_TIMEOUT секунд, submit() не ждет
+    вовсе. В полосе не больше SDK_LANE_MAX_PENDING ожидающих вызовов - зависшая
+    полоса отклоняет новые вызовы, а не копит их.
+    """
+
+    def __init__(self, call_timeout=None, max_pending=None):
+        self.call_timeout = call_timeout or float(os.getenv("SDK_CALL_TIMEOUT", 5))
+        self.max_pending = max_pending or int(os.getenv("SDK_LANE_MAX_PENDING", 16))
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def _lane(self, key, label):
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = _Lane(key, label)
+                self._lanes[key] = lane
+            elif label is not None:
+                lane.label = label
+            return lane
+
+    def _submit(self, lane, func, args, count_slow=False):
+        """
+        Поставить вызов в полосу (None - полоса переполнена или закрыта)
+
+        count_slow - считать таймаутом вызов дольше call_timeout (для вызовов
+        без ожидающего потока, которому некому сообщить о таймауте)
+        """
+
+        def run():
+            started = time.monotonic()
+            try:
+                return func(*args)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    lane.pending -= 1
+                    lane.calls += 1
+                    lane.total_time += elapsed
+                    lane.max_time = max(lane.max_time, elapsed)
+                    if count_slow and elapsed > self.call_timeout:
+                        lane.timeouts += 1
+
+        with self._lock:
+            if lane.pending >= self.max_pending:
+                lane.rejected += 1
+                rejected = True
+            else:
+                lane.pending += 1
+                rejected = False
+        if rejected:
+            print(f"⚠️  Полоса SDK {lane.label or lane.key} переполнена - вызов отклонен")
+            return None
+
+        try:
+            future = lane.executor.submit(run)
+        except RuntimeError:
+            # Полоса закрыта (выход из сессии или остановка)
+            with self._lock:
+                lane.pending -= 1
+                lane.rejected += 1
+            return None
+
+        with self._lock:
+            lane.futures.add(future)
+
+        def forget(f):
+            with self._lock:
+                lane.futures.discard(f)
+                if f.cancelled():
+                    lane.pending -= 1
+
+        future.add_done_callback(forget)
+        return future
+
+    def call(self, key, func, *args, label=None, timeout=None):
+        """
+        Выполнить func(*args) в полосе терминала key и дождаться результата
+
+        Returns:
+            Результат вызова или None при таймауте/ошибке/переполнении полосы
+        """
+        lane = self._lane(key, label)
+        timeout = timeout or self.call_timeout
+
+        future = self._submit(lane, func, args)
+        if future is None:
+            return None
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                lane.timeouts += 1
+            print(f"⏱️  Таймаут вызова SDK для {lane.label or key} ({timeout} сек)")
+            return None
+        except Exception as e:
+            with self._lock:
+                lane.errors += 1
+            print(f"❌ Ошибка вызова SDK для {lane.label or key}: {e}")
+            return None
+
+    def submit(self, key, func, *args, label=None, callback=None):
+        """
+        Поставить func(*args) в полосу терминала key, не дожидаясь результата
+
+        callback(result) вызывается в потоке полосы после завершения вызова
+        (result - None при ошибке SDK).
+
+        Returns:
+            True, если вызов принят; False, если полоса переполнена или закрыта
+        """
+        lane = self._lane(key, label)
+        future = self._submit(lane, func, args, count_slow=True)
+        if future is None:
+            return False
+
+        if callback is not None:
+            def done(f):
+                try:
+                    result = f.result()
+                except CancelledError:
+                    # Полоса закрыта до выполнения вызова (выход из сессии или остановка)
+                    result = None
+                except Exception as e:
+                    with self._lock:
+                        lane.errors += 1
+                    print(f"❌ Ошибка вызова SDK для {lane.label or key}: {e}")
+                    result = None
+                try:
+                    callback(result)
+                except Exception as e:
+                    print(f"❌ Ошибка обработки результата SDK для {lane.label or key}: {e}")
+
+            future.add_done_callback(done)
+        return True
+
+    def close_lane(self, key, timeout=None):
+        """
+        Закрыть полосу терминала перед выходом из сессии
+
+        Ожидающие вызовы отменяются (сессия user_id больше недействительна, а после
+        повторного входа user_id может достаться другому терминалу), выполняющийся
+        вызов дожидаемся не дольше timeout (по умолчанию SDK_CALL_TIMEOUT) секунд.
+        """
+        with self._lock:
+            lane = self._lanes.pop(key, None)
+        if lane is None:
+            return
+        lane.executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            futures = list(lane.futures)
+        wait_futures(futures, timeout=timeout or self.call_timeout)
+
+    def shutdown(self, timeout=None):
+        """
+        Остановить все полосы перед выходом из сессий
+
+        Уже принятые вызовы (например, закрытие дверей при остановке) выполняются,
+        но суммарно не дольше timeout (по умолчанию SDK_CALL_TIMEOUT) секунд;
+        не успевшие начаться вызовы отменяются.
+        """
+        with self._lock:
+            lanes = list(self._lanes.values())
+            self._lanes.clear()
+            futures = [future for lane in lanes for future in lane.futures]
+        for lane in lanes:
+            lane.executor.shutdown(wait=False)
+
+        _, not_done = wait_futures(futures, timeout=timeout or self.call_timeout)
+        if not_done:
+            for lane in lanes:
+                lane.executor.shutdown(wait=False, cancel_futures=True)
+            print(f"⚠️  Остановка полос SDK: не дождались вызовов: {len(not_done)}")
+
+    def stats(self):
+        """Задержки и счетчики вызовов по полосам"""
+        with self._lock:
+            return {
+                str(lane.label or key): {
+                    'user_id': key,
+                    'pending': lane.pending,
+                    'rejected': lane.rejected,
+                    'calls': lane.calls,
+                    'errors': lane.errors,
+                    'timeouts': lane.timeouts,
+                    'avg_ms': round(lane.total_time / lane.calls * 1000, 3) if lane.calls else 0.0,
+                    'max_ms': round(lane.max_time * 1000, 3),
+                }
+                for key, lane in self._lanes.items()
+            }
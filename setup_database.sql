@@ -17,9 +17,7 @@ CREATE TABLE IF NOT EXISTS user_states (
     last_reset_date DATE,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    INDEX idx_user_name (user_name),
-    INDEX idx_state (state),
-    INDEX idx_last_entry_auth_time (last_entry_auth_time)
+    INDEX idx_state_event_time (state, last_event_time)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Миграция: добавление поля last_entry_auth_time для существующих таблиц
@@ -44,7 +42,7 @@ DEALLOCATE PREPARE alterIfNotExists;
 
 -- Таблица логов событий
 CREATE TABLE IF NOT EXISTS event_logs (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+    id INT AUTO_INCREMENT,
     user_name VARCHAR(255) NOT NULL,
     terminal_ip VARCHAR(50) NOT NULL,
     terminal_type ENUM('entry', 'exit') NOT NULL,
@@ -56,14 +54,21 @@ CREATE TABLE IF NOT EXISTS event_logs (
     state_before ENUM('inside', 'outside'),
     state_after ENUM('inside', 'outside'),
     door_opened BOOLEAN DEFAULT FALSE,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_user_name (user_name),
-    INDEX idx_terminal (terminal_ip),
+    picture_sha256 CHAR(64) NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at),
+    -- Индексы под формы запросов (проверка планов - check_indexes.py)
     INDEX idx_created_at (created_at),
-    INDEX idx_status_code (status_code),
-    INDEX idx_is_violation (is_violation),
-    INDEX idx_violation_date (is_violation, created_at)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+    INDEX idx_violation_date (is_violation, created_at),
+    INDEX idx_user_violation_date (user_name, is_violation, created_at),
+    INDEX idx_status_violation_date (status_code, is_violation, created_at),
+    INDEX idx_terminal_date (terminal_ip, created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+-- Секции по месяцам создает приложение при запуске и ежедневно
+-- (Database.manage_event_log_partitions): p_future делится на секции периодов
+PARTITION BY RANGE (TO_DAYS(created_at)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
 
 -- Миграция: добавление полей status_code и is_violation для существующих таблиц
 SET @dbname = DATABASE();
@@ -103,6 +108,35 @@ PREPARE alterIfNotExists FROM @preparedStatement;
 EXECUTE alterIfNotExists;
 DEALLOCATE PREPARE alterIfNotExists;
 
+-- Добавление picture_sha256 (связь со снимком в хранилище logs/pictures)
+SET @columnname3 = 'picture_sha256';
+SET @preparedStatement = (SELECT IF(
+    (
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE
+            (TABLE_SCHEMA = @dbname)
+            AND (TABLE_NAME = @tablename)
+            AND (COLUMN_NAME = @columnname3)
+    ) > 0,
+    'SELECT 1',
+    CONCAT('ALTER TABLE ', @tablename, ' ADD COLUMN ', @columnname3, ' CHAR(64) NULL')
+));
+PREPARE alterIfNotExists FROM @preparedStatement;
+EXECUTE alterIfNotExists;
+DEALLOCATE PREPARE alterIfNotExists;
+
+-- Миграция: секционирование существующей event_logs по created_at
+-- Перестраивает таблицу целиком - выполняйте в окно обслуживания, сделав резервную копию.
+-- После миграции приложение само создаст секции периодов и будет удалять старые
+-- секции при EVENT_LOG_RETENTION_DAYS > 0.
+-- ALTER TABLE event_logs MODIFY created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP;
+-- ALTER TABLE event_logs DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at);
+-- ALTER TABLE event_logs PARTITION BY RANGE (TO_DAYS(created_at)) (
+--     -- вместо даты укажите начало текущего месяца: строки до нее останутся в p_history
+--     PARTITION p_history VALUES LESS THAN (TO_DAYS('2026-01-01')),
+--     PARTITION p_future VALUES LESS THAN MAXVALUE
+-- );
+
 -- Таблица конфигурации системы
 CREATE TABLE IF NOT EXISTS system_config (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -112,6 +146,55 @@ CREATE TABLE IF NOT EXISTS system_config (
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Эпоха сброса состояний (ежедневный сброс без UPDATE всей user_states):
+-- config_key = 'reset_epoch', config_value = 'YYYY-MM-DD HH:MM:SS'.
+-- Состояние 'inside' с last_event_time раньше эпохи считается 'outside'.
+
+-- Миграция: индексы существующих таблиц (приложение выполняет ее само при запуске).
+-- Составные индексы заменяют одиночные; idx_user_name в user_states дублирует UNIQUE,
+-- по last_entry_auth_time запросов нет. Удаляйте только существующие индексы.
+-- ALTER TABLE user_states
+--     ADD INDEX idx_state_event_time (state, last_event_time),
+--     DROP INDEX idx_user_name, DROP INDEX idx_state, DROP INDEX idx_last_entry_auth_time;
+-- ALTER TABLE event_logs
+--     ADD INDEX idx_user_violation_date (user_name, is_violation, created_at),
+--     ADD INDEX idx_status_violation_date (status_code, is_violation, created_at),
+--     ADD INDEX idx_terminal_date (terminal_ip, created_at),
+--     DROP INDEX idx_user_name, DROP INDEX idx_terminal, DROP INDEX idx_status_code, DROP INDEX idx_is_violation,
+--     ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Почасовая витрина событий по терминалу и коду статуса (/violations/stats, /stats)
+CREATE TABLE IF NOT EXISTS event_rollup_hourly (
+    bucket_hour DATETIME NOT NULL,
+    terminal_ip VARCHAR(50) NOT NULL,
+    terminal_type ENUM('entry', 'exit') NOT NULL,
+    status_code VARCHAR(50) NOT NULL,
+    is_violation BOOLEAN NOT NULL DEFAULT FALSE,
+    events INT NOT NULL DEFAULT 0,
+    doors_opened INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_hour, terminal_ip, terminal_type, status_code),
+    INDEX idx_violation_hour (is_violation, bucket_hour)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Суточная витрина событий по пользователю
+CREATE TABLE IF NOT EXISTS user_rollup_daily (
+    day DATE NOT NULL,
+    user_name VARCHAR(255) NOT NULL,
+    terminal_type ENUM('entry', 'exit') NOT NULL,
+    events INT NOT NULL DEFAULT 0,
+    violations INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_name, terminal_type)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Витрины пополняются при записи событий. События, записанные до их появления,
+-- учитывает задача rollup_backfill: id event_logs до 'rollup_backfill_id'
+-- (фиксируется при первом запуске), пройденная часть - 'rollup_watermark'.
+INSERT IGNORE INTO system_config (config_key, config_value, description)
+SELECT 'rollup_backfill_id', COALESCE(MAX(id), 0), 'Последний id event_logs до появления витрин'
+FROM event_logs;
+INSERT IGNORE INTO system_config (config_key, config_value, description)
+VALUES ('rollup_watermark', '0', 'Водяной знак заполнения витрин (id event_logs)');
+
 -- Создание пользователя (опционально)
 -- Раскомментируйте и измените пароль при необходимости
 -- CREATE USER IF NOT EXISTS 'apb_user'@'localhost' IDENTIFIED BY 'your_strong_password';
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import os
+import threading
+from dotenv import load_dotenv
+from apb_logic import apply_decision, effective_state
+
+load_dotenv()
+
+
+class UserStateCache:
+    """
+    In-memory кэш состояний пользователей APB (LRU + write-through)
+
+    Решение APB принимает транзакция перехода в MySQL (Database.apply_transition),
+    кэш на этом пути не читается: после каждого перехода он только принимает
+    авторитетное состояние из БД. Читается кэш, когда БД недоступна - решение
+    тогда принимается по последнему известному состоянию в памяти (peek).
+    Ежедневный сброс применяется по эпохе сброса (как в БД) без обхода записей.
+
+    Переходы, принятые в памяти при недоступной БД (record_fallback), хранятся
+    отдельно от LRU до записи в user_states: перед следующим переходом
+    пользователя или фоновой задачей (sync).
+    """
+
+    def __init__(self, database, max_size=None):
+        self.db = database
+        self.max_size = max_size or int(os.getenv("STATE_CACHE_SIZE", 50000))
+        self._entries = OrderedDict()
+        self._unsynced = {}  # user_name -> состояние, принятое без БД и еще не записанное
+        self._lock = threading.Lock()
+        self.reset_epoch = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _store(self, user_name, data):
+        """Сохранить запись в кэше с вытеснением самых старых (вызывать под self._lock)"""
+        self._entries[user_name] = data
+        self._entries.move_to_end(user_name)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def warm_up(self):
+        """Массовая загрузка последних активных пользователей из user_states"""
+        rows = self.db.load_user_states(limit=self.max_size)
+        self.reset_epoch = self.db.get_reset_epoch()
+        with self._lock:
+            # Строки приходят от самых свежих к старым - загружаем в обратном порядке,
+            # чтобы самые активные пользователи оказались в "горячем" конце LRU
+            for user_name, data in reversed(rows):
+                self._store(user_name, data)
+        print(f"🔥 Кэш состояний прогрет: {len(rows)} пользователей")
+        return len(rows)
+
+    def _effective(self, data):
+        """Копия записи с состоянием по эпохе сброса (вызывать под self._lock)"""
+        data = dict(data)
+        data['state'] = effective_state(data, self.reset_epoch)
+        return data
+
+    def peek(self, user_name):
+        """Состояние пользователя только из памяти (None - нет в кэше), без обращения к БД"""
+        with self._lock:
+            data = self._unsynced.get(user_name) or self._entries.get(user_name)
+            if data is None:
+                self.misses += 1
+                return None
+            if user_name in self._entries:
+                self._entries.move_to_end(user_name)
+            self.hits += 1
+            return self._effective(data)
+
+    def record_transition(self, user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+                          door_opened, window_seconds, now=None, write_log=True, picture_sha256=None):
+        """
+        Зафиксировать переход состояния (write-through)
+
+        Переход атомарно записывается в БД (Database.apply_transition), а кэш
+        обновляется авторитетным состоянием, которое вернула транзакция. Если у
+        пользователя есть переход, принятый без БД, он сначала записывается в
+        user_states. При ошибке кэш сохраняет последнее известное состояние.
+        Вызывать под блокировкой пользователя (user_locks).
+        """
+        if not self.sync(user_name):
+            return None
+        result = self.db.apply_transition(
+            user_name, terminal_ip, terminal_type, event_type, sub_event_type,
+            door_opened, window_seconds, now=now, write_log=write_log, picture_sha256=picture_sha256
+        )
+        if result:
+            with self._lock:
+                self._store(user_name, dict(result['user_state']))
+        return result
+
+    def record_fallback(self, user_name, terminal_ip, terminal_type, decision, now):
+        """
+        Учесть решение, принятое в памяти при недоступной БД
+
+        Состояние пользователя обновляется по тем же правилам, что и в транзакции
+        перехода, и ждет записи в user_states (sync). Вызывать под блокировкой
+        пользователя (user_locks).
+
+        Returns:
+            Новое состояние пользователя (копия)
+        """
+        with self._lock:
+            data = self._unsynced.get(user_name) or self._entries.get(user_name)
+            user_state = self._effective(data) if data is not None else {
+                'state': 'outside', 'last_terminal': None, 'last_event_time': None,
+                'last_reset_date': None, 'last_entry_auth_time': None,
+            }
+            apply_decision(user_state, decision, terminal_ip, terminal_type, now)
+            self._unsynced[user_name] = user_state
+            self._store(user_name, dict(user_state))
+            return dict(user_state)
+
+    def unsynced_users(self):
+        """Пользователи с переходами, еще не записанными в user_states"""
+        with self._lock:
+            return list(self._unsynced)
+
+    def sync(self, user_name):
+        """
+        Записать в user_states переход пользователя, принятый без БД
+        (True - записывать нечего или запись удалась). Вызывать под блокировкой
+        пользователя (user_locks).
+        """
+        with self._lock:
+            user_state = self._unsynced.get(user_name)
+        if user_state is None:
+            return True
+        if not self.db.sync_user_state(user_name, user_state):
+            return False
+        with self._lock:
+            if self._unsynced.get(user_name) is user_state:
+                del self._unsynced[user_name]
+        return True
+
+    def reset_all(self, epoch=None):
+        """Отразить сброс в памяти за O(1): принять новую эпоху сброса (по умолчанию - из БД)"""
+        epoch = epoch or self.db.get_reset_epoch()
+        with self._lock:
+            if epoch is not None and (self.reset_epoch is None or epoch > self.reset_epoch):
+                self.reset_epoch = epoch
+
+    def stats(self):
+        """Статистика работы кэша"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'unsynced': len(self._unsynced),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'reset_epoch': self.reset_epoch.strftime("%Y-%m-%d %H:%M:%S") if self.reset_epoch else None,
+            }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TERMINAL_TYPES = ("entry", "exit")
+
+# Переменные окружения старого формата: TERMINAL_IN_<n> / TERMINAL_OUT_<n>
+_ENV_TERMINAL = re.compile(r"^TERMINAL_(IN|OUT)_(\d+)$")
+
+
+class Terminal:
+    """Настройки одного терминала"""
+
+    def __init__(self, ip, type, name=None, door_no=1, port=None, user=None, password=None, sdk=None):
+        if type not in TERMINAL_TYPES:
+            raise ValueError(f"Терминал {ip}: неизвестный тип '{type}' (ожидается entry или exit)")
+        self.ip = ip
+        self.type = type
+        self.name = name or ip
+        self.door_no = int(door_no)
+        self.port = int(port or os.getenv("TERMINAL_PORT", 8000))
+        self.user = user if user is not None else os.getenv("TERMINAL_USER", "")
+        self.password = password if password is not None else os.getenv("TERMINAL_PASSWORD", "")
+        # По умолчанию через SDK управляются только двери входа
+        self.sdk = (type == "entry") if sdk is None else bool(sdk)
+
+    def as_dict(self):
+        """Описание терминала для API (без пароля)"""
+        return {
+            'ip': self.ip,
+            'type': self.type,
+            'name': self.name,
+            'door_no': self.door_no,
+            'sdk': self.sdk,
+        }
+
+
+class TerminalRegistry:
+    """
+    Реестр терминалов с поиском по IP за O(1)
+
+    Терминалы читаются из JSON файла TERMINALS_FILE (без ограничения числа,
+    свои тип, номер двери и учетные данные SDK у каждого). Если файла нет,
+    используются переменные окружения TERMINAL_IN_<n> / TERMINAL_OUT_<n>.
+    Формат файла - см. terminals.example.json.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("TERMINALS_FILE", "terminals.json")
+        self._lock = threading.Lock()
+        self._by_ip = {}
+        self._source = None
+        self._rejected = 0
+
+    def load(self):
+        """Загрузить (перезагрузить) реестр; ошибка конфигурации - ValueError"""
+        if os.path.exists(self.path):
+            terminals, source = self._load_file(), self.path
+        else:
+            terminals, source = self._load_env(), "env"
+
+        by_ip = {}
+        for terminal in terminals:
+            if terminal.ip in by_ip:
+                raise ValueError(f"Терминал {terminal.ip} указан в конфигурации дважды")
+            by_ip[terminal.ip] = terminal
+
+        # Новый словарь подставляется целиком - читатели не видят реестр частично
+        with self._lock:
+            self._by_ip = by_ip
+            self._source = source
+        print(f"📋 Реестр терминалов ({source}): входов {len(self.entries())}, выходов {len(self.exits())}")
+        return self
+
+    def _load_file(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if isinstance(config, list):
+            config = {"terminals": config}
+
+        defaults = config.get("defaults", {})
+        try:
+            return [Terminal(**{**defaults, **item}) for item in config.get("terminals", [])]
+        except TypeError as e:
+            raise ValueError(f"Ошибка в {self.path}: {e}")
+
+    def _load_env(self):
+        found = []
+        for key, value in os.environ.items():
+            match = _ENV_TERMINAL.match(key)
+            if match and value:
+                kind, number = match.groups()
+                found.append((kind, int(number), value.strip()))
+        return [
+            Terminal(ip, "entry" if kind == "IN" else "exit", name=f"{'Вход' if kind == 'IN' else 'Выход'} {number}")
+            for kind, number, ip in sorted(found)
+        ]
+
+    def _terminals(self):
+        with self._lock:
+            loaded = self._source is not None
+        if not loaded:
+            # Реестр загружается при первом обращении, если load() еще не вызывался
+            self.load()
+        return self._by_ip
+
+    def get(self, ip):
+        """Терминал по IP или None (неизвестный терминал)"""
+        return self._terminals().get(ip)
+
+    def reject(self, ip):
+        """Учесть событие от неизвестного терминала"""
+        with self._lock:
+            self._rejected += 1
+        print(f"⛔ Событие от неизвестного терминала {ip} отклонено")
+
+    def all(self):
+        return list(self._terminals().values())
+
+    def entries(self):
+        return [terminal for terminal in self.all() if terminal.type == "entry"]
+
+    def exits(self):
+        return [terminal for terminal in self.all() if terminal.type == "exit"]
+
+    def sdk_terminals(self):
+        """Терминалы, к которым подключаемся через SDK"""
+        return [terminal for terminal in self.all() if terminal.sdk]
+
+    def stats(self):
+        terminals = self.all()
+        with self._lock:
+            return {
+                'source': self._source,
+                'terminals': len(terminals),
+                'entry': sum(1 for terminal in terminals if terminal.type == "entry"),
+                'exit': sum(1 for terminal in terminals if terminal.type == "exit"),
+                'unknown_rejected': self._rejected,
+            }
+
+
+# Глобальный экземпляр реестра
+terminal_registry = TerminalRegistry()
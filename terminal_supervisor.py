@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Состояния сессии терминала
+STATE_CONNECTING = "connecting"
+STATE_UP = "up"
+STATE_DOWN = "down"
+
+
+class _Terminal:
+    """Состояние сессии одного терминала"""
+
+    def __init__(self, terminal_ip):
+        self.terminal_ip = terminal_ip
+        self.state = STATE_CONNECTING
+        self.user_id = None
+        self.since = datetime.now()
+        self.failures = 0  # Неудачных подключений подряд
+        self.next_action = 0.0  # monotonic: следующая проверка (up) или попытка подключения (down)
+        self.down_at = None  # monotonic: момент обнаружения отказа
+        self.in_flight = False
+        self.reconnects = 0
+        self.last_reconnect_ms = None
+        self.last_check_ms = None
+        self.last_error = None
+
+
+class TerminalSupervisor:
+    """
+    Наблюдение за сессиями SDK терминалов с автоматическим переподключением
+
+    Фоновый поток периодически (TERMINAL_CHECK_INTERVAL сек) проверяет каждую
+    активную сессию дешевым вызовом SDK. Потерянная сессия убирается из
+    terminal_connections, терминал переподключается с экспоненциальной
+    задержкой (TERMINAL_RECONNECT_BASE .. TERMINAL_RECONNECT_MAX сек) и
+    случайным разбросом, чтобы терминалы после сбоя сети не подключались разом.
+    Запись terminal_connections заменяется одним присваиванием - читатели видят
+    либо старую, либо новую сессию.
+
+    Args:
+        login: функция (terminal_ip) -> user_id (< 0 - ошибка подключения)
+        logout: функция (terminal_ip, user_id), закрывающая старую сессию
+        check: функция (terminal_ip, user_id) -> bool, проверка сессии
+        connections: словарь terminal_ip -> user_id активных сессий
+    """
+
+    def __init__(self, login, logout, check, connections, interval=None,
+                 backoff_base=None, backoff_max=None, workers=None):
+        self.login = login
+        self.logout = logout
+        self.check = check
+        self.connections = connections
+        self.interval = interval or float(os.getenv("TERMINAL_CHECK_INTERVAL", 30))
+        self.backoff_base = backoff_base or float(os.getenv("TERMINAL_RECONNECT_BASE", 2))
+        self.backoff_max = backoff_max or float(os.getenv("TERMINAL_RECONNECT_MAX", 300))
+        self.workers = workers or int(os.getenv("TERMINAL_SUPERVISOR_WORKERS", 4))
+
+        self._lock = threading.Lock()
+        self._terminals = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    # ---------- Регистрация ----------
+
+    def register(self, terminal_ip):
+        """Добавить терминал под наблюдение (первое подключение выполняет вызывающий)"""
+        with self._lock:
+            if terminal_ip not in self._terminals:
+                self._terminals[terminal_ip] = _Terminal(terminal_ip)
+
+    def attached(self, terminal_ip, user_id, seconds=None):
+        """Терминал подключен (при запуске или после переподключения)"""
+        with self._lock:
+            terminal = self._terminals.setdefault(terminal_ip, _Terminal(terminal_ip))
+            old_user_id = terminal.user_id
+            terminal.state = STATE_UP
+            terminal.user_id = user_id
+            terminal.since = datetime.now()
+            terminal.failures = 0
+            terminal.last_error = None
+            terminal.next_action = time.monotonic() + self.interval
+            if seconds is not None:
+                terminal.last_reconnect_ms = round(seconds * 1000, 3)
+            # Атомарная замена сессии для читателей terminal_connections
+            self.connections[terminal_ip] = user_id
+
+        if old_user_id is not None and old_user_id != user_id:
+            self.logout(terminal_ip, old_user_id)
+
+    def failed(self, terminal_ip, error=None):
+        """Подключение не удалось - следующая попытка с экспоненциальной задержкой"""
+        with self._lock:
+            terminal = self._terminals.setdefault(terminal_ip, _Terminal(terminal_ip))
+            if terminal.state != STATE_DOWN:
+                terminal.state = STATE_DOWN
+                terminal.since = datetime.now()
+                terminal.down_at = time.monotonic()
+            terminal.failures += 1
+            terminal.last_error = error
+            terminal.next_action = time.monotonic() + self._backoff(terminal.failures)
+
+    def _backoff(self, failures):
+        """Задержка перед попыткой: base * 2^(n-1), не более max, разброс 50-100%"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(failures - 1, 0)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # ---------- Фоновый поток ----------
+
+    def start(self):
+        """Запуск потока наблюдения"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="terminal-supervisor")
+        self._thread = threading.Thread(target=self._run, name="terminal-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка наблюдения (сессии остаются открытыми)"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(5)
+        self._thread = None
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _run(self):
+        while not self._stop.wait(1):
+            now = time.monotonic()
+            due = []
+            with self._lock:
+                for terminal in self._terminals.values():
+                    if terminal.in_flight or terminal.state == STATE_CONNECTING:
+                        continue
+                    if now >= terminal.next_action:
+                        terminal.in_flight = True
+                        due.append((terminal.terminal_ip, terminal.state, terminal.user_id))
+
+            for terminal_ip, state, user_id in due:
+                task = self._check if state == STATE_UP else self._reconnect
+                try:
+                    self._executor.submit(task, terminal_ip, user_id)
+                except RuntimeError:
+                    # Пул остановлен (идет завершение работы)
+                    return
+
+    def _check(self, terminal_ip, user_id):
+        started = time.monotonic()
+        try:
+            alive = self.check(terminal_ip, user_id)
+        except Exception as e:
+            print(f"⚠️  Ошибка проверки сессии {terminal_ip}: {e}")
+            alive = False
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            terminal = self._terminals[terminal_ip]
+            terminal.in_flight = False
+            terminal.last_check_ms = round(elapsed * 1000, 3)
+            if terminal.user_id != user_id:
+                return  # Сессия уже заменена
+            if alive:
+                terminal.next_action = time.monotonic() + self.interval
+                return
+            terminal.state = STATE_DOWN
+            terminal.since = datetime.now()
+            terminal.down_at = time.monotonic()
+            terminal.user_id = None
+            terminal.failures = 0
+            terminal.next_action = 0.0  # Первая попытка переподключения - сразу
+            if self.connections.get(terminal_ip) == user_id:
+                del self.connections[terminal_ip]
+
+        print(f"🔌 Сессия терминала {terminal_ip} потеряна - переподключение...")
+        self.logout(terminal_ip, user_id)
+
+    def _reconnect(self, terminal_ip, _):
+        started = time.monotonic()
+        try:
+            user_id = self.login(terminal_ip)
+            error = None if user_id >= 0 else "login failed"
+        except Exception as e:
+            user_id, error = -1, str(e)
+
+        if user_id < 0:
+            with self._lock:
+                self._terminals[terminal_ip].in_flight = False
+            self.failed(terminal_ip, error)
+            return
+
+        with self._lock:
+            terminal = self._terminals[terminal_ip]
+            terminal.in_flight = False
+            terminal.reconnects += 1
+            down_at = terminal.down_at
+        # Задержка восстановления - от обнаружения отказа до новой сессии
+        self.attached(terminal_ip, user_id, time.monotonic() - (down_at or started))
+        print(f"✅ Терминал {terminal_ip} переподключен (user_id: {user_id})")
+
+    # ---------- Метрики ----------
+
+    def stats(self):
+        """Состояние сессий терминалов"""
+        now = time.monotonic()
+        with self._lock:
+            terminals = {
+                terminal.terminal_ip: {
+                    'state': terminal.state,
+                    'user_id': terminal.user_id,
+                    'since': terminal.since.strftime("%Y-%m-%d %H:%M:%S"),
+                    'failures': terminal.failures,
+                    'next_attempt_in': round(max(0.0, terminal.next_action - now), 1)
+                    if terminal.state == STATE_DOWN else None,
+                    'reconnects': terminal.reconnects,
+                    'last_reconnect_ms': terminal.last_reconnect_ms,
+                    'last_check_ms': terminal.last_check_ms,
+                    'last_error': terminal.last_error,
+                }
+                for terminal in self._terminals.values()
+            }
+        return {
+            'up': sum(1 for t in terminals.values() if t['state'] == STATE_UP),
+            'down': sum(1 for t in terminals.values() if t['state'] == STATE_DOWN),
+            'connecting': sum(1 for t in terminals.values() if t['state'] == STATE_CONNECTING),
+            'terminals': terminals,
+        }
@@ -169,14 +169,23 @@ def check_status():
     print("="*60)
 
     try:
-        response = requests.get(f"{SERVER_URL}/status")
-        if response.status_code == 200:
+        # Список людей внутри /status отдает только по запросу и постранично
+        users_inside = []
+        offset = 0
+        while offset is not None:
+            response = requests.get(f"{SERVER_URL}/status", params={"users": "true", "offset": offset})
+            if response.status_code != 200:
+                break
             data = response.json()
+            users_inside.extend(data.get('users_inside', []))
+            offset = data.get('next_offset')
+
+        if response.status_code == 200:
             print(f"\n📊 Пользователей внутри: {data['users_inside_count']}")
 
-            if data['users_inside']:
+            if users_inside:
                 print("\n👥 Пользователи внутри:")
-                for user in data['users_inside']:
+                for user in users_inside:
                     print(f"   - {user['name']} (терминал: {user['last_terminal']}, время: {user['last_event']})")
             else:
                 print("\n✅ Все снаружи")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class StripedLocks:
+    """
+    Блокировки по пользователю с фиксированным числом полос (lock striping)
+
+    Имя пользователя отображается на одну из USER_LOCK_STRIPES блокировок:
+    события одного пользователя выполняются строго по очереди, события разных
+    пользователей - параллельно (кроме редких совпадений полос). Память не
+    растет с числом пользователей.
+    """
+
+    def __init__(self, stripes=None):
+        self.stripes = stripes or int(os.getenv("USER_LOCK_STRIPES", 256))
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+
+        # Метрики конкуренции
+        self._stats_lock = threading.Lock()
+        self._acquisitions = 0
+        self._contended = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def stripe_for(self, key):
+        """Номер полосы для ключа (стабильный хэш)"""
+        return zlib.crc32(key.encode("utf-8")) % self.stripes
+
+    @contextmanager
+    def hold(self, key):
+        """Удерживать блокировку полосы ключа на время блока with"""
+        lock = self._locks[self.stripe_for(key)]
+        waited = 0.0
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            started = time.monotonic()
+            lock.acquire()
+            waited = time.monotonic() - started
+
+        with self._stats_lock:
+            self._acquisitions += 1
+            if contended:
+                self._contended += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self):
+        """Счетчики конкуренции за блокировки"""
+        with self._stats_lock:
+            return {
+                'stripes': self.stripes,
+                'acquisitions': self._acquisitions,
+                'contended': self._contended,
+                'avg_wait_ms': round(self._total_wait / self._contended * 1000, 3) if self._contended else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 3),
+            }
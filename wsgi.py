@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Точка входа WSGI для промышленного запуска
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from main import create_app
+
+app = create_app()